@@ -14,6 +14,28 @@ class Settings(BaseSettings):
     # Used only by scripts/translate_chapters_deepseek.py (offline tooling).
     deepseek_api_key: Optional[str] = None
     deepseek_model: str = "deepseek-chat"
+    # Byte budget of the in-process chapter-text LRU (app/services/chapter_text_cache.py).
+    chapter_text_cache_mb: int = 64
+    # Disk tier below it; empty disables. Mount a volume here to survive deploys.
+    # The size is the total: with WEB_CONCURRENCY > 1 each worker gets its share.
+    chapter_text_disk_cache_dir: str = "/tmp/chapter-text-cache"
+    chapter_text_disk_cache_mb: int = 1024
+    # Threads for PostgREST queries issued from async code (app/database.py).
+    db_executor_workers: int = 16
+    # Log every PostgREST query still made on the event-loop thread.
+    db_blocking_guard: bool = False
+    # bcrypt worker processes for login/signup (app/services/password_hasher.py)
+    # and how many calls may wait for one before answering 503.
+    password_hash_workers: int = 2
+    password_hash_queue: int = 16
+    # uvicorn worker processes (uvicorn reads the same variable). Each worker
+    # has its own DB executor and bcrypt pool, so those multiply with it.
+    web_concurrency: int = 1
+    # Locks and cache invalidation between workers (app/services/coordination.py):
+    # "memory" (one worker), "sqlite" (workers on one host), or "auto" — sqlite
+    # whenever WEB_CONCURRENCY > 1.
+    coordination_backend: str = "auto"
+    coordination_sqlite_path: str = "/tmp/truyen-coordination/coordination.sqlite3"
 
     @property
     def cors_origins(self) -> list[str]:
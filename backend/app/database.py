@@ -1,11 +1,204 @@
+"""Supabase client plus the async data-access helpers.
+
+The supabase-py client is synchronous: every .execute() is a blocking HTTP
+round-trip. Called from an `async def` handler it stalls the event loop —
+and with it every in-flight request on our single uvicorn worker — for the
+whole round-trip. Async code runs queries through execute() / run() below,
+which hand them to a dedicated, bounded thread pool:
+
+    rows = (await database.execute(db.table("chapters").select("id").eq(...))).data
+    await database.run(_several_queries, book_id)
+
+Dedicated rather than asyncio.to_thread: the default pool is also where
+FastAPI runs every sync `def` handler and where CPU work (EPUB parsing,
+encoding) goes, so a burst of either used to queue queries behind it — and
+a burst of queries could starve it. Bounded (DB_EXECUTOR_WORKERS) so a
+fan-out of queries queues here instead of opening dozens of connections to
+PostgREST at once.
+
+Set DB_BLOCKING_GUARD=1 (dev/staging) to log every query still executed on
+the event-loop thread, with the call site, once per site.
+"""
+import asyncio
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator, TypeVar
+
+import httpx
 from supabase import create_client, Client
 from app.config import settings
+from app.services import circuit_breaker
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
 
 _client: Client | None = None
+_client_lock = threading.Lock()
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.db_executor_workers, thread_name_prefix="db"
+)
+
+# Answers that mean PostgREST (or the proxy in front of it) is struggling,
+# as opposed to rejecting this particular query. 520-527 are Cloudflare's.
+_UNHEALTHY_STATUSES = frozenset({408, 429, 500, 502, 503, 504, 520, 521, 522, 523, 524, 527})
+
+# postgrest-py retries GETs answered 503/520 by itself (up to 3 times, sleeping
+# 1s, 2s, 4s on the calling thread). Those retries draw on this budget; once
+# it is spent the retry fails fast with RetryBudgetExhausted instead.
+_retry_budget = circuit_breaker.RetryBudget(ratio=0.1, per_second=1.0, burst=10.0)
+
+
+def _breaker_for(request: httpx.Request) -> circuit_breaker.CircuitBreaker:
+    """postgrest:{table or rpc/fn}:{read|write} — a slow table or a failing
+    write path shouldn't take every read down with it."""
+    parts = request.url.path.split("/rest/v1/", 1)[-1].split("/")
+    target = ":".join(parts[:2]) if parts[0] == "rpc" else parts[0]
+    kind = "read" if request.method in ("GET", "HEAD") else "write"
+    return circuit_breaker.get(f"postgrest:{target}:{kind}")
+
+
+def _is_failure(exc: BaseException) -> bool:
+    return isinstance(exc, httpx.TransportError)
+
+
+class _BreakerTransport(httpx.BaseTransport):
+    """Wraps the PostgREST session's transport so every query goes through a
+    circuit breaker — there is no single call site to wrap, .execute() is
+    called all over the routers."""
+
+    def __init__(self, inner: httpx.BaseTransport) -> None:
+        self._inner = inner
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if settings.db_blocking_guard:
+            _check_blocking(request)
+        if request.headers.get("X-Retry-Count", "0") != "0":
+            if not _retry_budget.withdraw():
+                raise circuit_breaker.RetryBudgetExhausted("postgrest retry budget", 1.0)
+        else:
+            _retry_budget.deposit()
+        with _breaker_for(request).guard(_is_failure) as call:
+            response = self._inner.handle_request(request)
+            call.failed = response.status_code in _UNHEALTHY_STATUSES
+            return response
+
+    def close(self) -> None:
+        self._inner.close()
+
+
+_reported_sites: set[tuple[str, int]] = set()
+
+
+def _check_blocking(request: httpx.Request) -> None:
+    """Debug guard: log a query made on the event-loop thread (it blocks
+    every other request for its whole round-trip). Once per call site."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return  # worker thread — where queries belong
+    stack = traceback.extract_stack()
+    # The innermost frame outside the libraries is the call site to fix.
+    site = next(
+        f for f in reversed(stack)
+        if "site-packages" not in f.filename and f.filename != __file__
+    )
+    key = (site.filename, site.lineno)
+    if key in _reported_sites:
+        return
+    _reported_sites.add(key)
+    logger.warning(
+        "Blocking PostgREST call on the event loop: %s %s from %s:%d (%s) — "
+        "use database.execute()/run()",
+        request.method, request.url.path, site.filename, site.lineno, site.name,
+    )
 
 
 def get_client() -> Client:
     global _client
     if _client is None:
-        _client = create_client(settings.supabase_url, settings.supabase_service_key)
+        # Worker threads race here at startup now that queries run on the
+        # DB executor.
+        with _client_lock:
+            if _client is None:
+                client = create_client(settings.supabase_url, settings.supabase_service_key)
+                session = client.postgrest.session
+                session._transport = _BreakerTransport(session._transport)
+                _client = client
     return _client
+
+
+async def execute(query: Any) -> Any:
+    """`await execute(builder)` — the builder's .execute() on the DB
+    executor. Building the query is pure Python and stays on the loop."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, query.execute)
+
+
+async def run(fn: Callable[..., T], *args: Any) -> T:
+    """Run a blocking callable on the DB executor — for a sequence of
+    queries that belong together, or a helper that issues its own."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+# PostgREST's max_rows cap (Supabase's default): no response carries more rows
+# than this, whatever .limit() or .range() asked for — the rest is silently cut.
+POSTGREST_MAX_ROWS = 1000
+# Chapters per keyset page, comfortably under the cap.
+CHAPTER_PAGE_SIZE = 500
+
+
+def _chapter_page_query(book_id: str, columns: str, after: int | None, page_size: int) -> Any:
+    if "chapter_index" not in columns.split(","):
+        columns += ",chapter_index"
+    query = get_client().table("chapters").select(columns).eq("book_id", book_id)
+    if after is not None:
+        query = query.gt("chapter_index", after)
+    return query.order("chapter_index").limit(page_size)
+
+
+def iter_chapter_pages(
+    book_id: str, columns: str, page_size: int = CHAPTER_PAGE_SIZE
+) -> Iterator[list[dict]]:
+    """A book's chapters in reading order, one page at a time.
+
+    Keyset pagination (chapter_index > last seen) rather than .range(): an
+    OFFSET makes Postgres walk and discard every earlier row, so paging a
+    10,000-chapter book cost O(n²) row visits; each keyset page is one index
+    seek. chapter_index is added to `columns` if missing (it is the cursor)."""
+    after: int | None = None
+    while True:
+        batch = _chapter_page_query(book_id, columns, after, page_size).execute().data or []
+        if batch:
+            yield batch
+        if len(batch) < page_size:
+            return
+        after = batch[-1]["chapter_index"]
+
+
+async def chapter_pages(
+    book_id: str, columns: str, page_size: int = CHAPTER_PAGE_SIZE
+) -> AsyncIterator[list[dict]]:
+    """iter_chapter_pages for async code — each page on the DB executor."""
+    after: int | None = None
+    while True:
+        batch = (await execute(_chapter_page_query(book_id, columns, after, page_size))).data or []
+        if batch:
+            yield batch
+        if len(batch) < page_size:
+            return
+        after = batch[-1]["chapter_index"]
+
+
+async def fetch_all_chapters(book_id: str, columns: str) -> list[dict]:
+    return [row async for batch in chapter_pages(book_id, columns) for row in batch]
+
+
+def shutdown() -> None:
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+
+def retry_budget_stats() -> dict:
+    return _retry_budget.stats()
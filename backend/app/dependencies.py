@@ -1,49 +1,116 @@
-import asyncio
+import hashlib
+import threading
 import time
+from collections import OrderedDict
 from typing import Optional
 
 from fastapi import Header, HTTPException
 from jose import JWTError, jwt
 
 from app.config import settings
+from app import database
 from app.database import get_client
+from app.services import coordination
 
 _ALGORITHM = "HS256"
 
+
+class _ExpiringLRU:
+    """Bounded LRU whose entries each carry their own expiry.
+
+    Called from the event loop (hits) and from DB executor threads (puts
+    after a lookup), hence the lock. At capacity the least recently used
+    entry goes — not the whole cache, which used to turn one busy minute
+    into a stampede of lookups for every active user at once.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[object, tuple[object, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, count_miss: bool = True):
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is not None and time.monotonic() < hit[1]:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return hit[0]
+            if hit is not None:
+                del self._data[key]
+            if count_miss:
+                self.misses += 1
+            return None
+
+    def put(self, key, value, ttl_seconds: float) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl_seconds)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+            }
+
+
 # Role/approval are looked up on EVERY authenticated request, and each lookup
 # is a full backend↔Supabase round-trip that runs before the handler does any
 # real work. Caching them in-process removes 1–2 round-trips of latency from
-# every request. Single uvicorn worker (same assumption as the TTS queue and
-# the _strip_running sets), so decide_approval can invalidate this cache
-# directly; the TTL only exists to pick up role/approval edits made straight
-# in the database.
+# every request. decide_approval invalidates through invalidate_user_caches,
+# which also reaches the other uvicorn workers; the TTL only exists to pick
+# up role/approval edits made straight in the database.
 _USER_CACHE_TTL_SECONDS = 300.0
-_role_cache: dict[str, tuple[str, float]] = {}
-_approval_cache: dict[str, tuple[str, float]] = {}
+_USER_CACHE_MAX_ENTRIES = 10_000
+_role_cache = _ExpiringLRU(_USER_CACHE_MAX_ENTRIES)
+_approval_cache = _ExpiringLRU(_USER_CACHE_MAX_ENTRIES)
 
+# Verified JWT claims, keyed by a digest of the token so the cache never holds
+# a usable credential. The same bearer token comes back thousands of times an
+# hour (the 5 s progress sync, the Android app fetching chapter text itself),
+# and each one used to be decoded and HMAC-checked from scratch. An entry
+# lives until the token's own exp — never longer than decoding would have
+# accepted it — and only successfully verified tokens are stored.
+_CLAIMS_CACHE_MAX_ENTRIES = 10_000
+_claims_cache = _ExpiringLRU(_CLAIMS_CACHE_MAX_ENTRIES)
 
-def _cache_get(cache: dict[str, tuple[str, float]], key: str) -> Optional[str]:
-    hit = cache.get(key)
-    if hit is None:
-        return None
-    value, stored_at = hit
-    if time.monotonic() - stored_at >= _USER_CACHE_TTL_SECONDS:
-        cache.pop(key, None)
-        return None
-    return value
 
+def _cache_get(cache: _ExpiringLRU, key: str, count_miss: bool = True) -> Optional[str]:
+    return cache.get(key, count_miss)
 
-def _cache_put(cache: dict[str, tuple[str, float]], key: str, value: str) -> None:
-    # Hard bound so months of uptime can't grow this without limit.
-    if len(cache) > 10_000:
-        cache.clear()
-    cache[key] = (value, time.monotonic())
+
+def _cache_put(cache: _ExpiringLRU, key: str, value: str) -> None:
+    cache.put(key, value, _USER_CACHE_TTL_SECONDS)
 
 
 def invalidate_user_caches(user_id: str) -> None:
     """Drop cached role/approval for a user after an admin changes them."""
-    _role_cache.pop(user_id, None)
-    _approval_cache.pop(user_id, None)
+    _forget_user(user_id)
+    coordination.broadcast("user.invalidate", user_id)
+
+
+def _forget_user(user_id: str) -> None:
+    _role_cache.pop(user_id)
+    _approval_cache.pop(user_id)
+
+
+coordination.subscribe("user.invalidate", _forget_user)
 
 
 def _lookup_role(user_id: str) -> str:
@@ -115,6 +182,23 @@ async def get_current_user(authorization: str = Header(...)) -> dict:
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Invalid authorization header")
     token = authorization[7:]
+    user_id, email = _verified_claims(token)
+    # Cache hit is a plain dict read (fine on the event loop); a miss does
+    # a real DB round-trip, which the DB executor keeps off the loop — the
+    # sync Supabase client would otherwise stall every in-flight request.
+    # (A miss here is counted once, by _lookup_role.)
+    role = _cache_get(_role_cache, user_id, count_miss=False)
+    if role is None:
+        role = await database.run(_lookup_role, user_id)
+    return {"id": user_id, "email": email, "role": role}
+
+
+def _verified_claims(token: str) -> tuple[str, str]:
+    """(user_id, email) from a valid token; raises 401 otherwise."""
+    key = hashlib.sha256(token.encode()).digest()
+    cached = _claims_cache.get(key)
+    if cached is not None:
+        return cached
     try:
         # leeway (seconds) tolerates minor clock skew between this API server and
         # the issuer/client so a token that's a few seconds past exp by the
@@ -126,19 +210,30 @@ async def get_current_user(authorization: str = Header(...)) -> dict:
             algorithms=[_ALGORITHM],
             options={"leeway": 30},
         )
-        user_id: str = payload.get("sub")
-        email: str = payload.get("email", "")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        # Cache hit is a plain dict read (fine on the event loop); a miss does
-        # a real DB round-trip, which to_thread keeps off the loop — the sync
-        # Supabase client would otherwise stall every in-flight request.
-        role = _cache_get(_role_cache, user_id)
-        if role is None:
-            role = await asyncio.to_thread(_lookup_role, user_id)
-        return {"id": user_id, "email": email, "role": role}
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
+    user_id: str = payload.get("sub")
+    email: str = payload.get("email", "")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    claims = (user_id, email)
+    # Cache until exp only: inside the leeway window the token still decodes,
+    # it just isn't worth keeping. No exp (not something Supabase issues)
+    # means no caching.
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)):
+        remaining = exp - time.time()
+        if remaining > 0:
+            _claims_cache.put(key, claims, remaining)
+    return claims
+
+
+def cache_stats() -> dict:
+    return {
+        "jwt_claims": _claims_cache.stats(),
+        "role": _role_cache.stats(),
+        "approval": _approval_cache.stats(),
+    }
 
 
 async def get_admin_user(authorization: str = Header(...)) -> dict:
@@ -164,9 +259,9 @@ async def get_approved_user(
     user = await get_current_user(authorization)
     if user.get("role") == "admin":
         return user
-    status = _cache_get(_approval_cache, user["id"])
+    status = _cache_get(_approval_cache, user["id"], count_miss=False)
     if status is None:
-        status = await asyncio.to_thread(lookup_approval, user["id"])
+        status = await database.run(lookup_approval, user["id"])
     if status == "pending":
         raise HTTPException(status_code=403, detail=PENDING_MESSAGE)
     if status != "approved":
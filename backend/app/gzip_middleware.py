@@ -30,6 +30,11 @@ from starlette.types import ASGIApp, Message, Receive, Scope, Send
 # else compressible (JSON, text) flows through normally.
 _SKIP_CONTENT_TYPES = ("text/event-stream",)
 
+# Streamed record-per-chunk bodies (the NDJSON batch chapter-text endpoint):
+# still compressed, but sync-flushed after every chunk so the client receives
+# each record as it is produced instead of when zlib's buffer happens to fill.
+_FLUSH_CONTENT_TYPES = ("application/x-ndjson",)
+
 
 class SmartGZipMiddleware:
     def __init__(self, app: ASGIApp, minimum_size: int = 512, compresslevel: int = 6) -> None:
@@ -56,6 +61,7 @@ class _Responder:
         self.initial_message: Message = {}
         self.started = False
         self.passthrough = False
+        self.flush_chunks = False
         self.buffer = io.BytesIO()
         self.gzip_file = gzip.GzipFile(mode="wb", fileobj=self.buffer, compresslevel=compresslevel)
 
@@ -76,6 +82,7 @@ class _Responder:
                 "content-encoding" in headers
                 or any(ct.startswith(p) for p in _SKIP_CONTENT_TYPES)
             )
+            self.flush_chunks = any(ct.startswith(p) for p in _FLUSH_CONTENT_TYPES)
             return
 
         if mtype != "http.response.body":
@@ -118,6 +125,8 @@ class _Responder:
                 headers.add_vary_header("Accept-Encoding")
                 del headers["Content-Length"]
                 self.gzip_file.write(body)
+                if self.flush_chunks:
+                    self.gzip_file.flush()
                 message["body"] = self.buffer.getvalue()
                 self.buffer.seek(0)
                 self.buffer.truncate()
@@ -129,6 +138,8 @@ class _Responder:
         self.gzip_file.write(body)
         if not more_body:
             self.gzip_file.close()
+        elif self.flush_chunks:
+            self.gzip_file.flush()
         message["body"] = self.buffer.getvalue()
         self.buffer.seek(0)
         self.buffer.truncate()
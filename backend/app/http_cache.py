@@ -0,0 +1,74 @@
+"""Conditional GET helpers (ETag / If-None-Match → 304).
+
+The Android app and the PWA re-fetch chapter text, chapter lists and the
+catalog constantly just to learn nothing changed. Every row already carries a
+version (chapters.updated_at), so each endpoint derives a strong ETag from a
+cheap metadata lookup and answers 304 before doing the expensive part — a
+Storage download or a multi-thousand-row select — and before sending a body
+over cellular.
+
+The ETag folds in whether the client accepts gzip: a compressed and an
+uncompressed body are different representations and must not share a strong
+validator.
+"""
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+# Clients may keep the body but must revalidate before every reuse. "private"
+# for anything behind the approval gate so no shared cache stores it.
+REVALIDATE_PUBLIC = "no-cache"
+REVALIDATE_PRIVATE = "private, no-cache"
+
+
+def accepts_gzip(request: Request) -> bool:
+    return "gzip" in request.headers.get("accept-encoding", "")
+
+
+def make_etag(request: Request, *parts: object) -> str:
+    """Strong ETag over `parts` (versions, page params, …) + the encoding."""
+    raw = "|".join(str(p) for p in parts)
+    if accepts_gzip(request):
+        raw += "|gz"
+    return '"' + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:24] + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match uses weak comparison (RFC 9110 §13.1.2), so a W/ prefix
+    on the client's copy still matches."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def validator_headers(etag: str, cache_control: str) -> dict:
+    return {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers=validator_headers(etag, cache_control))
+
+
+def conditional(
+    request: Request, cache_control: str, *parts: object
+) -> tuple[str, Optional[Response]]:
+    """(etag, 304 response or None). The usual handler preamble:
+
+        etag, unchanged = http_cache.conditional(request, REVALIDATE_PUBLIC, v)
+        if unchanged:
+            return unchanged
+    """
+    etag = make_etag(request, *parts)
+    if etag_matches(request, etag):
+        return etag, not_modified(etag, cache_control)
+    return etag, None
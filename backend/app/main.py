@@ -2,15 +2,29 @@ import logging
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
 
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
 from app.config import settings
 from app.database import get_client
+from app.dependencies import cache_stats as auth_cache_stats, get_admin_user
 from app.gzip_middleware import SmartGZipMiddleware
 from app.routers import auth, books, chapters, progress, upload, tts, genres, stats
 from app.routers import settings as settings_router
+from app import database
+from app.services import (
+    catalog_cache,
+    chapter_pack,
+    chapter_text_cache,
+    circuit_breaker,
+    coordination,
+    epub_parser,
+    password_hasher,
+    progress_buffer,
+    read_ahead,
+    storage_service,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,7 +33,9 @@ logger = logging.getLogger(__name__)
 # it. If the process dies mid-parse (deploy / crash / OOM), that task is lost
 # and the book is stuck in 'parsing' forever. Anything older than this on
 # startup is assumed orphaned — a real parse never takes this long (the slow
-# TTS phase runs under status='converting', not 'parsing').
+# TTS phase runs under status='converting', not 'parsing'). With several
+# workers one of them restarting must not fail a parse another is still
+# running, so books whose parse lease is live are skipped.
 STUCK_PARSING_MINUTES = 30
 
 
@@ -32,6 +48,19 @@ def _recover_stuck_parsing_books() -> None:
         cutoff = (
             datetime.now(timezone.utc) - timedelta(minutes=STUCK_PARSING_MINUTES)
         ).isoformat()
+        stuck = (
+            db.table("books")
+            .select("id")
+            .eq("status", "parsing")
+            .lt("created_at", cutoff)
+            .execute()
+        )
+        orphaned = [
+            row["id"] for row in stuck.data or []
+            if coordination.holder(epub_parser.parse_lease_name(row["id"])) is None
+        ]
+        if not orphaned:
+            return
         res = (
             db.table("books")
             .update({
@@ -41,8 +70,8 @@ def _recover_stuck_parsing_books() -> None:
                     'Bấm "Phân tích lại" để thử lại từ file gốc.'
                 ),
             })
+            .in_("id", orphaned)
             .eq("status", "parsing")
-            .lt("created_at", cutoff)
             .execute()
         )
         n = len(res.data or [])
@@ -58,11 +87,22 @@ def _recover_stuck_parsing_books() -> None:
 async def lifespan(app: FastAPI):
     # Startup: recover orphaned parses. There is no TTS worker -- audio is
     # synthesized on demand for playback and never stored.
-    _recover_stuck_parsing_books()
+    await coordination.start()
+    await database.run(_recover_stuck_parsing_books)
+    await chapter_text_cache.start()
+    progress_buffer.start()
+    password_hasher.start()
     logger.info("Application started")
     yield
     # Shutdown
     logger.info("Application shutting down")
+    # Before the DB executor goes away: buffered progress saves exist nowhere else.
+    await progress_buffer.stop()
+    await chapter_text_cache.stop()
+    await coordination.stop()
+    password_hasher.shutdown()
+    await storage_service.aclose()
+    database.shutdown()
 
 
 app = FastAPI(
@@ -88,21 +128,41 @@ app.add_middleware(
 app.add_middleware(SmartGZipMiddleware, minimum_size=512)
 
 
+def _cors_error_headers(request: Request) -> dict:
+    # Always echo the requesting origin back so Capacitor WebViews (https://localhost)
+    # can read the error body even when the origin isn't in the configured allow-list.
+    # An error response is never cacheable, so reflecting the origin is safe here.
+    origin = request.headers.get("origin", "")
+    if not origin:
+        return {}
+    return {
+        "Access-Control-Allow-Origin": origin,
+        "Access-Control-Allow-Credentials": "true",
+    }
+
+
+@app.exception_handler(circuit_breaker.CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: circuit_breaker.CircuitOpenError):
+    # Supabase is failing and the call was never made: a retryable 503, not
+    # an opaque 500 (and no stack trace per request while it lasts).
+    logger.warning("%s %s: %s", request.method, request.url.path, exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Máy chủ dữ liệu đang quá tải — thử lại sau ít phút"},
+        headers={
+            **_cors_error_headers(request),
+            "Retry-After": str(max(1, round(exc.retry_after))),
+        },
+    )
+
+
 @app.exception_handler(Exception)
 async def unhandled_exception_handler(request: Request, exc: Exception):
     logger.exception("Unhandled error: %s", exc)
-    origin = request.headers.get("origin", "")
-    headers = {}
-    # Always echo the requesting origin back so Capacitor WebViews (https://localhost)
-    # can read the error body even when the origin isn't in the configured allow-list.
-    # A 500 response is never cacheable, so reflecting the origin is safe here.
-    if origin:
-        headers["Access-Control-Allow-Origin"] = origin
-        headers["Access-Control-Allow-Credentials"] = "true"
     return JSONResponse(
         status_code=500,
         content={"detail": "Internal server error"},
-        headers=headers,
+        headers=_cors_error_headers(request),
     )
 
 app.include_router(auth.router)
@@ -119,3 +179,26 @@ app.include_router(stats.router)
 @app.get("/api/health")
 async def health():
     return {"status": "ok", "version": "1.0.0"}
+
+
+@app.get("/api/metrics")
+async def metrics(_admin: dict = Depends(get_admin_user)):
+    """Admin-only: in-process counters for tuning caches and limits. Per
+    process — each restart starts from zero."""
+    return {
+        "chapter_text_cache": chapter_text_cache.stats(),
+        "storage_single_flight": storage_service.single_flight_stats(),
+        "storage_scheduler": storage_service.scheduler_stats(),
+        "circuit_breakers": circuit_breaker.stats(),
+        "retry_budget": {
+            "storage": storage_service.retry_budget_stats(),
+            "postgrest": database.retry_budget_stats(),
+        },
+        "read_ahead": read_ahead.stats(),
+        "catalog": catalog_cache.stats(),
+        "progress_buffer": progress_buffer.stats(),
+        "password_hasher": password_hasher.stats(),
+        "auth_caches": auth_cache_stats(),
+        "coordination": coordination.stats(),
+        "chapter_pack": chapter_pack.stats(),
+    }
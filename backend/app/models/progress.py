@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class ProgressUpsert(BaseModel):
@@ -11,6 +11,10 @@ class ProgressUpsert(BaseModel):
     total_value: Optional[float] = None
 
 
+class ProgressBatchRequest(BaseModel):
+    book_ids: List[str] = Field(..., max_length=500)
+
+
 class ProgressResponse(BaseModel):
     id: str
     user_id: str
@@ -5,7 +5,6 @@ from datetime import datetime, timedelta, timezone
 
 from fastapi import APIRouter, Depends, HTTPException, Request
 from jose import jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel, EmailStr
 
 from app.config import settings
@@ -19,12 +18,14 @@ from app.dependencies import (
     PENDING_MESSAGE,
     REJECTED_MESSAGE,
 )
+from app.services import password_hasher
 
 # Every handler in this router is deliberately sync (`def`, not `async def`):
 # FastAPI runs sync handlers on its worker thread pool, which keeps the
-# blocking Supabase client AND bcrypt (~100–300ms of pure CPU per hash/verify)
-# off the single worker's event loop. As `async def`, one login attempt froze
-# every in-flight request for the duration of the bcrypt check.
+# blocking Supabase client off the single worker's event loop. bcrypt
+# (~100–300ms of pure CPU per hash/verify) goes one step further, to the
+# password_hasher process pool, so a login burst can't hold the GIL and the
+# shared threads that every other sync endpoint runs on.
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 logger = logging.getLogger(__name__)
@@ -33,7 +34,13 @@ _ALGORITHM = "HS256"
 _ACCESS_TOKEN_EXPIRE_MINUTES = 60
 _REFRESH_TOKEN_EXPIRE_DAYS = 90
 
-_pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def _hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Máy chủ đang bận xử lý đăng nhập — thử lại sau giây lát",
+        headers={"Retry-After": str(password_hasher.HasherBusy.retry_after)},
+    )
 
 
 class AuthRequest(BaseModel):
@@ -143,7 +150,10 @@ def signup(body: AuthRequest, request: Request):
             raise HTTPException(status_code=400, detail="Email đã được đăng ký")
 
         user_id = str(uuid.uuid4())
-        password_hash = _pwd_context.hash(body.password)
+        try:
+            password_hash = password_hasher.hash_password(body.password)
+        except password_hasher.HasherBusy:
+            raise _hasher_busy()
         # approval_status is left to the column default ('pending') so this
         # insert still works on a database where the migration hasn't been run
         # yet — one less way for a deploy to take signups down.
@@ -212,7 +222,13 @@ def login(body: AuthRequest):
         
         user_data = result.data
         password_hash = user_data.get("password_hash")
-        if not password_hash or not _pwd_context.verify(body.password, password_hash):
+        if not password_hash:
+            raise HTTPException(status_code=401, detail="Email hoặc mật khẩu không đúng")
+        try:
+            verified = password_hasher.verify_password(body.password, password_hash)
+        except password_hasher.HasherBusy:
+            raise _hasher_busy()
+        if not verified:
             raise HTTPException(status_code=401, detail="Email hoặc mật khẩu không đúng")
 
         user_id = user_data["id"]
@@ -1,17 +1,29 @@
+import base64
 import json
 import logging
 import re
+import uuid
+from datetime import datetime, timedelta, timezone
 
-from fastapi import APIRouter, HTTPException, Query, Depends, Response, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Query, Depends, Request, Response, UploadFile, File, Form
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 
+from app import http_cache
 from app.config import settings
+from app import database
 from app.database import get_client
 from app.dependencies import get_admin_user, get_approved_user
 from app.models.book import BookResponse
 from app.models.chapter import ChapterResponse
-from app.services import image_service, storage_service, text_cleanup
+from app.services import (
+    catalog_cache,
+    coordination,
+    image_service,
+    progress_buffer,
+    storage_service,
+    text_cleanup,
+)
 
 router = APIRouter(prefix="/api/books", tags=["books"])
 logger = logging.getLogger(__name__)
@@ -37,11 +49,36 @@ _BOOK_SELECT = (
 # Read endpoints are sync (`def`) so FastAPI runs them on the worker thread
 # pool: the blocking Supabase client would otherwise stall the single uvicorn
 # worker's event loop for a full DB round-trip per call.
-@router.get("", response_model=List[BookResponse])
-def list_books():
+_BOOK_LIST = TypeAdapter(List[BookResponse])
+
+
+def _build_catalog() -> bytes:
     db = get_client()
     result = db.table("books").select(_BOOK_SELECT).order("created_at", desc=True).execute()
-    return _attach_genres(result.data)
+    return _BOOK_LIST.dump_json(_BOOK_LIST.validate_python(_attach_genres(result.data)))
+
+
+@router.get("", response_model=List[BookResponse])
+def list_books(request: Request):
+    # Served from catalog_cache: the select, genre flattening, validation and
+    # both serializations happen once per catalog change, not per home-page
+    # load. Books carry no updated_at (and genre edits never touch the row),
+    # so the validator is the catalog's content hash.
+    catalog = catalog_cache.get(_build_catalog)
+    etag, unchanged = http_cache.conditional(
+        request, http_cache.REVALIDATE_PUBLIC, catalog["version"]
+    )
+    if unchanged:
+        return unchanged
+    headers = http_cache.validator_headers(etag, http_cache.REVALIDATE_PUBLIC)
+    if http_cache.accepts_gzip(request):
+        # Content-Encoding makes SmartGZipMiddleware pass it through as-is.
+        return Response(
+            content=catalog["gzip"],
+            media_type="application/json",
+            headers={**headers, "Content-Encoding": "gzip"},
+        )
+    return Response(content=catalog["body"], media_type="application/json", headers=headers)
 
 
 @router.get("/{book_id}", response_model=BookResponse)
@@ -53,11 +90,118 @@ def get_book(book_id: str):
     return _attach_genres([result.data])[0]
 
 
+# Must match the prune interval in schema.sql (prune_chapter_deletions).
+CHAPTER_DELETIONS_RETENTION_DAYS = 30
+# updated_at is now() at transaction START, so a long write (auto-split,
+# strip-string) can commit rows stamped before a delta a client already
+# received. Re-sending everything from a minute before `since` covers that;
+# a re-sent row is just an idempotent overwrite on the client.
+DELTA_OVERLAP = timedelta(seconds=60)
+
+_CHAPTER_LIST_SELECT = "id,book_id,chapter_index,title,word_count,status,updated_at"
+
+
+def _parse_since(since: str) -> datetime:
+    # A client that didn't URL-encode the offset's "+" sends a space.
+    try:
+        parsed = datetime.fromisoformat(since.strip().replace(" ", "+"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since must be an ISO 8601 timestamp")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _wrap_cursor(prefix: str, value: str) -> str:
+    return base64.urlsafe_b64encode(f"{prefix}:{value}".encode()).decode().rstrip("=")
+
+
+def _unwrap_cursor(cursor: str, prefix: str) -> str:
+    """The value _wrap_cursor put in; ValueError if it isn't one of ours."""
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    found, _, value = raw.partition(":")
+    if found != prefix:
+        raise ValueError(raw)
+    return value
+
+
+def _encode_cursor(chapter_index: int) -> str:
+    return _wrap_cursor("ci", str(chapter_index))
+
+
+def _decode_cursor(cursor: str) -> int:
+    try:
+        return int(_unwrap_cursor(cursor, "ci"))
+    except ValueError:  # binascii.Error and UnicodeDecodeError included
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# A delta walk keysets two streams — changed chapters on (updated_at, id),
+# tombstones on (deleted_at, chapter_id) — so its cursor carries the last
+# position reached in each (None: nothing returned yet, start at `since`).
+# A full re-list also carries the newest updated_at from its first page,
+# which becomes its next_since.
+def _encode_delta_cursor(
+    items_after: Optional[list], deleted_after: Optional[list], full_since: Optional[str]
+) -> str:
+    state = {"i": items_after, "d": deleted_after, "f": full_since}
+    return _wrap_cursor("dl", json.dumps(state, separators=(",", ":")))
+
+
+def _decode_delta_cursor(cursor: str) -> tuple[Optional[list], Optional[list], Optional[str]]:
+    try:
+        state = json.loads(_unwrap_cursor(cursor, "dl"))
+        # All of it ends up inside PostgREST filters or the response: only
+        # well-formed values get that far.
+        for position in (state["i"], state["d"]):
+            if position is not None:
+                at, row_id = position
+                datetime.fromisoformat(at)
+                uuid.UUID(row_id)
+        if state["f"] is not None:
+            datetime.fromisoformat(state["f"])
+        return state["i"], state["d"], state["f"]
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _after_position(query, at_column: str, id_column: str, position: Optional[list], floor: Optional[str]):
+    """Rows strictly after `position` in (at_column, id_column) order, or
+    after `floor` when there is no position yet (everything if neither).
+    One reindex stamps thousands of rows with the same updated_at, so the
+    id tie-break is what lets a page end in the middle of them."""
+    if position is not None:
+        at, row_id = position
+        return query.or_(f'{at_column}.gt."{at}",and({at_column}.eq."{at}",{id_column}.gt.{row_id})')
+    if floor is not None:
+        return query.gt(at_column, floor)
+    return query
+
+
+def _json_response(payload: dict, etag: str) -> Response:
+    return Response(
+        content=json.dumps(payload, ensure_ascii=False, separators=(",", ":")),
+        media_type="application/json",
+        headers=http_cache.validator_headers(etag, http_cache.REVALIDATE_PUBLIC),
+    )
+
+
 @router.get("/{book_id}/chapters", response_model=None)
 def get_book_chapters(
+    request: Request,
     book_id: str,
     page: int = Query(1, ge=1, description="Page number (1-based)"),
-    page_size: int = Query(100, ge=1, le=10000, description="Chapters per page"),
+    page_size: int = Query(100, ge=1, le=10000, description="Chapters per page (at most 1000 are returned)"),
+    since: Optional[str] = Query(
+        None,
+        description="Delta sync: only chapters changed after this updated_at, "
+        "plus ids deleted since (page/page_size are ignored)",
+    ),
+    cursor: Optional[str] = Query(
+        None,
+        description="Opaque next_cursor from the previous page (replaces page; "
+        "with since, pass the same since again)",
+    ),
 ):
     db = get_client()
     # Verify book exists
@@ -66,19 +210,45 @@ def get_book_chapters(
         raise HTTPException(status_code=404, detail="Book not found")
 
     total = book.data.get("total_chapters", 0)
-
-    # Calculate range for Supabase (0-based inclusive)
-    offset = (page - 1) * page_size
-    end = offset + page_size - 1
+    since_at = _parse_since(since) if since else None
+
+    # Version of the whole list = newest updated_at in the book (edits and
+    # reindexes bump it via trg_chapters_updated_at) + total_chapters (catches
+    # deleting the last chapter, which touches no surviving row). One
+    # index-backed single-row lookup decides the 304 before the big select.
+    newest = db.table("chapters").select("updated_at").eq("book_id", book_id).order(
+        "updated_at", desc=True
+    ).limit(1).execute()
+    newest_at = (newest.data or [{}])[0].get("updated_at")
+    if since_at is not None:
+        return _chapter_delta(request, db, book_id, total, newest_at, since_at, cursor)
+
+    after = _decode_cursor(cursor) if cursor else None
+    # Larger pages would come back cut at max_rows and look like the last
+    # one. The effective size is echoed back and total_pages follows it, so
+    # a client asking for 10000 just walks more pages.
+    page_size = min(page_size, database.POSTGREST_MAX_ROWS)
+    etag, unchanged = http_cache.conditional(
+        request, http_cache.REVALIDATE_PUBLIC, book_id, newest_at, total,
+        page if after is None else f"after:{after}", page_size,
+    )
+    if unchanged:
+        return unchanged
 
     # Clients only consume id/book_id/index/title/word_count/status/updated_at
     # (updated_at is load-bearing: it versions the offline chapter-text
     # caches). The audio_* columns are always NULL since the pre-generation
     # pipeline was removed, and error_message/created_at have no consumer —
     # dropping them roughly halves the JSON for a 5,000-chapter book.
-    chapters = db.table("chapters").select(
-        "id,book_id,chapter_index,title,word_count,status,updated_at"
-    ).eq("book_id", book_id).order("chapter_index").range(offset, end).execute()
+    query = db.table("chapters").select(_CHAPTER_LIST_SELECT).eq("book_id", book_id)
+    if after is not None:
+        # Keyset: one index seek however deep the page is.
+        query = query.gt("chapter_index", after).order("chapter_index").limit(page_size)
+    else:
+        # ?page= is kept for older clients; an OFFSET walks every earlier row.
+        offset = (page - 1) * page_size
+        query = query.order("chapter_index").range(offset, offset + page_size - 1)
+    items = query.execute().data or []
 
     total_pages = max(1, -(-total // page_size))  # ceil division
 
@@ -87,16 +257,119 @@ def get_book_chapters(
     # are already JSON-safe dicts from PostgREST, and this handler is sync,
     # so serialization happens on the worker thread too.
     payload = {
-        "items": chapters.data or [],
+        "items": items,
         "total": total,
-        "page": page,
+        "page": page if after is None else None,
         "page_size": page_size,
         "total_pages": total_pages,
+        # Present on every full page, so a client can switch from ?page=1 to
+        # cursors for the rest of the walk.
+        "next_cursor": (
+            _encode_cursor(items[-1]["chapter_index"]) if len(items) == page_size else None
+        ),
     }
-    return Response(
-        content=json.dumps(payload, ensure_ascii=False, separators=(",", ":")),
-        media_type="application/json",
+    return _json_response(payload, etag)
+
+
+def _chapter_delta(
+    request: Request,
+    db,
+    book_id: str,
+    total: int,
+    newest_at: Optional[str],
+    since_at: datetime,
+    cursor: Optional[str],
+) -> Response:
+    """?since= mode: rows whose updated_at is after `since` (every edit and
+    reindex bumps it, and inserts start with it), tombstones for chapters
+    deleted since, and total_chapters. A client applies `items` by id, drops
+    `deleted`, and sends `next_since` back next time — a sync after an edit
+    to one chapter is one row instead of the whole book.
+
+    Both lists are keyset-paged under PostgREST's max_rows cap; while
+    `next_cursor` is set the client requests it (with the same `since`)
+    before moving on. `next_since` is only ever as new as what was actually
+    returned, so a client that stops mid-walk resumes from it losing nothing.
+
+    A `since` older than the tombstone retention can't be answered as a
+    delta — deletions that old are pruned — so the walk becomes a full
+    re-list: `full` is true, `deleted` stays empty, and the client replaces
+    its list with the items of every page instead of applying them."""
+    if cursor:
+        items_after, deleted_after, full_since = _decode_delta_cursor(cursor)
+    else:
+        items_after = deleted_after = full_since = None
+        if datetime.now(timezone.utc) - since_at > timedelta(days=CHAPTER_DELETIONS_RETENTION_DAYS):
+            # Anything deleted once the walk is under way is newer than this,
+            # so the first delta after it catches it.
+            full_since = newest_at or since_at.isoformat()
+    full = full_since is not None
+    floor = (since_at - DELTA_OVERLAP).isoformat()
+    page_size = database.CHAPTER_PAGE_SIZE
+
+    items = _after_position(
+        db.table("chapters").select(_CHAPTER_LIST_SELECT).eq("book_id", book_id),
+        "updated_at", "id", items_after, None if full else floor,
+    ).order("updated_at").order("id").limit(page_size).execute().data or []
+    # Tombstones are queried from their own position on every page, not just
+    # until they run out, so a chapter deleted mid-walk still shows up.
+    deleted = [] if full else _after_position(
+        db.table("chapter_deletions").select("chapter_id,deleted_at").eq("book_id", book_id),
+        "deleted_at", "chapter_id", deleted_after, floor,
+    ).order("deleted_at").order("chapter_id").limit(page_size).execute().data or []
+    live = {row["id"] for row in items}
+    deleted_ids = sorted({row["chapter_id"] for row in deleted} - live)
+    # The ETag has to cover deletions too: deleting a chapter touches no row
+    # when it was the last one, and total_chapters alone misses a delete plus
+    # an insert.
+    newest_deleted = deleted[-1]["deleted_at"] if deleted else None
+
+    items_more = len(items) == page_size
+    deleted_more = len(deleted) == page_size
+    next_cursor = next_since = None
+    if items_more or deleted_more:
+        next_cursor = _encode_delta_cursor(
+            [items[-1]["updated_at"], items[-1]["id"]] if items else items_after,
+            [deleted[-1]["deleted_at"], deleted[-1]["chapter_id"]] if deleted else deleted_after,
+            full_since,
+        )
+        if not full:
+            # Everything before the earliest cut-off has been sent.
+            next_since = min(
+                (rows[-1][column] for rows, more, column in (
+                    (items, items_more, "updated_at"), (deleted, deleted_more, "deleted_at"),
+                ) if more),
+                key=_parse_since,
+            )
+    elif full and cursor:
+        next_since = full_since
+    else:
+        # Both lists ran out on this request: the server's newest change,
+        # not the client's clock, is the next `since`.
+        next_since = max(
+            (v for v in (
+                newest_at, newest_deleted, items[-1]["updated_at"] if items else None,
+                since_at.isoformat(),
+            ) if v),
+            key=_parse_since,
+        )
+
+    etag, unchanged = http_cache.conditional(
+        request, http_cache.REVALIDATE_PUBLIC, book_id, newest_at, newest_deleted,
+        len(deleted), total, "since", floor, full, cursor or "",
     )
+    if unchanged:
+        return unchanged
+    payload = {
+        "items": items,
+        "deleted": deleted_ids,
+        "total": total,
+        "full": full,
+        "next_cursor": next_cursor,
+        # Null on a non-final page of a full re-list, which can't be resumed.
+        "next_since": next_since,
+    }
+    return _json_response(payload, etag)
 
 
 @router.get("/{book_id}/epub")
@@ -116,14 +389,12 @@ async def download_book_epub(
     import unicodedata
     from urllib.parse import quote
 
-    import httpx
-
-    from app.services import epub_parser
+    from app.services import chapter_pack, epub_parser
 
     db = get_client()
-    book = db.table("books").select(
+    book = await database.execute(db.table("books").select(
         "id,title,author,status,cover_url"
-    ).eq("id", book_id).maybe_single().execute()
+    ).eq("id", book_id).maybe_single())
     if not book.data:
         raise HTTPException(status_code=404, detail="Book not found")
     if book.data.get("status") == "parsing":
@@ -133,44 +404,23 @@ async def download_book_epub(
         )
 
     # All chapters in reading order, paginated past the PostgREST max_rows cap.
-    PAGE_SIZE = 500
-    chapters: list[dict] = []
-    fetch_offset = 0
-    while True:
-        page = db.table("chapters").select(
-            "id,chapter_index,title,updated_at"
-        ).eq("book_id", book_id).order("chapter_index").range(
-            fetch_offset, fetch_offset + PAGE_SIZE - 1
-        ).execute()
-        batch = page.data or []
-        chapters.extend(batch)
-        if len(batch) < PAGE_SIZE:
-            break
-        fetch_offset += PAGE_SIZE
+    chapters = await database.fetch_all_chapters(book_id, "id,chapter_index,title,updated_at")
     if not chapters:
         raise HTTPException(status_code=404, detail="Truyện chưa có chương nào")
 
-    # Chapter texts from Storage — capped fan-out, see STORAGE_CONCURRENCY.
-    # get_chapter_text_by_ids returns "" on failure; build_epub turns that into
-    # a placeholder page so one bad object can't sink the whole download.
-    sem = asyncio.Semaphore(storage_service.STORAGE_CONCURRENCY)
-
-    async def _fetch_text(ch: dict) -> str:
-        async with sem:
-            return await storage_service.get_chapter_text_by_ids(
-                book_id, ch["id"], ch.get("updated_at")
-            )
-
-    texts = await asyncio.gather(*(_fetch_text(ch) for ch in chapters))
+    # Chapter texts from the book's pack (two GETs), per-chapter objects for
+    # anything the pack doesn't cover. A chapter that can't be read comes back
+    # as ""; build_epub turns that into a placeholder page so one bad object
+    # can't sink the whole download.
+    texts = await chapter_pack.fetch_book_texts(book_id, chapters)
 
     # Cover is cosmetic — never fail the download over it.
     cover_bytes = None
     if book.data.get("cover_url"):
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                resp = await client.get(book.data["cover_url"])
-                if resp.status_code == 200 and resp.content:
-                    cover_bytes = resp.content
+            cover_bytes = await storage_service.fetch_public_object(
+                book.data["cover_url"], timeout=10.0
+            ) or None
         except Exception:
             pass
 
@@ -230,7 +480,7 @@ async def update_book(
 ):
     """Admin-only: update book metadata (title, author, cover image, story status)."""
     db = get_client()
-    book = db.table("books").select("id,cover_url").eq("id", book_id).maybe_single().execute()
+    book = await database.execute(db.table("books").select("id,cover_url").eq("id", book_id).maybe_single())
     if not book.data:
         raise HTTPException(status_code=404, detail="Book not found")
 
@@ -279,30 +529,44 @@ async def update_book(
             raise HTTPException(status_code=500, detail=f"Cover upload failed: {e}")
 
     if updates:
-        db.table("books").update(updates).eq("id", book_id).execute()
+        await database.execute(db.table("books").update(updates).eq("id", book_id))
+        catalog_cache.invalidate()
 
-    result = db.table("books").select(_BOOK_SELECT).eq("id", book_id).maybe_single().execute()
+    result = await database.execute(db.table("books").select(_BOOK_SELECT).eq("id", book_id).maybe_single())
     return _attach_genres([result.data])[0]
 
 
 @router.delete("/{book_id}")
 async def delete_book(book_id: str, _admin: dict = Depends(get_admin_user)):
     import asyncio
+    from app.services import chapter_pack
     db = get_client()
-    book = db.table("books").select("id").eq("id", book_id).maybe_single().execute()
+    book = await database.execute(db.table("books").select("id").eq("id", book_id).maybe_single())
     if not book.data:
         raise HTTPException(status_code=404, detail="Book not found")
 
-    # Delete from storage (best effort, all four buckets in parallel).
-    await asyncio.gather(
-        storage_service.delete_folder("audio", book_id),
-        storage_service.delete_folder("covers", book_id),
-        storage_service.delete_folder("epub-uploads", book_id),
-        storage_service.delete_folder("chapter-text", book_id),
-    )
+    # No pack rebuild may run during the delete (in any worker): it would
+    # write chapter-packs/{book_id}/ again after we cleared it.
+    chapter_pack.cancel(book_id)
+    pack_lease = await chapter_pack.hold_for_delete(book_id)
+    try:
+        # Delete from storage (best effort, every bucket in parallel).
+        with storage_service.priority(storage_service.BULK):
+            await asyncio.gather(
+                storage_service.delete_folder("audio", book_id),
+                storage_service.delete_folder("covers", book_id),
+                storage_service.delete_folder("epub-uploads", book_id),
+                storage_service.delete_folder("chapter-text", book_id),
+                storage_service.delete_folder(chapter_pack.CHAPTER_PACK_BUCKET, book_id),
+            )
 
-    # Delete from DB (cascades to chapters)
-    db.table("books").delete().eq("id", book_id).execute()
+        # Delete from DB (cascades to chapters)
+        await database.execute(db.table("books").delete().eq("id", book_id))
+    finally:
+        if pack_lease is not None:
+            await pack_lease.release()
+    catalog_cache.invalidate()
+    progress_buffer.forget_book(book_id)
     return {"message": "Book deleted"}
 
 
@@ -324,20 +588,21 @@ async def feature_book(
     _admin: dict = Depends(get_admin_user),
 ):
     db = get_client()
-    book = db.table("books").select("id").eq("id", book_id).maybe_single().execute()
+    book = await database.execute(db.table("books").select("id").eq("id", book_id).maybe_single())
     if not book.data:
         raise HTTPException(status_code=404, detail="Book not found")
 
     # Un-feature every other book first so only one spotlight exists at a time.
     if body.is_featured:
-        db.table("books").update({"is_featured": False, "featured_label": None}).neq("id", book_id).execute()
+        await database.execute(db.table("books").update({"is_featured": False, "featured_label": None}).neq("id", book_id))
 
-    db.table("books").update({
+    await database.execute(db.table("books").update({
         "is_featured": body.is_featured,
         "featured_label": body.featured_label if body.is_featured else None,
-    }).eq("id", book_id).execute()
+    }).eq("id", book_id))
+    catalog_cache.invalidate()
 
-    result = db.table("books").select(_BOOK_SELECT).eq("id", book_id).maybe_single().execute()
+    result = await database.execute(db.table("books").select(_BOOK_SELECT).eq("id", book_id).maybe_single())
     return _attach_genres([result.data])[0]
 
 
@@ -359,15 +624,18 @@ class StripStringRequest(BaseModel):
 # A bulk strip walks every chapter of the book through Storage, so on a big
 # book it runs for minutes. If the admin's browser gives up first and they
 # click again, a second full pass used to start on top of the first one,
-# doubling Storage load. Single uvicorn worker (same assumption as the TTS
-# queue), so an in-process set is enough to reject the overlap.
-_strip_running: set[str] = set()
+# doubling Storage load. The run holds a coordination lease, so the retry is
+# rejected whichever uvicorn worker it lands on.
+def _strip_lease_name(book_id: str) -> str:
+    return f"strip-string:{book_id}"
+
 
 # Auto-split deletes every chapter row and reinserts new ones, so two
 # overlapping runs on one book could interleave their deletes and inserts. The
 # admin UI gives up before the server does on a big book, and the natural
 # reaction is to press the button again.
-_autosplit_running: set[str] = set()
+def _autosplit_lease_name(book_id: str) -> str:
+    return f"auto-split:{book_id}"
 
 
 def _build_strip_pattern(body: StripStringRequest) -> "re.Pattern[str]":
@@ -386,85 +654,77 @@ async def strip_string_from_chapters(
     _admin: dict = Depends(get_admin_user),
 ):
     """Remove a literal string (or regex match) from every chapter's text."""
-    import asyncio
+    from app.services import chapter_pack
     if not body.target:
         raise HTTPException(status_code=400, detail="target string cannot be empty")
 
     pattern = _build_strip_pattern(body)
 
     db = get_client()
-    book = db.table("books").select("id").eq("id", book_id).maybe_single().execute()
+    book = await database.execute(db.table("books").select("id").eq("id", book_id).maybe_single())
     if not book.data:
         raise HTTPException(status_code=404, detail="Book not found")
 
-    if not body.dry_run and book_id in _strip_running:
-        raise HTTPException(
-            status_code=409,
-            detail="Lần xóa trước cho truyện này vẫn đang chạy — đợi nó xong rồi thử lại.",
-        )
+    # Taken now and released in the finally below; nothing in between awaits.
+    lease = None
+    if not body.dry_run:
+        lease = await coordination.acquire(_strip_lease_name(book_id))
+        if lease is None:
+            raise HTTPException(
+                status_code=409,
+                detail="Lần xóa trước cho truyện này vẫn đang chạy — đợi nó xong rồi thử lại.",
+            )
 
     # Paginate through all chapters; for each, download text from Storage,
     # strip matches, re-upload + update word_count.
-    PAGE_SIZE = 500
-    # Keep storage fan-out low — see storage_service.STORAGE_CONCURRENCY note.
-    CONCURRENCY = 8
-    sem = asyncio.Semaphore(CONCURRENCY)
     scanned = matched = occurrences = updated_count = failed_count = 0
     samples: list[str] = []
     first_error: str | None = None
 
-    async def _strip_one(ch: dict) -> int:
+    async def _strip_one(ch: dict, text: str) -> int:
         """Returns occurrences removed (0 = chapter untouched)."""
         nonlocal matched, occurrences
-        async with sem:
-            text = await storage_service.get_chapter_text_by_ids(
-                book_id, ch["id"], ch.get("updated_at")
-            )
-            if not text:
-                return 0
-            new_text, hits, removed = text_cleanup.apply_strip(
-                text, pattern, body.whole_line
-            )
-            if not hits:
-                return 0
-            matched += 1
-            occurrences += hits
-            if len(samples) < 8:
-                samples.extend(removed[: 8 - len(samples)])
-            if body.dry_run:
-                return hits
-            new_word_count = len(new_text.split()) if new_text.strip() else 0
-            path = await storage_service.upload_chapter_text(
-                book_id, ch["id"], new_text
-            )
-            # Single row update for path + word_count (write_chapter_text plus a
-            # second update doubled the DB round-trips across hundreds of
-            # chapters). The updated_at trigger still fires, so offline caches
-            # and the CDN version key pick up the edit.
-            await asyncio.to_thread(
-                lambda: db.table("chapters").update({
-                    "text_storage_path": path,
-                    "word_count": new_word_count,
-                }).eq("id", ch["id"]).execute()
-            )
+        if not text:
+            return 0
+        new_text, hits, removed = text_cleanup.apply_strip(
+            text, pattern, body.whole_line
+        )
+        if not hits:
+            return 0
+        matched += 1
+        occurrences += hits
+        if len(samples) < 8:
+            samples.extend(removed[: 8 - len(samples)])
+        if body.dry_run:
             return hits
+        new_word_count = len(new_text.split()) if new_text.strip() else 0
+        path = await storage_service.upload_chapter_text(
+            book_id, ch["id"], new_text
+        )
+        # Single row update for path + word_count (write_chapter_text plus a
+        # second update doubled the DB round-trips across hundreds of
+        # chapters). The updated_at trigger still fires, so offline caches
+        # and the CDN version key pick up the edit.
+        await database.execute(
+            db.table("chapters").update({
+                "text_storage_path": path,
+                "word_count": new_word_count,
+            }).eq("id", ch["id"])
+        )
+        return hits
 
-    if not body.dry_run:
-        _strip_running.add(book_id)
     try:
-        fetch_offset = 0
-        while True:
-            page = db.table("chapters").select("id,updated_at").eq("book_id", book_id).order(
-                "chapter_index"
-            ).range(fetch_offset, fetch_offset + PAGE_SIZE - 1).execute()
-            batch = page.data or []
-            if not batch:
-                break
+        async for batch in database.chapter_pages(book_id, "id,updated_at"):
+            # One ranged read of the book's pack per page; chapters it doesn't
+            # cover are fetched on their own.
+            texts = await chapter_pack.fetch_book_texts(book_id, batch)
             # return_exceptions: one chapter failing (Storage blip, row gone)
             # must not abandon the other 499 and collapse the whole request
             # into an opaque 500 — count it, log it, keep going.
-            results = await asyncio.gather(
-                *(_strip_one(ch) for ch in batch), return_exceptions=True
+            results = await storage_service.fan_out(
+                lambda pair: _strip_one(*pair),
+                list(zip(batch, texts)),
+                return_exceptions=True,
             )
             for ch, res in zip(batch, results):
                 scanned += 1
@@ -482,11 +742,9 @@ async def strip_string_from_chapters(
                 book_id, scanned, matched, updated_count, failed_count,
                 " (dry run)" if body.dry_run else "",
             )
-            if len(batch) < PAGE_SIZE:
-                break
-            fetch_offset += PAGE_SIZE
     finally:
-        _strip_running.discard(book_id)
+        if lease is not None:
+            await lease.release()
 
     return {
         "dry_run": body.dry_run,
@@ -500,6 +758,36 @@ async def strip_string_from_chapters(
     }
 
 
+@router.post("/{book_id}/pack")
+async def rebuild_book_pack(
+    book_id: str,
+    _admin: dict = Depends(get_admin_user),
+):
+    """Admin-only: rebuild the book's chapter pack now instead of waiting for
+    the post-write countdown (e.g. to pack a book written before packs
+    existed). Incremental — only chapters changed since the last pack are
+    downloaded."""
+    from app.services import chapter_pack
+
+    db = get_client()
+    book = await database.execute(db.table("books").select("id").eq("id", book_id).maybe_single())
+    if not book.data:
+        raise HTTPException(status_code=404, detail="Book not found")
+    # The same lease the background rebuild takes: two rebuilds of one book
+    # would each upload a pack and leave the loser's pack or index orphaned.
+    lease = await coordination.acquire(chapter_pack.rebuild_lease_name(book_id))
+    if lease is None:
+        raise HTTPException(
+            status_code=409,
+            detail="Gói chương của truyện này đang được dựng lại — đợi nó xong rồi thử lại.",
+        )
+    try:
+        chapter_pack.cancel(book_id)
+        return await chapter_pack.rebuild_pack(book_id)
+    finally:
+        await lease.release()
+
+
 @router.post("/{book_id}/reparse")
 async def reparse_book(
     book_id: str,
@@ -515,15 +803,13 @@ async def reparse_book(
     from app.services import epub_parser
 
     db = get_client()
-    book = db.table("books").select("id").eq("id", book_id).maybe_single().execute()
+    book = await database.execute(db.table("books").select("id").eq("id", book_id).maybe_single())
     if not book.data:
         raise HTTPException(status_code=404, detail="Book not found")
 
     # Locate the original upload. We don't store the ext on the book row, so
     # list the folder and pick the first file (uploads only ever write one).
-    files = await asyncio.to_thread(
-        storage_service._sync_list, "epub-uploads", book_id
-    )
+    files = await storage_service._async_list("epub-uploads", book_id)
     if not files:
         raise HTTPException(
             status_code=400,
@@ -535,20 +821,20 @@ async def reparse_book(
     async def _run() -> None:
         from app.routers.upload import _convert_and_parse
         try:
-            raw = await asyncio.to_thread(
-                storage_service._sync_download,
-                "epub-uploads",
-                f"{book_id}/{original_name}",
+            raw = await storage_service._async_download(
+                "epub-uploads", f"{book_id}/{original_name}"
             )
             # Clear stale state before re-parsing: chapter rows + their storage
             # objects. parse_epub_task uses INSERT (not UPSERT) and would
             # collide on the (book_id, chapter_index) unique constraint.
             await storage_service.delete_folder("chapter-text", book_id)
             await storage_service.delete_folder("audio", book_id)
-            db.table("chapters").delete().eq("book_id", book_id).execute()
-            db.table("books").update(
+            await database.execute(db.table("chapters").delete().eq("book_id", book_id))
+            await database.execute(db.table("books").update(
                 {"status": "parsing", "total_chapters": 0, "error_message": None}
-            ).eq("id", book_id).execute()
+            ).eq("id", book_id))
+            catalog_cache.invalidate()
+            progress_buffer.forget_book(book_id)
             # Re-use the upload converter so non-EPUB originals (PDF/TXT/MOBI)
             # still work after re-upload to epub-uploads.
             title = original_name.rsplit(".", 1)[0]
@@ -558,10 +844,11 @@ async def reparse_book(
             logging.getLogger(__name__).exception(
                 f"Reparse failed for book {book_id}: {e}"
             )
-            db.table("books").update({
+            await database.execute(db.table("books").update({
                 "status": "error",
                 "error_message": f"Phân tích lại thất bại: {type(e).__name__}: {e}"[:1000],
-            }).eq("id", book_id).execute()
+            }).eq("id", book_id))
+            catalog_cache.invalidate()
 
     asyncio.create_task(_run())
     return {"book_id": book_id, "status": "parsing", "source": original_name}
@@ -612,7 +899,7 @@ async def append_chapters_from_file(
         raise HTTPException(status_code=400, detail="mode must be 'auto' or 'all'")
 
     db = get_client()
-    book = db.table("books").select("id,status").eq("id", book_id).maybe_single().execute()
+    book = await database.execute(db.table("books").select("id,status").eq("id", book_id).maybe_single())
     if not book.data:
         raise HTTPException(status_code=404, detail="Book not found")
     if book.data.get("status") == "parsing":
@@ -642,20 +929,7 @@ async def append_chapters_from_file(
 
     # ── Existing chapters, in reading order (paginated past the PostgREST
     # max_rows cap — same pattern as auto-split) ────────────────────────────
-    PAGE_SIZE = 500
-    existing: list[dict] = []
-    fetch_offset = 0
-    while True:
-        page = db.table("chapters").select(
-            "id,chapter_index,title"
-        ).eq("book_id", book_id).order("chapter_index").range(
-            fetch_offset, fetch_offset + PAGE_SIZE - 1
-        ).execute()
-        batch = page.data or []
-        existing.extend(batch)
-        if len(batch) < PAGE_SIZE:
-            break
-        fetch_offset += PAGE_SIZE
+    existing = await database.fetch_all_chapters(book_id, "id,chapter_index,title")
 
     # ── Convert + parse the uploaded file (CPU on worker threads) ───────────
     title_guess = filename[: -len(ext)]
@@ -775,14 +1049,14 @@ async def append_chapters_from_file(
     inserted_ids: list[str] = []
     try:
         for i in range(0, len(insert_rows), BATCH_SIZE):
-            db.table("chapters").insert(insert_rows[i:i + BATCH_SIZE]).execute()
+            await database.execute(db.table("chapters").insert(insert_rows[i:i + BATCH_SIZE]))
             inserted_ids.extend(r["id"] for r in insert_rows[i:i + BATCH_SIZE])
     except Exception as insert_err:
         for i in range(0, len(inserted_ids), BATCH_SIZE):
             try:
-                db.table("chapters").delete().in_(
+                await database.execute(db.table("chapters").delete().in_(
                     "id", inserted_ids[i:i + BATCH_SIZE]
-                ).execute()
+                ))
             except Exception:
                 pass
         raise HTTPException(
@@ -797,7 +1071,8 @@ async def append_chapters_from_file(
     if book.data.get("status") == "error":
         book_updates["status"] = "ready"
         book_updates["error_message"] = None
-    db.table("books").update(book_updates).eq("id", book_id).execute()
+    await database.execute(db.table("books").update(book_updates).eq("id", book_id))
+    catalog_cache.invalidate()
 
     if deferred:
         bg = asyncio.create_task(
@@ -855,57 +1130,37 @@ async def auto_split_book(
         merge_short_chapters,
         MIN_CHAPTER_WORDS,
     )
+    from app.services import chapter_pack
     import asyncio
     import uuid as _uuid
 
     db = get_client()
-    book = db.table("books").select("id").eq("id", book_id).maybe_single().execute()
+    book = await database.execute(db.table("books").select("id").eq("id", book_id).maybe_single())
     if not book.data:
         raise HTTPException(status_code=404, detail="Book not found")
 
-    if book_id in _autosplit_running:
+    # Held for the whole run so a retry after the client gives up is
+    # rejected rather than starting a second delete-and-reinsert pass.
+    lease = await coordination.acquire(_autosplit_lease_name(book_id))
+    if lease is None:
         raise HTTPException(
             status_code=409,
             detail="Lần tách trước cho truyện này vẫn đang chạy — đợi nó xong rồi thử lại.",
         )
-
-    # Registered for the whole run so a retry after the client gives up is
-    # rejected rather than starting a second delete-and-reinsert pass.
-    _autosplit_running.add(book_id)
     try:
         # Fetch ALL chapters in reading order using pagination.
         # PostgREST enforces a server-side max_rows cap (default 1000 on Supabase)
         # that ignores client-specified limits above it. Paginate to bypass this.
-        PAGE_SIZE = 500
-        chapters: list[dict] = []
-        fetch_offset = 0
-        while True:
-            page = db.table("chapters").select(
-                "id,chapter_index,title,updated_at"
-            ).eq("book_id", book_id).order("chapter_index").range(
-                fetch_offset, fetch_offset + PAGE_SIZE - 1
-            ).execute()
-            batch = page.data or []
-            chapters.extend(batch)
-            if len(batch) < PAGE_SIZE:
-                break
-            fetch_offset += PAGE_SIZE
+        chapters = await database.fetch_all_chapters(
+            book_id, "id,chapter_index,title,updated_at"
+        )
         old_count = len(chapters)
         if not chapters:
             raise HTTPException(status_code=400, detail="No chapters to split")
 
-        # Download text for each chapter from Storage in parallel.
-        # See storage_service.STORAGE_CONCURRENCY for why this is capped low.
-        DOWNLOAD_CONCURRENCY = 8
-        dl_sem = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
-
-        async def _fetch_text(ch: dict) -> str:
-            async with dl_sem:
-                return await storage_service.get_chapter_text_by_ids(
-                    book_id, ch["id"], ch.get("updated_at")
-                )
-
-        chapter_texts = await asyncio.gather(*(_fetch_text(ch) for ch in chapters))
+        # Every chapter's text: the book's pack in one read, per-chapter
+        # objects only for what it doesn't cover.
+        chapter_texts = await chapter_pack.fetch_book_texts(book_id, chapters)
 
         # Merge every chapter's text in reading order, then split by headers.
         combined = "\n".join(chapter_texts)
@@ -970,15 +1225,12 @@ async def auto_split_book(
         ]
 
         # Upload each new chapter's text to Storage in parallel.
-        up_sem = asyncio.Semaphore(8)
-
         async def _upload_one(ch: dict) -> None:
-            async with up_sem:
-                ch["text_storage_path"] = await storage_service.upload_chapter_text(
-                    book_id, ch["id"], ch["_text"]
-                )
+            ch["text_storage_path"] = await storage_service.upload_chapter_text(
+                book_id, ch["id"], ch["_text"]
+            )
 
-        await asyncio.gather(*(_upload_one(ch) for ch in new_chapters))
+        await storage_service.fan_out(_upload_one, new_chapters)
         # Strip the in-memory _text field before insert (not a column).
         insert_rows = [{k: v for k, v in ch.items() if k != "_text"} for ch in new_chapters]
 
@@ -986,7 +1238,7 @@ async def auto_split_book(
         # attempt. Without this, re-running auto-split hits a unique constraint on
         # (book_id, chapter_index) because those rows were never normalized/deleted.
         try:
-            db.table("chapters").delete().eq("book_id", book_id).gte("chapter_index", OFFSET).execute()
+            await database.execute(db.table("chapters").delete().eq("book_id", book_id).gte("chapter_index", OFFSET))
         except Exception:
             pass
 
@@ -998,13 +1250,13 @@ async def auto_split_book(
         inserted_ids: list[str] = []
         try:
             for i in range(0, len(insert_rows), BATCH_SIZE):
-                db.table("chapters").insert(insert_rows[i : i + BATCH_SIZE]).execute()
+                await database.execute(db.table("chapters").insert(insert_rows[i : i + BATCH_SIZE]))
                 inserted_ids.extend(ch["id"] for ch in insert_rows[i : i + BATCH_SIZE])
         except Exception as insert_err:
             # Roll back any rows we managed to insert before the failure
             if inserted_ids:
                 try:
-                    db.table("chapters").delete().eq("book_id", book_id).gte("chapter_index", OFFSET).execute()
+                    await database.execute(db.table("chapters").delete().eq("book_id", book_id).gte("chapter_index", OFFSET))
                 except Exception:
                     pass
             raise HTTPException(
@@ -1013,56 +1265,58 @@ async def auto_split_book(
             )
 
         # Only now that new chapters are safely stored: delete the old chapters'
-        # text. Fan out per-chapter deletes — best effort, capped concurrency.
+        # text. Fan out per-chapter deletes — best effort, at BULK priority.
         #
         # This used to delete `audio/{book}/{chapter}.mp3` for every chapter too.
         # Audio is no longer generated or stored anywhere, so that was one wasted
         # Storage round-trip per chapter on every run — 5,421 of them on the
         # largest book — against a bucket that cannot contain anything.
         chapter_ids = [ch["id"] for ch in chapters]
-        del_sem = asyncio.Semaphore(8)
 
         async def _delete_old(ch: dict) -> None:
-            async with del_sem:
-                try:
-                    await storage_service.delete_chapter_text(book_id, ch["id"])
-                except Exception:
-                    pass
+            try:
+                await storage_service.delete_chapter_text(book_id, ch["id"])
+            except Exception:
+                pass
 
-        await asyncio.gather(*(_delete_old(ch) for ch in chapters))
+        await storage_service.fan_out(_delete_old, chapters)
         # Delete only the chapters we actually fetched and processed, in batches of
         # 100 to stay within URL length limits (each UUID is ~36 chars).
         DELETE_BATCH = 100
         for i in range(0, len(chapter_ids), DELETE_BATCH):
-            db.table("chapters").delete().in_("id", chapter_ids[i : i + DELETE_BATCH]).execute()
+            await database.execute(db.table("chapters").delete().in_("id", chapter_ids[i : i + DELETE_BATCH]))
 
         # Normalize chapter_index back to 0-based now that old rows are gone.
         # Prefer the single-statement RPC (normalize_chapter_offset); if it's not
         # deployed yet (older schema), fall back to parallel per-row updates.
         try:
-            await asyncio.to_thread(
-                lambda: db.rpc("normalize_chapter_offset", {
+            await database.execute(
+                db.rpc("normalize_chapter_offset", {
                     "p_book_id": book_id,
                     "p_offset": OFFSET,
-                }).execute()
+                })
             )
         except Exception as rpc_err:
-            # Fallback: N parallel UPDATEs via thread pool.
-            norm_sem = asyncio.Semaphore(20)
+            # Fallback: per-row UPDATEs, a few at a time. The DB executor is
+            # shared with every request, and thousands of queued UPDATEs
+            # would sit ahead of all of their queries.
+            norm_sem = asyncio.Semaphore(4)
 
             async def _renumber_one(ch: dict) -> None:
                 real_index = ch["chapter_index"] - OFFSET
                 async with norm_sem:
-                    await asyncio.to_thread(
-                        lambda: db.table("chapters").update(
+                    await database.execute(
+                        db.table("chapters").update(
                             {"chapter_index": real_index}
-                        ).eq("id", ch["id"]).execute()
+                        ).eq("id", ch["id"])
                     )
 
             await asyncio.gather(*(_renumber_one(ch) for ch in new_chapters))
 
         new_count = len(new_chapters)
-        db.table("books").update({"total_chapters": new_count}).eq("id", book_id).execute()
+        await database.execute(db.table("books").update({"total_chapters": new_count}).eq("id", book_id))
+        catalog_cache.invalidate()
+        progress_buffer.forget_book(book_id)
 
         return {
             "old_count": old_count,
@@ -1070,7 +1324,7 @@ async def auto_split_book(
             "missing_chapters": missing_chapters,
         }
     finally:
-        _autosplit_running.discard(book_id)
+        await lease.release()
 
 
 @router.post("/{book_id}/chapters", response_model=ChapterResponse, status_code=201)
@@ -1088,7 +1342,7 @@ async def create_chapter(
     text_content = body.text_content.strip()
 
     db = get_client()
-    book = db.table("books").select("id").eq("id", book_id).maybe_single().execute()
+    book = await database.execute(db.table("books").select("id").eq("id", book_id).maybe_single())
     if not book.data:
         raise HTTPException(status_code=404, detail="Book not found")
 
@@ -1096,19 +1350,18 @@ async def create_chapter(
 
     # Check whether the requested index is already taken; if so, shift
     # all chapters at that index and above up by one to make room.
-    existing = (
+    existing = await database.execute(
         db.table("chapters")
         .select("id")
         .eq("book_id", book_id)
         .eq("chapter_index", body.chapter_index)
         .limit(1)
-        .execute()
     )
     if existing.data:
-        db.rpc("shift_chapters_up", {
+        await database.execute(db.rpc("shift_chapters_up", {
             "p_book_id": book_id,
             "p_insert_index": body.chapter_index,
-        }).execute()
+        }))
 
     import uuid as _uuid
     new_chapter_id = str(_uuid.uuid4())
@@ -1119,7 +1372,7 @@ async def create_chapter(
         )
 
     try:
-        result = db.table("chapters").insert({
+        result = await database.execute(db.table("chapters").insert({
             "id": new_chapter_id,
             "book_id": book_id,
             "chapter_index": body.chapter_index,
@@ -1127,7 +1380,7 @@ async def create_chapter(
             "text_storage_path": text_storage_path,
             "word_count": word_count,
             "status": "pending",
-        }).execute()
+        }))
     except Exception as e:
         # Clean up the orphaned Storage file before raising
         if text_storage_path:
@@ -1138,9 +1391,11 @@ async def create_chapter(
         raise HTTPException(status_code=500, detail="Failed to create chapter")
 
     # Recalculate total_chapters
-    count_result = db.table("chapters").select("id", count="exact").eq("book_id", book_id).execute()
+    count_result = await database.execute(db.table("chapters").select("id", count="exact").eq("book_id", book_id))
     total = count_result.count or 0
-    db.table("books").update({"total_chapters": total}).eq("id", book_id).execute()
+    await database.execute(db.table("books").update({"total_chapters": total}).eq("id", book_id))
+    catalog_cache.invalidate()
+    progress_buffer.forget_book(book_id)
 
     ch = result.data[0]
     return ChapterResponse(**ch, audio=None)
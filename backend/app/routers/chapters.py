@@ -1,15 +1,19 @@
 import asyncio
+import gzip
+import json
 import logging
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
 from fastapi.responses import StreamingResponse
 from typing import Optional
 from pydantic import BaseModel
+from app import database
 from app.database import get_client
 from app.dependencies import get_admin_user, get_approved_user
 from app.models.chapter import ChapterResponse, AudioSummary
 from app.config import settings
-from app.services import storage_service
+from app import http_cache
+from app.services import catalog_cache, chapter_text_cache, progress_buffer, read_ahead, storage_service
 
 router = APIRouter(prefix="/api", tags=["chapters"])
 logger = logging.getLogger(__name__)
@@ -36,46 +40,253 @@ def get_chapter(chapter_id: str):
     return ChapterResponse(**{k: v for k, v in ch.items() if k in ChapterResponse.model_fields}, audio=audio)
 
 
+def _gzip_response(body: bytes, media_type: str, headers: Optional[dict] = None) -> Response:
+    """A body that is ALREADY gzip. Content-Encoding makes SmartGZipMiddleware
+    pass it through untouched instead of compressing it a second time."""
+    return Response(
+        content=body,
+        media_type=media_type,
+        headers={
+            **(headers or {}),
+            "Content-Encoding": "gzip",
+            "Vary": "Accept-Encoding",
+        },
+    )
+
+
 @router.get("/chapters/{chapter_id}/text")
 async def get_chapter_text(
     chapter_id: str,
+    request: Request,
+    response: Response,
+    format: str = Query("json", pattern="^(json|text)$"),
     _user: dict = Depends(get_approved_user),
 ):
+    """Chapter text as {id, text_content, updated_at}, or with format=text as
+    the bare text/plain body (updated_at in X-Updated-At).
+
+    Chapter text is stored gzip, so the naive path gunzipped it, wrapped it in
+    JSON and had the middleware gzip it again — two full compression passes
+    per request. format=text hands a gzip-accepting client the stored object
+    as-is; the JSON envelope is compressed once per (chapter, updated_at) and
+    then served from chapter_text_cache."""
     db = get_client()
     # Hottest endpoint in the app (every chapter open, web and Android).
     # Selecting text_storage_path here lets us download from Storage directly
     # instead of going through storage_service.get_chapter_text, which
-    # re-fetched this same row a second time. to_thread keeps the sync
-    # client's round-trip off the event loop.
-    result = await asyncio.to_thread(
-        lambda: db.table("chapters")
-        .select("id,text_storage_path,updated_at")
+    # re-fetched this same row a second time.
+    result = await database.execute(
+        db.table("chapters")
+        .select("id,book_id,chapter_index,text_storage_path,updated_at")
         .eq("id", chapter_id)
         .maybe_single()
-        .execute()
     )
     if not result or not result.data:
         raise HTTPException(status_code=404, detail="Chapter not found")
     row = result.data
+    version = row.get("updated_at")
+    gzip_ok = http_cache.accepts_gzip(request)
+
+    # Warm the next chapters in the background so the player's next request
+    # is a cache hit (also on a 304 — the reader is still on this chapter).
+    read_ahead.schedule(row["book_id"], row["chapter_index"])
+
+    # updated_at versions the text, so a client holding the current copy gets
+    # a bodiless 304 before any cache or Storage work.
+    etag, unchanged = http_cache.conditional(
+        request, http_cache.REVALIDATE_PRIVATE, row["id"], version, format
+    )
+    if unchanged:
+        return unchanged
+    # Only now: a 304 served the client's own copy, not the prefetched bytes,
+    # and counting it as a hit would grow the read-ahead for exactly the
+    # clients that need no warming.
+    if row.get("text_storage_path"):
+        read_ahead.note_served(row["text_storage_path"], version)
+    validators = http_cache.validator_headers(etag, http_cache.REVALIDATE_PRIVATE)
+
+    if format == "json" and gzip_ok:
+        cached = chapter_text_cache.envelope_get(row["id"], version)
+        if cached is not None:
+            return _gzip_response(cached, "application/json", validators)
+
     # Same contract as before: no stored path or a failed download → "".
-    text = ""
+    data = b""
+    stale = False
     path = row.get("text_storage_path")
     if path:
         try:
-            text = await storage_service.download_chapter_text(
-                path, row.get("updated_at")
-            )
+            data = await storage_service.download_chapter_object(path, version)
         except Exception as e:
             logger.warning(
                 f"Storage download failed for chapter {chapter_id} ({path}): {e}"
             )
+            # Storage down (or its circuit open): an older copy still in the
+            # cache beats an empty chapter. It goes out labelled with ITS
+            # version and without validators, so clients refetch later
+            # instead of filing old text under the current updated_at.
+            cached = chapter_text_cache.get_stale(path) if storage_service.is_unavailable(e) else None
+            if cached is not None:
+                version, data = cached
+                validators = {}
+                stale = True
+                try:
+                    await storage_service.prepare_chapter_decode(row["book_id"], data)
+                except Exception:
+                    pass
+
+    if format == "text" and gzip_ok and storage_service.is_gzip(data):
+        return _gzip_response(
+            data,
+            "text/plain; charset=utf-8",
+            {**validators, "X-Updated-At": version or ""},
+        )
+
+    text = ""
+    if data:
+        try:
+            text = storage_service.decode_chapter_bytes(data, row["book_id"])
+        except Exception as e:
+            # Corrupt blob: serve "" rather than garbage to the reader / TTS.
+            logger.warning(f"Could not decode text of chapter {chapter_id} ({path}): {e}")
+            data = b""
+
+    if format == "text":
+        return Response(
+            content=text,
+            media_type="text/plain; charset=utf-8",
+            headers={**(validators if data else {}), "X-Updated-At": version or ""},
+        )
+
     # updated_at lets clients that cache this text offline (Android app)
     # detect an admin edit and refetch instead of serving stale text forever.
-    return {
+    payload = {
         "id": row["id"],
         "text_content": text,
-        "updated_at": row["updated_at"],
+        "updated_at": version,
     }
+    if not data:
+        # A failed download is never cached or validated — the next request
+        # must retry Storage rather than 304 onto an empty chapter.
+        return payload
+    if not gzip_ok:
+        response.headers.update(validators)
+        return payload
+    body = gzip.compress(
+        json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+        compresslevel=6,
+    )
+    if not stale:
+        chapter_text_cache.envelope_put(row["id"], version, body)
+    return _gzip_response(body, "application/json", validators)
+
+
+# Upper bound on one batch: the native listen queue asks for 50 chapters ahead,
+# a little headroom beyond that, but never a whole book in one stream.
+MAX_BATCH_TEXT = 100
+
+
+class BatchTextRequest(BaseModel):
+    # Either explicit ids…
+    chapter_ids: Optional[list[str]] = None
+    # …or a reading-order window of one book.
+    book_id: Optional[str] = None
+    from_index: Optional[int] = None
+    count: int = 50
+
+
+@router.post("/chapters/batch-text")
+async def batch_chapter_text(
+    body: BatchTextRequest,
+    _user: dict = Depends(get_approved_user),
+):
+    """Stream many chapter texts as NDJSON, one
+    {id, chapter_index, text_content, updated_at} line per chapter in reading
+    order. Replaces the listen page's one-by-one prefetch of the next 50
+    chapters (50 auth checks, 50 row lookups, 50 Storage GETs) with one auth
+    check and one row query. Downloads go through the storage scheduler at
+    PREFETCH priority once the body starts, and each line is flushed as soon
+    as it and every line before it are ready, so the client can start
+    queueing on the first chapter."""
+    if body.chapter_ids:
+        if len(body.chapter_ids) > MAX_BATCH_TEXT:
+            raise HTTPException(
+                status_code=400, detail=f"At most {MAX_BATCH_TEXT} chapters per batch"
+            )
+    elif body.book_id is not None and body.from_index is not None:
+        if body.from_index < 0 or not 1 <= body.count <= MAX_BATCH_TEXT:
+            raise HTTPException(
+                status_code=400,
+                detail=f"from_index must be >= 0 and count between 1 and {MAX_BATCH_TEXT}",
+            )
+    else:
+        raise HTTPException(
+            status_code=400, detail="Provide chapter_ids, or book_id + from_index"
+        )
+
+    db = get_client()
+    cols = "id,book_id,chapter_index,text_storage_path,updated_at"
+    if body.chapter_ids:
+        query = db.table("chapters").select(cols).in_("id", body.chapter_ids)
+    else:
+        query = (
+            db.table("chapters")
+            .select(cols)
+            .eq("book_id", body.book_id)
+            .gte("chapter_index", body.from_index)
+            .order("chapter_index")
+            .limit(body.count)
+        )
+    result = await database.execute(query)
+    rows = sorted(result.data or [], key=lambda r: (r["book_id"], r["chapter_index"]))
+
+    async def _load(row: dict) -> str:
+        path = row.get("text_storage_path")
+        if not path:
+            return ""
+        try:
+            return await storage_service.download_chapter_text(
+                path, row.get("updated_at")
+            )
+        except Exception as e:
+            logger.warning(
+                f"Storage download failed for chapter {row['id']} ({path}): {e}"
+            )
+            return ""
+
+    async def _stream():
+        # Downloads start with the body, not in the handler: a client gone
+        # before the first byte costs none. They overlap under fan_out's cap
+        # and are awaited in order. Batches are the app filling its offline
+        # cache ahead of the listener: PREFETCH, so a chapter someone is
+        # waiting on right now goes first.
+        loop = asyncio.get_running_loop()
+        texts = [loop.create_future() for _ in rows]
+
+        async def _fill(i: int) -> None:
+            texts[i].set_result(await _load(rows[i]))
+
+        loader = asyncio.create_task(
+            storage_service.fan_out(_fill, range(len(rows)), level=storage_service.PREFETCH)
+        )
+        try:
+            for row, pending in zip(rows, texts):
+                text = await pending
+                yield json.dumps(
+                    {
+                        "id": row["id"],
+                        "chapter_index": row["chapter_index"],
+                        "text_content": text,
+                        "updated_at": row["updated_at"],
+                    },
+                    ensure_ascii=False,
+                    separators=(",", ":"),
+                ) + "\n"
+        finally:
+            # Client went away mid-stream: don't keep downloading for nobody.
+            loader.cancel()
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
 
 
 @router.get("/audio/{chapter_id}")
@@ -109,7 +320,7 @@ async def update_chapter(
     _admin: dict = Depends(get_admin_user),
 ):
     db = get_client()
-    result = db.table("chapters").select("id,book_id,chapter_index").eq("id", chapter_id).maybe_single().execute()
+    result = await database.execute(db.table("chapters").select("id,book_id,chapter_index").eq("id", chapter_id).maybe_single())
     if not result.data:
         raise HTTPException(status_code=404, detail="Chapter not found")
     book_id = result.data["book_id"]
@@ -126,14 +337,13 @@ async def update_chapter(
         # The (book_id, chapter_index) unique constraint would turn a collision
         # into an opaque 500 — check first and return an actionable 409.
         if body.chapter_index != result.data["chapter_index"]:
-            collision = (
+            collision = await database.execute(
                 db.table("chapters")
                 .select("id")
                 .eq("book_id", book_id)
                 .eq("chapter_index", body.chapter_index)
                 .neq("id", chapter_id)
                 .limit(1)
-                .execute()
             )
             if collision.data:
                 raise HTTPException(
@@ -149,11 +359,13 @@ async def update_chapter(
         updates["word_count"] = len(body.text_content.split())
 
     if updates:
-        db.table("chapters").update(updates).eq("id", chapter_id).execute()
+        await database.execute(db.table("chapters").update(updates).eq("id", chapter_id))
+    if "chapter_index" in updates and body.chapter_index != result.data["chapter_index"]:
+        progress_buffer.forget_book(book_id)
 
-    updated = db.table("chapters").select(
+    updated = await database.execute(db.table("chapters").select(
         "id,chapter_index,title,word_count,updated_at"
-    ).eq("id", chapter_id).maybe_single().execute()
+    ).eq("id", chapter_id).maybe_single())
     return updated.data
 
 
@@ -164,14 +376,14 @@ async def update_chapter_text(
     _admin: dict = Depends(get_admin_user),
 ):
     db = get_client()
-    result = db.table("chapters").select("id,book_id").eq("id", chapter_id).maybe_single().execute()
+    result = await database.execute(db.table("chapters").select("id,book_id").eq("id", chapter_id).maybe_single())
     if not result.data:
         raise HTTPException(status_code=404, detail="Chapter not found")
     word_count = len(body.text_content.split())
     await storage_service.write_chapter_text(result.data["book_id"], chapter_id, body.text_content)
-    updated = db.table("chapters").update({
+    updated = await database.execute(db.table("chapters").update({
         "word_count": word_count,
-    }).eq("id", chapter_id).execute()
+    }).eq("id", chapter_id))
     # updated_at (bumped by trg_chapters_updated_at) lets the editing client
     # stamp its offline chapter-text cache with the NEW version — without it
     # the device's stale cached copy passes the freshness check and the edit
@@ -194,7 +406,7 @@ async def delete_chapter(
     db = get_client()
 
     # Fetch the chapter to get book_id and index
-    result = db.table("chapters").select("id,book_id,chapter_index").eq("id", chapter_id).maybe_single().execute()
+    result = await database.execute(db.table("chapters").select("id,book_id,chapter_index").eq("id", chapter_id).maybe_single())
     if not result.data:
         raise HTTPException(status_code=404, detail="Chapter not found")
 
@@ -206,18 +418,20 @@ async def delete_chapter(
     await storage_service.delete_chapter_text(book_id, chapter_id)
 
     # Delete the chapter row
-    db.table("chapters").delete().eq("id", chapter_id).execute()
+    await database.execute(db.table("chapters").delete().eq("id", chapter_id))
 
     # Re-index all chapters after the deleted one in a single query
-    db.rpc("reindex_chapters_after_delete", {
+    await database.execute(db.rpc("reindex_chapters_after_delete", {
         "p_book_id": book_id,
         "p_deleted_index": deleted_index,
-    }).execute()
+    }))
 
     # Update book's total_chapters
-    count_result = db.table("chapters").select("id", count="exact").eq("book_id", book_id).execute()
+    count_result = await database.execute(db.table("chapters").select("id", count="exact").eq("book_id", book_id))
     new_total = count_result.count or 0
-    db.table("books").update({"total_chapters": new_total}).eq("id", book_id).execute()
+    await database.execute(db.table("books").update({"total_chapters": new_total}).eq("id", book_id))
+    catalog_cache.invalidate()
+    progress_buffer.forget_book(book_id)
 
     return {"deleted": chapter_id, "total_chapters": new_total}
 
@@ -272,7 +486,7 @@ async def split_chapter(
             raise HTTPException(status_code=400, detail="Each part must have a non-empty title")
 
     db = get_client()
-    result = db.table("chapters").select("id,book_id,chapter_index").eq("id", chapter_id).maybe_single().execute()
+    result = await database.execute(db.table("chapters").select("id,book_id,chapter_index").eq("id", chapter_id).maybe_single())
     if not result.data:
         raise HTTPException(status_code=404, detail="Chapter not found")
 
@@ -281,21 +495,21 @@ async def split_chapter(
     num_new = len(body.parts) - 1
 
     # Shift all chapters after base_index up by num_new to make room for new chapters
-    db.rpc("shift_chapters_up_by_n", {
+    await database.execute(db.rpc("shift_chapters_up_by_n", {
         "p_book_id": book_id,
         "p_insert_index": base_index + 1,
         "p_n": num_new,
-    }).execute()
+    }))
 
     # Update the existing chapter with parts[0]
     first = body.parts[0]
     first_path = await storage_service.upload_chapter_text(book_id, chapter_id, first.text_content)
-    db.table("chapters").update({
+    await database.execute(db.table("chapters").update({
         "title": first.title.strip(),
         "text_storage_path": first_path,
         "word_count": len(first.text_content.split()),
         "status": "pending",
-    }).eq("id", chapter_id).execute()
+    }).eq("id", chapter_id))
 
     # Insert new chapters for parts[1:]
     new_ids = []
@@ -303,7 +517,7 @@ async def split_chapter(
         new_id = str(_uuid.uuid4())
         new_ids.append(new_id)
         path = await storage_service.upload_chapter_text(book_id, new_id, part.text_content)
-        db.table("chapters").insert({
+        await database.execute(db.table("chapters").insert({
             "id": new_id,
             "book_id": book_id,
             "chapter_index": base_index + i,
@@ -311,12 +525,14 @@ async def split_chapter(
             "text_storage_path": path,
             "word_count": len(part.text_content.split()),
             "status": "pending",
-        }).execute()
+        }))
 
     # Update total_chapters
-    count_result = db.table("chapters").select("id", count="exact").eq("book_id", book_id).execute()
+    count_result = await database.execute(db.table("chapters").select("id", count="exact").eq("book_id", book_id))
     new_total = count_result.count or 0
-    db.table("books").update({"total_chapters": new_total}).eq("id", book_id).execute()
+    await database.execute(db.table("books").update({"total_chapters": new_total}).eq("id", book_id))
+    catalog_cache.invalidate()
+    progress_buffer.forget_book(book_id)
 
     return {"chapter_id": chapter_id, "new_chapter_ids": new_ids, "total_chapters": new_total}
 
@@ -338,43 +554,41 @@ async def bulk_delete_chapters(
     db = get_client()
 
     # Fetch all chapters to get book_id mapping
-    result = db.table("chapters").select("id,book_id").in_("id", body.chapter_ids).execute()
+    result = await database.execute(db.table("chapters").select("id,book_id").in_("id", body.chapter_ids))
     if not result.data:
         raise HTTPException(status_code=404, detail="No chapters found")
 
     chapters = result.data
     book_ids = list({ch["book_id"] for ch in chapters})
 
-    # Delete audio + text files from storage (best effort, parallel).
-    # Storage fan-out capped at 8 — see storage_service.STORAGE_CONCURRENCY.
-    import asyncio
-    del_sem = asyncio.Semaphore(8)
-
+    # Delete audio + text files from storage (best effort, parallel, BULK
+    # priority — the storage scheduler sets the pace).
     async def _delete_files(ch: dict) -> None:
-        async with del_sem:
-            try:
-                await storage_service.delete_path("audio", f"{ch['book_id']}/{ch['id']}.mp3")
-            except Exception:
-                pass
-            try:
-                await storage_service.delete_chapter_text(ch["book_id"], ch["id"])
-            except Exception:
-                pass
-
-    await asyncio.gather(*(_delete_files(ch) for ch in chapters))
+        try:
+            await storage_service.delete_path("audio", f"{ch['book_id']}/{ch['id']}.mp3")
+        except Exception:
+            pass
+        try:
+            await storage_service.delete_chapter_text(ch["book_id"], ch["id"])
+        except Exception:
+            pass
+
+    await storage_service.fan_out(_delete_files, chapters)
 
     # Delete all chapter rows at once
-    db.table("chapters").delete().in_("id", body.chapter_ids).execute()
+    await database.execute(db.table("chapters").delete().in_("id", body.chapter_ids))
 
     # Re-index remaining chapters per book with a single SQL function each
     for book_id in book_ids:
-        db.rpc("reindex_all_chapters", {"p_book_id": book_id}).execute()
+        await database.execute(db.rpc("reindex_all_chapters", {"p_book_id": book_id}))
 
     # Update total_chapters per book
     totals: dict[str, int] = {}
     for book_id in book_ids:
-        count_result = db.table("chapters").select("id", count="exact").eq("book_id", book_id).execute()
+        count_result = await database.execute(db.table("chapters").select("id", count="exact").eq("book_id", book_id))
         totals[book_id] = count_result.count or 0
-        db.table("books").update({"total_chapters": totals[book_id]}).eq("id", book_id).execute()
+        await database.execute(db.table("books").update({"total_chapters": totals[book_id]}).eq("id", book_id))
+        progress_buffer.forget_book(book_id)
+    catalog_cache.invalidate()
 
     return {"deleted": len(body.chapter_ids), "book_totals": totals}
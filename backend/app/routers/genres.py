@@ -4,6 +4,7 @@ from typing import List
 from app.database import get_client
 from app.dependencies import get_admin_user, get_current_user
 from app.models.genre import GenreResponse, GenreCreate, GenreUpdate
+from app.services import catalog_cache
 
 router = APIRouter(prefix="/api/genres", tags=["genres"])
 
@@ -87,6 +88,8 @@ def update_genre(genre_id: str, body: GenreUpdate, _admin: dict = Depends(get_ad
             raise HTTPException(status_code=409, detail="Genre with this name already exists")
         raise HTTPException(status_code=500, detail="Failed to update genre")
 
+    # Book listings embed genre names and colors.
+    catalog_cache.invalidate()
     return result.data[0]
 
 
@@ -98,6 +101,7 @@ def delete_genre(genre_id: str, _admin: dict = Depends(get_admin_user)):
         raise HTTPException(status_code=404, detail="Genre not found")
 
     db.table("genres").delete().eq("id", genre_id).execute()
+    catalog_cache.invalidate()
 
 
 # ── Book ↔ Genre assignment (admin only) ──
@@ -113,9 +117,11 @@ def assign_genre(book_id: str, genre_id: str, _admin: dict = Depends(get_admin_u
         raise HTTPException(status_code=404, detail="Genre not found")
 
     db.table("book_genres").upsert({"book_id": book_id, "genre_id": genre_id}).execute()
+    catalog_cache.invalidate()
 
 
 @router.delete("/assign/{book_id}/{genre_id}", status_code=204)
 def remove_genre(book_id: str, genre_id: str, _admin: dict = Depends(get_admin_user)):
     db = get_client()
     db.table("book_genres").delete().eq("book_id", book_id).eq("genre_id", genre_id).execute()
+    catalog_cache.invalidate()
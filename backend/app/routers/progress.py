@@ -4,52 +4,64 @@ from fastapi import APIRouter, Depends, HTTPException
 
 from app.database import get_client
 from app.dependencies import get_current_user
-from app.models.progress import ProgressUpsert, ProgressResponse
+from app.models.progress import ProgressBatchRequest, ProgressUpsert, ProgressResponse
+from app.services import progress_buffer
 
 router = APIRouter(prefix="/api/progress", tags=["progress"])
 
 
 # All handlers here are sync (`def`) so FastAPI runs them on the worker thread
 # pool: the blocking Supabase client would otherwise stall the single uvicorn
-# worker's event loop, and progress writes fire constantly during playback.
+# worker's event loop. Saves are buffered (progress_buffer) and only touch the
+# database on a cache miss.
 @router.put("", response_model=ProgressResponse)
 def save_progress(body: ProgressUpsert, user: dict = Depends(get_current_user)):
-    """Upsert progress for user + book (one row per book)."""
-    db = get_client()
-    data = {
-        "user_id": user["id"],
-        "book_id": body.book_id,
-        "chapter_id": body.chapter_id,
-        "progress_value": body.progress_value,
-        "total_value": body.total_value,
-        "updated_at": "now()",
-    }
-    result = (
-        db.table("user_progress")
-        .upsert(data, on_conflict="user_id,book_id")
-        .execute()
-    )
-    if not result.data:
-        raise HTTPException(status_code=500, detail="Failed to save progress")
-    row = result.data[0]
-    # Fetch chapter_index from chapters table
-    ch = (
-        db.table("chapters")
-        .select("chapter_index")
-        .eq("id", row["chapter_id"])
-        .maybe_single()
-        .execute()
-    )
-    row["chapter_index"] = ((ch.data or {}) if ch else {}).get("chapter_index")
+    """Upsert progress for user + book (one row per book). Buffered: the
+    row reaches user_progress within a few seconds (progress_buffer), the
+    response is answered from memory."""
+    try:
+        return progress_buffer.save(
+            user["id"], body.book_id, body.chapter_id, body.progress_value, body.total_value
+        )
+    except progress_buffer.ChapterNotFound:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Chapter does not belong to this book")
+
+
+def _stored_row(row: dict) -> dict:
+    progress_buffer.remember_row_id(row["user_id"], row["book_id"], row["id"])
+    # chapter_index is stored on the row; only a row written before the
+    # column existed (and missed the backfill) needs the chapters lookup.
+    if row.get("chapter_index") is None:
+        try:
+            row["chapter_index"] = progress_buffer.chapter_info(row["chapter_id"])[1]
+        except progress_buffer.ChapterNotFound:
+            pass
     return row
 
 
+@router.post("/batch", response_model=List[ProgressResponse])
+def get_batch_progress(body: ProgressBatchRequest, user: dict = Depends(get_current_user)):
+    """Progress rows for several books at once (library progress bars) —
+    books without progress are simply absent. Served from the per-user row
+    cache in progress_buffer: one query per user every couple of minutes
+    instead of one per book per page load."""
+    rows = progress_buffer.user_rows(user["id"])
+    return [_stored_row(rows[book_id]) for book_id in dict.fromkeys(body.book_ids) if book_id in rows]
+
+
 @router.get("/chapter/{chapter_id}", response_model=Optional[ProgressResponse])
 def get_chapter_progress(
     chapter_id: str,
     user: dict = Depends(get_current_user),
 ):
     """Get progress for a specific chapter."""
+    # The book's latest save may still be buffered — and may have moved on
+    # from this chapter, making the stored row stale.
+    for row in progress_buffer.pending_for_user(user["id"]):
+        if row["chapter_id"] == chapter_id:
+            return row
     db = get_client()
     result = (
         db.table("user_progress")
@@ -61,16 +73,9 @@ def get_chapter_progress(
     )
     if not result or not result.data:
         return None
-    row = result.data
-    ch = (
-        db.table("chapters")
-        .select("chapter_index")
-        .eq("id", row["chapter_id"])
-        .maybe_single()
-        .execute()
-    )
-    row["chapter_index"] = ((ch.data or {}) if ch else {}).get("chapter_index")
-    return row
+    if progress_buffer.pending(user["id"], result.data["book_id"]) is not None:
+        return None
+    return _stored_row(result.data)
 
 
 @router.get("/my-books", response_model=List[Dict[str, Any]])
@@ -80,6 +85,9 @@ def get_my_books(user: dict = Depends(get_current_user)):
     Each entry contains book metadata + the last-stopped chapter info.
     Sorted by most recently updated.
     """
+    # The query joins books/chapters in the database, so write the user's
+    # buffered saves first rather than merging them in by hand.
+    progress_buffer.flush_user(user["id"])
     db = get_client()
     result = (
         db.table("user_progress")
@@ -115,6 +123,9 @@ def get_book_progress(
     user: dict = Depends(get_current_user),
 ):
     """Get progress for a book."""
+    buffered = progress_buffer.pending(user["id"], book_id)
+    if buffered is not None:
+        return buffered
     db = get_client()
     result = (
         db.table("user_progress")
@@ -126,13 +137,4 @@ def get_book_progress(
     )
     if not result or not result.data:
         return None
-    row = result.data
-    ch = (
-        db.table("chapters")
-        .select("chapter_index")
-        .eq("id", row["chapter_id"])
-        .maybe_single()
-        .execute()
-    )
-    row["chapter_index"] = ((ch.data or {}) if ch else {}).get("chapter_index")
-    return row
+    return _stored_row(result.data)
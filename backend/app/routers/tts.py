@@ -2,6 +2,7 @@ import asyncio
 import io
 from fastapi import APIRouter, HTTPException, Body, Depends
 from fastapi.responses import StreamingResponse
+from app import database
 from app.database import get_client
 from app.dependencies import get_approved_user
 
@@ -90,40 +91,38 @@ async def chapter_full_audio(
          it directly (avoids re-generating and is instant).
       2. On-the-fly generation as fallback (edge-tts → gTTS).
     """
-    import tempfile, os, httpx
+    import tempfile, os
+    from app.services import storage_service
 
     db = get_client()
 
     # ── 1. Check for a pre-stored audio file ─────────────────────────────────
-    audio_row = (
+    audio_row = await database.execute(
         db.table("chapters")
         .select("audio_url")
         .eq("id", chapter_id)
         .maybe_single()
-        .execute()
     )
     if audio_row and audio_row.data and audio_row.data.get("audio_url"):
         public_url = audio_row.data["audio_url"]
         try:
-            async with httpx.AsyncClient(timeout=30) as client:
-                r = await client.get(public_url)
-                r.raise_for_status()
-                return StreamingResponse(
-                    io.BytesIO(r.content),
-                    media_type="audio/mpeg",
-                    headers={"Cache-Control": "public, max-age=86400"},
-                )
+            # Coalesced: concurrent offline-caching requests for the same
+            # chapter share one fetch.
+            content = await storage_service.fetch_public_object(public_url, timeout=30)
+            return StreamingResponse(
+                io.BytesIO(content),
+                media_type="audio/mpeg",
+                headers={"Cache-Control": "public, max-age=86400"},
+            )
         except Exception:
             pass  # fall through to on-the-fly generation
 
     # ── 2. Fetch chapter text ─────────────────────────────────────────────────
-    from app.services import storage_service
-    chapter = (
+    chapter = await database.execute(
         db.table("chapters")
         .select("id")
         .eq("id", chapter_id)
         .maybe_single()
-        .execute()
     )
     if not chapter.data:
         raise HTTPException(status_code=404, detail="Chapter not found")
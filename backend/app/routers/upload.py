@@ -8,10 +8,11 @@ from typing import Optional
 
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
 
+from app import database
 from app.database import get_client
 from app.config import settings
 from app.dependencies import get_admin_user
-from app.services import image_service, storage_service, epub_parser
+from app.services import catalog_cache, coordination, image_service, storage_service, epub_parser
 from app.services.converter import txt_to_epub, pdf_to_epub, prc_to_epub
 
 router = APIRouter(prefix="/api", tags=["upload"])
@@ -184,14 +185,15 @@ async def upload_book(
 
     # Insert book row only AFTER both uploads succeeded. If we crash earlier
     # there's no orphan row in the DB.
-    db.table("books").insert({
+    await database.execute(db.table("books").insert({
         "id": book_id,
         "title": base_title,
         "voice": voice,
         "status": "parsing",
         "total_chapters": 0,
         **({"cover_url": cover_url} if cover_url else {}),
-    }).execute()
+    }))
+    catalog_cache.invalidate()
 
     # Convert to EPUB if needed, then parse
     task = asyncio.create_task(_convert_and_parse(book_id, content, ext, base_title))
@@ -207,6 +209,10 @@ async def _convert_and_parse(
 ) -> None:
     """Convert TXT/PDF → EPUB (if needed) then run the standard EPUB parser."""
     db = get_client()
+    # Marks this worker as the book's parser for the whole run. If another
+    # worker still holds it (a reparse racing the original parse) we go ahead
+    # anyway — the lease is about ownership, not exclusion.
+    lease = await coordination.acquire(epub_parser.parse_lease_name(book_id))
     try:
         if ext != ".epub":
             logger.info(f"Book {book_id}: converting {ext} → EPUB")
@@ -216,7 +222,11 @@ async def _convert_and_parse(
 
     except Exception as e:
         logger.exception(f"Book {book_id}: conversion failed: {e}")
-        db.table("books").update({
+        await database.execute(db.table("books").update({
             "status": "error",
             "error_message": f"Chuyển đổi file sang EPUB thất bại: {type(e).__name__}: {e}"[:1000],
-        }).eq("id", book_id).execute()
+        }).eq("id", book_id))
+        catalog_cache.invalidate()
+    finally:
+        if lease is not None:
+            await lease.release()
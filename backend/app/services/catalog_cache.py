@@ -0,0 +1,97 @@
+"""In-memory book catalog for GET /api/books.
+
+Every home-page load used to run the full books ⨝ book_genres ⨝ genres
+select, flatten the genres, validate every row against BookResponse and
+serialize the list — for a catalog that only changes when an admin edits it.
+The finished JSON body (and a gzipped copy) is now kept here, so a load is a
+dict lookup and, for a gzip-accepting client, zero compression work.
+
+Invalidation is write-through: every code path that changes a catalog field
+(book rows, genres, book↔genre links) calls invalidate() after its write,
+which also reaches the other uvicorn workers through coordination. A short
+TTL is the safety net for edits made straight in the database (dashboard,
+scripts).
+
+The version is a hash of the body, so a TTL rebuild of an unchanged catalog
+keeps its ETag and clients keep getting 304s.
+"""
+import gzip
+import hashlib
+import threading
+import time
+from typing import Callable, Optional
+
+from app.services import coordination
+
+TTL_SECONDS = 60.0
+
+_lock = threading.Lock()
+# One build at a time: concurrent misses wait for it instead of each running
+# the same select.
+_build_lock = threading.Lock()
+_entry: Optional[dict] = None
+_generation = 0
+_stats = {"hits": 0, "builds": 0, "invalidations": 0}
+
+
+def _fresh(entry: Optional[dict]) -> bool:
+    return entry is not None and time.monotonic() - entry["built_at"] < TTL_SECONDS
+
+
+def get(build: Callable[[], bytes]) -> dict:
+    """{version, body, gzip} of the current catalog; `build` (blocking — the
+    DB select plus serialization) runs only on a miss."""
+    global _entry
+    entry = _entry
+    if _fresh(entry):
+        _stats["hits"] += 1
+        return entry
+    with _build_lock:
+        entry = _entry
+        if _fresh(entry):
+            _stats["hits"] += 1
+            return entry
+        generation = _generation
+        body = build()
+        entry = {
+            "version": hashlib.sha1(body).hexdigest()[:24],
+            "body": body,
+            "gzip": gzip.compress(body, compresslevel=6),
+            "built_at": time.monotonic(),
+        }
+        _stats["builds"] += 1
+        with _lock:
+            # A write landed mid-build: serve this caller what we read, but
+            # don't keep a catalog that may predate the write.
+            if _generation == generation:
+                _entry = entry
+        return entry
+
+
+def invalidate() -> None:
+    """Drop the cached catalog. Call after any write to books, genres or
+    book_genres."""
+    _drop()
+    coordination.broadcast("catalog.invalidate")
+
+
+def _drop(_payload=None) -> None:
+    global _entry, _generation
+    with _lock:
+        _generation += 1
+        _entry = None
+        _stats["invalidations"] += 1
+
+
+coordination.subscribe("catalog.invalidate", _drop)
+
+
+def stats() -> dict:
+    entry = _entry
+    return {
+        **_stats,
+        "cached": entry is not None,
+        "bytes": len(entry["body"]) if entry else 0,
+        "gzip_bytes": len(entry["gzip"]) if entry else 0,
+        "age_seconds": round(time.monotonic() - entry["built_at"], 1) if entry else None,
+    }
@@ -0,0 +1,383 @@
+"""Per-book packed chapter-text archives.
+
+A 5,000-chapter book is 5,000 objects in the chapter-text bucket, so every
+whole-book pass (EPUB export, auto-split, strip-string) paid thousands of
+GETs at STORAGE_CONCURRENCY. The pack is one object per book holding every
+chapter's object bytes back to back — each one an independent gzip or zstd
+frame, exactly as stored in chapter-text — plus a small index of
+(chapter_id, updated_at, offset, length). A whole-book read is now two GETs
+(index + pack); a contiguous run of chapters is the index plus one Range GET.
+
+Layout in the private "chapter-packs" bucket:
+
+    {book_id}/index.json.gz          gzip JSON, always fetched fresh
+    {book_id}/pack-{generation}.bin  concatenated chapter objects
+
+The pack name changes on every rebuild and the index is written last, so a
+reader never pairs an index with a pack it doesn't describe. A reader still
+holding the previous index after its pack was deleted just falls back below.
+
+The pack is an accelerator, never the source of truth: an entry is used only
+when its updated_at matches the chapter row's, and anything stale, missing
+or undecodable is read from its own chapter-text object. So a pack that lags
+behind edits — or doesn't exist yet — costs speed, not correctness.
+
+Rebuilds are incremental: entries whose (id, updated_at) still match are
+copied out of the previous pack; only changed chapters are downloaded. They
+run in the background a couple of minutes after the last chapter-text write
+to a book, so a parse or a strip-string pass triggers one rebuild, not one
+per chapter. A coordination lease per book keeps two uvicorn workers that
+both saw writes from rebuilding the same pack at once, and lets a book
+delete wait out a rebuild already under way; cancel() reaches every
+worker's countdown. A rebuild that finds the book gone uploads nothing, and
+one that loses the race anyway removes what it wrote.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import uuid
+
+from app import database
+from app.services import coordination, storage_service
+
+logger = logging.getLogger(__name__)
+
+CHAPTER_PACK_BUCKET = "chapter-packs"
+PACK_FORMAT = 1
+
+# Quiet period after the last write before a book is repacked.
+REBUILD_DELAY_SECONDS = 120.0
+# How long a book delete waits for a rebuild in flight before going ahead.
+DELETE_WAIT_SECONDS = 30.0
+
+_timers: dict[str, asyncio.TimerHandle] = {}
+_rebuilding: set[str] = set()
+# Strong refs so the event loop doesn't GC a rebuild task mid-flight.
+_tasks: set = set()
+_stats = {"pack_hits": 0, "fallbacks": 0, "rebuilds": 0, "rebuild_failures": 0}
+
+
+def _index_path(book_id: str) -> str:
+    return f"{book_id}/index.json.gz"
+
+
+def _pack_path(book_id: str, generation: str) -> str:
+    return f"{book_id}/pack-{generation}.bin"
+
+
+def rebuild_lease_name(book_id: str) -> str:
+    """Coordination lease held by whoever is rewriting the book's pack —
+    the background rebuild or the admin endpoint."""
+    return f"chapter-pack:{book_id}"
+
+
+async def load_index(book_id: str) -> dict | None:
+    """The book's pack index, or None if there is no (readable) pack."""
+    try:
+        raw = await storage_service._async_download(
+            CHAPTER_PACK_BUCKET,
+            _index_path(book_id),
+            # The index is overwritten in place; never let the CDN answer.
+            uuid.uuid4().hex,
+        )
+        index = json.loads(gzip.decompress(raw))
+    except Exception as e:
+        # Supabase answers 400/404 for a missing object — the common case
+        # for a book that was never packed.
+        logger.debug("No chapter pack for book %s: %s", book_id, e)
+        return None
+    if index.get("format") != PACK_FORMAT:
+        return None
+    return index
+
+
+def _entries(index: dict) -> dict[str, tuple[str, int, int]]:
+    """chapter_id → (updated_at, offset, length)."""
+    return {cid: (version, offset, length) for cid, version, offset, length in index["entries"]}
+
+
+async def fetch_book_texts(book_id: str, chapters: list[dict]) -> list[str]:
+    """Texts for `chapters` (rows with at least id and updated_at), in the
+    given order. Current pack entries come from one (Range) GET over the span
+    they cover; everything else falls back to per-chapter downloads. A
+    chapter that can't be read at all comes back as "", same as
+    get_chapter_text_by_ids.
+
+    Every caller is a whole-book job, so all of it runs at BULK priority."""
+    with storage_service.priority(storage_service.BULK):
+        return await _fetch_book_texts(book_id, chapters)
+
+
+async def _fetch_book_texts(book_id: str, chapters: list[dict]) -> list[str]:
+    texts: list[str | None] = [None] * len(chapters)
+    index = await load_index(book_id) if chapters else None
+    if index is not None:
+        entries = _entries(index)
+        wanted: list[tuple[int, int, int]] = []
+        for i, ch in enumerate(chapters):
+            entry = entries.get(ch["id"])
+            if entry is not None and entry[0] == ch.get("updated_at"):
+                wanted.append((i, entry[1], entry[2]))
+        if wanted:
+            lo = min(offset for _, offset, _ in wanted)
+            hi = max(offset + length for _, offset, length in wanted)
+            byte_range = None if lo == 0 and hi >= index["size"] else (lo, hi - 1)
+            try:
+                blob = await storage_service._async_download(
+                    CHAPTER_PACK_BUCKET,
+                    _pack_path(book_id, index["generation"]),
+                    index["generation"],
+                    byte_range,
+                )
+            except Exception as e:
+                logger.warning("Chapter pack read failed for book %s: %s", book_id, e)
+                blob = None
+            if blob is not None:
+                parts = [(i, blob[offset - lo:offset - lo + length]) for i, offset, length in wanted]
+                # Fetch any dictionary the slices need first (a cache lookup
+                # once it's there), so the decode loop never touches Storage.
+                for _, part in parts:
+                    try:
+                        await storage_service.prepare_chapter_decode(book_id, part)
+                    except Exception:
+                        # Corrupt header or no dictionary: the decode below
+                        # fails and the chapter is read on its own.
+                        pass
+                # Thousands of gzip/zstd decodes for an export — off the loop.
+                _stats["pack_hits"] += await asyncio.to_thread(_decode_parts, book_id, parts, texts)
+
+    missing = [i for i, text in enumerate(texts) if text is None]
+    if missing:
+        _stats["fallbacks"] += len(missing)
+
+        async def _fetch(i: int) -> None:
+            ch = chapters[i]
+            texts[i] = await storage_service.get_chapter_text_by_ids(
+                book_id, ch["id"], ch.get("updated_at")
+            )
+
+        await storage_service.fan_out(_fetch, missing)
+    return texts  # type: ignore[return-value]
+
+
+def _decode_parts(book_id: str, parts: list[tuple[int, bytes]], texts: list[str | None]) -> int:
+    """Decode pack slices into `texts`; returns how many decoded."""
+    decoded = 0
+    for i, part in parts:
+        try:
+            texts[i] = storage_service.decode_chapter_bytes(part, book_id)
+        except Exception:
+            # Truncated or corrupt slice — read it on its own.
+            continue
+        decoded += 1
+    return decoded
+
+
+async def rebuild_pack(book_id: str) -> dict:
+    """(Re)write the book's pack, reusing every entry that is still current.
+    Returns counts for logging / the admin endpoint. Runs at BULK priority."""
+    with storage_service.priority(storage_service.BULK):
+        return await _rebuild_pack(book_id)
+
+
+async def _book_exists(book_id: str) -> bool:
+    book = await database.execute(
+        database.get_client().table("books").select("id").eq("id", book_id).maybe_single()
+    )
+    return bool(book and book.data)
+
+
+async def _rebuild_pack(book_id: str) -> dict:
+    if not await _book_exists(book_id):
+        # Deleted after the countdown started (possibly in another worker).
+        return {"chapters": 0, "reused": 0, "downloaded": 0, "bytes": 0}
+    rows = await database.fetch_all_chapters(book_id, "id,updated_at,text_storage_path")
+    rows = [r for r in rows if r.get("text_storage_path") and r.get("updated_at")]
+    if not rows:
+        # Nothing to pack; readers of a book with no chapters never look.
+        return {"chapters": 0, "reused": 0, "downloaded": 0, "bytes": 0}
+
+    old_index = await load_index(book_id)
+    old_entries = _entries(old_index) if old_index else {}
+    reusable = [r for r in rows if old_entries.get(r["id"], ("",))[0] == r["updated_at"]]
+    old_blob = b""
+    if reusable and old_index is not None:
+        try:
+            old_blob = await storage_service._async_download(
+                CHAPTER_PACK_BUCKET,
+                _pack_path(book_id, old_index["generation"]),
+                old_index["generation"],
+            )
+        except Exception as e:
+            logger.warning("Previous chapter pack unreadable for book %s: %s", book_id, e)
+
+    parts: list[bytes | None] = [None] * len(rows)
+    reused = 0
+    for i, row in enumerate(rows):
+        entry = old_entries.get(row["id"])
+        if entry is None or entry[0] != row["updated_at"]:
+            continue
+        part = old_blob[entry[1]:entry[1] + entry[2]]
+        if len(part) == entry[2] and storage_service.is_compressed_chapter(part):
+            parts[i] = part
+            reused += 1
+
+    # Straight to Storage rather than download_chapter_object: a whole book
+    # pushed through chapter_text_cache would evict every listener's chapter.
+    async def _download(i: int) -> None:
+        row = rows[i]
+        try:
+            data = await storage_service._async_download(
+                storage_service.CHAPTER_TEXT_BUCKET,
+                row["text_storage_path"],
+                row["updated_at"],
+            )
+        except Exception as e:
+            # Left out of the pack; readers fetch it on its own.
+            logger.warning("Chapter pack: skipping chapter %s: %s", row["id"], e)
+            return
+        # Legacy plain-UTF-8 objects are gzipped so every entry is compressed.
+        parts[i] = (
+            data if storage_service.is_compressed_chapter(data)
+            else storage_service._gzip_compress(data)
+        )
+
+    downloaded = [i for i, part in enumerate(parts) if part is None]
+    await storage_service.fan_out(_download, downloaded)
+
+    entries: list[list] = []
+    chunks: list[bytes] = []
+    offset = 0
+    for row, part in zip(rows, parts):
+        if part is None:
+            continue
+        entries.append([row["id"], row["updated_at"], offset, len(part)])
+        chunks.append(part)
+        offset += len(part)
+    blob = b"".join(chunks)
+    del chunks, old_blob
+
+    generation = uuid.uuid4().hex[:12]
+    index = {
+        "format": PACK_FORMAT,
+        "book_id": book_id,
+        "generation": generation,
+        "size": len(blob),
+        "entries": entries,
+    }
+    # Pack first, index last: the index must never name a pack that isn't
+    # there yet.
+    await storage_service._async_upload(
+        CHAPTER_PACK_BUCKET,
+        _pack_path(book_id, generation),
+        blob,
+        "application/octet-stream",
+    )
+    await storage_service._async_upload(
+        CHAPTER_PACK_BUCKET,
+        _index_path(book_id),
+        gzip.compress(json.dumps(index, separators=(",", ":")).encode("utf-8")),
+        "application/gzip",
+        "no-cache",
+    )
+    if old_index is not None and old_index["generation"] != generation:
+        await storage_service.delete_path(
+            CHAPTER_PACK_BUCKET, _pack_path(book_id, old_index["generation"])
+        )
+    if not await _book_exists(book_id):
+        # The book was deleted while we were packing it (its delete gave up
+        # waiting for us): take back what we just wrote.
+        await storage_service.delete_folder(CHAPTER_PACK_BUCKET, book_id)
+        return {"chapters": 0, "reused": 0, "downloaded": 0, "bytes": 0}
+
+    result = {
+        "chapters": len(entries),
+        "reused": reused,
+        "downloaded": len(downloaded),
+        "bytes": len(blob),
+    }
+    logger.info("Chapter pack for book %s rebuilt: %s", book_id, result)
+    return result
+
+
+def mark_dirty(book_id: str) -> None:
+    """A chapter of `book_id` was written: (re)start its rebuild countdown.
+    No-op outside a running event loop (scripts), where nothing would be
+    around to run the rebuild."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    timer = _timers.pop(book_id, None)
+    if timer is not None:
+        timer.cancel()
+    _timers[book_id] = loop.call_later(REBUILD_DELAY_SECONDS, _start_rebuild, book_id)
+
+
+def cancel(book_id: str) -> None:
+    """Drop a pending rebuild, in every worker (the book is being deleted,
+    or rebuilt right now)."""
+    _cancel_local(book_id)
+    coordination.broadcast("chapter_pack.cancel", book_id)
+
+
+def _cancel_local(book_id: str) -> None:
+    timer = _timers.pop(book_id, None)
+    if timer is not None:
+        timer.cancel()
+
+
+coordination.subscribe("chapter_pack.cancel", _cancel_local)
+
+
+async def hold_for_delete(book_id: str) -> coordination.Lease | None:
+    """Take the book's rebuild lease for a delete, waiting up to
+    DELETE_WAIT_SECONDS for a rebuild in flight (in any worker) to finish.
+    While it is held no rebuild can start. None if the wait ran out — the
+    rebuild then notices the book is gone and cleans up after itself."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + DELETE_WAIT_SECONDS
+    while True:
+        lease = await coordination.acquire(rebuild_lease_name(book_id))
+        if lease is not None or loop.time() >= deadline:
+            return lease
+        await asyncio.sleep(1.0)
+
+
+def _start_rebuild(book_id: str) -> None:
+    _timers.pop(book_id, None)
+    if book_id in _rebuilding:
+        # Writes landed during a rebuild; go again once it settles.
+        mark_dirty(book_id)
+        return
+    _rebuilding.add(book_id)
+    task = asyncio.create_task(_rebuild_quietly(book_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _rebuild_quietly(book_id: str) -> None:
+    lease = None
+    try:
+        lease = await coordination.acquire(rebuild_lease_name(book_id))
+        if lease is None:
+            # Another worker is repacking this book; ours may include writes
+            # it missed, so go again after the quiet period.
+            mark_dirty(book_id)
+            return
+        await rebuild_pack(book_id)
+        _stats["rebuilds"] += 1
+    except Exception as e:
+        # e.g. the pack outgrew the project's upload size limit — readers
+        # keep falling back to per-chapter objects.
+        _stats["rebuild_failures"] += 1
+        logger.warning("Chapter pack rebuild failed for book %s: %s", book_id, e)
+    finally:
+        if lease is not None:
+            await lease.release()
+        _rebuilding.discard(book_id)
+
+
+def stats() -> dict:
+    return {**_stats, "pending": len(_timers), "rebuilding": len(_rebuilding)}
@@ -0,0 +1,432 @@
+"""In-process LRU cache for chapter-text objects.
+
+`GET /api/chapters/{id}/text` is the hottest endpoint in the app, and at the
+evening peak hundreds of listeners sit on the same few dozen chapters. Without
+a cache every one of those requests paid a full Storage GET for bytes another
+listener was served a second earlier.
+
+Entries are the object bytes exactly as Storage returned them (gzip for every
+object written since compression landed, plain UTF-8 for legacy ones) — ~3x
+denser than decoded text, and decoding on a hit is a sub-millisecond gunzip.
+
+Keyed by (text_storage_path, updated_at). The trg_chapters_updated_at trigger
+bumps updated_at on every write, so an admin edit reads through to a fresh
+key and the old entry simply ages out of the LRU — no explicit invalidation.
+Callers without a version are never cached: nothing would tell us the entry
+went stale.
+
+Below the memory tier sits a size-capped directory of the same objects, so a
+restart or deploy doesn't start fully cold — the first hour after a deploy
+used to be the slowest of the day. Point CHAPTER_TEXT_DISK_CACHE_DIR at a
+mounted volume to carry it across deploys too (the container's own disk only
+survives process restarts); an empty value disables the tier.
+
+With several uvicorn workers the directory is split, not shared: each worker
+claims a slot lease and keeps its own subdirectory (worker-0, worker-1, …)
+with its share of CHAPTER_TEXT_DISK_CACHE_MB. Sharing one directory would
+have every worker index and evict the same files against the full budget
+each, so the tier grew to N times its size and the workers deleted each
+other's files. A worker without a slot (all taken while old workers drain
+during a deploy, or its lease lost) runs without the disk tier until it gets
+one. Files a different WEB_CONCURRENCY left behind aren't indexed; clear the
+directory when changing it.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import settings
+from app.services import coordination
+
+logger = logging.getLogger(__name__)
+
+CacheKey = tuple[str, str]
+
+
+class ByteBudgetLRU:
+    """LRU bounded by the total size of its values rather than entry count.
+
+    Thread-safe: the async text path touches it from the event loop, while
+    storage fan-out and the sync handlers reach it from worker threads.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[CacheKey, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: CacheKey) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: CacheKey, value: bytes) -> None:
+        size = len(value)
+        # One huge object must not flush the whole working set.
+        if size > self.max_bytes // 8:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += size
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def latest(self, path: str) -> Optional[tuple[str, bytes]]:
+        """Most recently used (version, value) cached for `path` under any
+        version. A linear scan — only for the outage fallback, never the
+        hot path. Doesn't count as a hit or touch recency."""
+        with self._lock:
+            for key in reversed(self._entries):
+                if key[0] == path:
+                    return key[1], self._entries[key]
+        return None
+
+    def __contains__(self, key: CacheKey) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class DiskCache:
+    """Size-capped directory of cached objects, LRU by file mtime.
+
+    Recency is tracked with mtime (bumped on every hit) rather than atime,
+    which relatime/noatime mounts don't update reliably. The in-memory index
+    is rebuilt from a directory scan on first use, so it survives restarts
+    exactly as far as the directory does. Objects are ~10–40 KB, so a plain
+    read() is as fast as mmap here and avoids holding mappings open.
+
+    All methods do blocking file I/O — call them from worker threads.
+    """
+
+    def __init__(self, root: str, max_bytes: int) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _file(self, key: CacheKey) -> str:
+        digest = hashlib.sha1(f"{key[0]}\0{key[1]}".encode("utf-8")).hexdigest()
+        return os.path.join(digest[:2], digest)
+
+    def _load_index(self) -> None:
+        """Scan the directory once; oldest mtime first = LRU order."""
+        found: list[tuple[float, str, int]] = []
+        self._loaded = True
+        try:
+            os.makedirs(self.root, exist_ok=True)
+        except OSError as e:
+            # Unwritable cache dir: every get misses and every put fails
+            # softly, i.e. we run without the disk tier.
+            logger.warning("Chapter-text disk cache unavailable (%s): %s", self.root, e)
+            return
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                full = os.path.join(dirpath, name)
+                if name.endswith(".tmp"):
+                    # Half-written file from a process killed mid-put.
+                    try:
+                        os.unlink(full)
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, os.path.relpath(full, self.root), st.st_size))
+        found.sort()
+        for _, rel, size in found:
+            self._index[rel] = size
+            self._size += size
+        logger.info(
+            "Chapter-text disk cache: indexed %d objects (%d bytes) in %s",
+            len(self._index), self._size, self.root,
+        )
+
+    def get(self, key: CacheKey) -> Optional[bytes]:
+        rel = self._file(key)
+        with self._lock:
+            if not self._loaded:
+                self._load_index()
+            if rel not in self._index:
+                self.misses += 1
+                return None
+        full = os.path.join(self.root, rel)
+        try:
+            with open(full, "rb") as f:
+                data = f.read()
+            os.utime(full)
+        except OSError:
+            # Removed behind our back (manual cleanup, disk wiped) — forget it.
+            with self._lock:
+                size = self._index.pop(rel, None)
+                if size is not None:
+                    self._size -= size
+                self.misses += 1
+            return None
+        with self._lock:
+            if rel in self._index:
+                self._index.move_to_end(rel)
+            self.hits += 1
+        return data
+
+    def put(self, key: CacheKey, data: bytes) -> None:
+        rel = self._file(key)
+        full = os.path.join(self.root, rel)
+        try:
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+            # Write-then-rename so a reader never sees a partial object.
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(full), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, full)
+        except OSError as e:
+            logger.warning("Chapter-text disk cache write failed (%s): %s", rel, e)
+            return
+        victims: list[str] = []
+        with self._lock:
+            if not self._loaded:
+                self._load_index()
+            old = self._index.pop(rel, None)
+            if old is not None:
+                self._size -= old
+            self._index[rel] = len(data)
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._index) > 1:
+                victim, size = self._index.popitem(last=False)
+                self._size -= size
+                self.evictions += 1
+                victims.append(victim)
+        for victim in victims:
+            try:
+                os.unlink(os.path.join(self.root, victim))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "root": self.root,
+                "entries": len(self._index),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_cache = ByteBudgetLRU(settings.chapter_text_cache_mb * 1024 * 1024)
+# Set by start(): this worker's directory, and the slot lease that makes it
+# this worker's alone (None with a single worker, which needs none).
+_disk: Optional[DiskCache] = None
+_disk_lease: Optional[coordination.Lease] = None
+_claim_task: Optional[asyncio.Task] = None
+# How often a worker without a slot retries, and checks it still has one.
+_SLOT_CHECK_SECONDS = 30.0
+
+
+def get(path: str, version: Optional[str]) -> Optional[bytes]:
+    """Cached object bytes for (path, version), or None on a miss."""
+    if not version:
+        return None
+    return _cache.get((path, version))
+
+
+def contains(path: str, version: Optional[str]) -> bool:
+    """Memory-tier membership without touching hit/miss counters or recency."""
+    return bool(version) and (path, version) in _cache
+
+
+def put(path: str, version: Optional[str], data: bytes) -> None:
+    if not version:
+        return
+    _cache.put((path, version), data)
+
+
+_stale_served = 0
+
+
+def get_stale(path: str) -> Optional[tuple[str, bytes]]:
+    """(version, bytes) of whatever copy of `path` the memory tier still
+    holds, possibly outdated. Only for serving *something* while Storage is
+    unreachable — the caller must label it with the returned version, never
+    the requested one, so clients refetch once Storage is back."""
+    global _stale_served
+    found = _cache.latest(path)
+    if found is not None:
+        _stale_served += 1
+    return found
+
+
+# Finished gzip'd JSON bodies for GET /api/chapters/{id}/text share the memory
+# budget under their own key namespace — chapter-text paths always contain a
+# "/", chapter ids never do, so the two can't collide.
+_ENVELOPE_PREFIX = "envelope:"
+
+
+def envelope_get(chapter_id: str, version: Optional[str]) -> Optional[bytes]:
+    """Pre-gzipped JSON response body for (chapter_id, version), or None."""
+    if not version:
+        return None
+    return _cache.get((_ENVELOPE_PREFIX + chapter_id, version))
+
+
+def envelope_put(chapter_id: str, version: Optional[str], body: bytes) -> None:
+    if not version:
+        return
+    _cache.put((_ENVELOPE_PREFIX + chapter_id, version), body)
+
+
+def disk_slot_lease_name(slot: int) -> str:
+    return f"chapter-text-disk:{slot}"
+
+
+def _load_disk_index(disk: DiskCache) -> None:
+    with disk._lock:
+        if not disk._loaded:
+            disk._load_index()
+
+
+async def start() -> None:
+    """Set up the disk tier at startup and index it in a thread, so the
+    directory scan isn't paid by the first reader after a restart. With
+    several workers this claims a slot first, retrying in the background
+    while every slot is taken."""
+    global _disk, _claim_task
+    root = settings.chapter_text_disk_cache_dir
+    if not root:
+        return
+    max_bytes = settings.chapter_text_disk_cache_mb * 1024 * 1024
+    workers = max(1, settings.web_concurrency)
+    if workers == 1:
+        disk = DiskCache(root, max_bytes)
+        await asyncio.to_thread(_load_disk_index, disk)
+        _disk = disk
+        return
+    if _claim_task is None:
+        _claim_task = asyncio.create_task(_hold_slot(root, max_bytes // workers, workers))
+
+
+async def _hold_slot(root: str, max_bytes: int, workers: int) -> None:
+    global _disk, _disk_lease
+    while True:
+        lease, slot = None, None
+        for i in range(workers):
+            try:
+                lease = await coordination.acquire(disk_slot_lease_name(i))
+            except Exception as e:
+                logger.warning("Chapter-text disk slot %d: %s", i, e)
+                continue
+            if lease is not None:
+                slot = i
+                break
+        if lease is None:
+            await asyncio.sleep(_SLOT_CHECK_SECONDS)
+            continue
+        try:
+            disk = DiskCache(os.path.join(root, f"worker-{slot}"), max_bytes)
+            await asyncio.to_thread(_load_disk_index, disk)
+            _disk, _disk_lease = disk, lease
+            while not lease.lost:
+                await asyncio.sleep(_SLOT_CHECK_SECONDS)
+            logger.warning("Chapter-text disk slot %d lost; claiming another", slot)
+        finally:
+            _disk = _disk_lease = None
+            await lease.release()
+
+
+async def stop() -> None:
+    """Give up the disk slot (the next worker may take it at once)."""
+    global _claim_task
+    if _claim_task is not None:
+        _claim_task.cancel()
+        try:
+            await _claim_task
+        except asyncio.CancelledError:
+            pass
+        _claim_task = None
+
+
+def _active_disk() -> Optional[DiskCache]:
+    """This worker's disk tier, or None while it has none — including the
+    window between losing its slot lease and _hold_slot noticing, when
+    another worker may already own the directory."""
+    disk, lease = _disk, _disk_lease
+    if disk is None or (lease is not None and lease.lost):
+        return None
+    return disk
+
+
+def disk_enabled(version: Optional[str]) -> bool:
+    """Whether disk_get / disk_put would do anything for this version — lets
+    async callers skip the worker-thread hop when they wouldn't."""
+    return bool(version) and _active_disk() is not None
+
+
+def disk_get(path: str, version: Optional[str]) -> Optional[bytes]:
+    """Disk-tier lookup. Blocking file I/O — worker threads only."""
+    disk = _active_disk()
+    if not version or disk is None:
+        return None
+    return disk.get((path, version))
+
+
+def disk_put(path: str, version: Optional[str], data: bytes) -> None:
+    """Disk-tier insert. Blocking file I/O — worker threads only."""
+    disk = _active_disk()
+    if not version or disk is None:
+        return
+    disk.put((path, version), data)
+
+
+def stats() -> dict:
+    out = _cache.stats()
+    out["stale_served"] = _stale_served
+    disk = _active_disk()
+    out["disk"] = disk.stats() if disk is not None else None
+    return out
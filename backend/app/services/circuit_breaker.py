@@ -0,0 +1,234 @@
+"""Circuit breakers and a retry budget for calls to Supabase.
+
+When Supabase degrades, every caller used to find out on its own: each
+Storage call retried up to 4 times with multi-second sleeps, each PostgREST
+call waited out its timeout, and the combined retry traffic landed on a
+backend that was already failing — while FastAPI's worker threads sat in
+time.sleep.
+
+Two mechanisms, shared process-wide:
+
+  * CircuitBreaker — one per dependency key ("storage:chapter-text:download",
+    "postgrest:chapters:read", ...). It watches a rolling window of outcomes;
+    once enough calls have failed it opens and calls fail fast with
+    CircuitOpenError instead of reaching Supabase. After a cool-down it lets
+    a single probe through (half-open): success closes it, failure re-opens
+    it with a longer cool-down. Only failures that say something about
+    Supabase's health count (5xx, 429, timeouts, dropped connections) — a 404
+    or a constraint violation is a healthy answer.
+
+  * RetryBudget — a token bucket that caps retries at a fraction of first
+    attempts (plus a small steady allowance), so retries can't multiply
+    traffic during an outage. Once it is empty, a failed call raises its
+    error instead of retrying.
+
+Both are thread-safe: Storage is reached from the event loop and from worker
+threads (scripts, sync handlers), PostgREST only from worker threads.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """The dependency is considered down; the call was not attempted."""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"{name} unavailable (circuit open, retry in {retry_after:.0f}s)")
+
+
+class RetryBudgetExhausted(CircuitOpenError):
+    """A retry was due but the retry budget is spent. Same meaning for the
+    caller as an open circuit: the dependency is struggling, back off."""
+
+
+class CircuitBreaker:
+    # Rolling window the failure rate is computed over.
+    WINDOW_SECONDS = 30.0
+    # Don't judge a dependency on a handful of calls.
+    MIN_CALLS = 10
+    FAILURE_RATE = 0.5
+    OPEN_SECONDS = 5.0
+    MAX_OPEN_SECONDS = 60.0
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.state = CLOSED
+        self._outcomes: deque[tuple[float, bool]] = deque()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._open_for = self.OPEN_SECONDS
+        self._probing = False
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0, "closed": 0}
+
+    def _trim(self, now: float) -> None:
+        while self._outcomes and now - self._outcomes[0][0] > self.WINDOW_SECONDS:
+            _, ok = self._outcomes.popleft()
+            if not ok:
+                self._failures -= 1
+
+    def _open(self, now: float, reason: str) -> None:
+        self.state = OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        self._failures = 0
+        self._stats["opened"] += 1
+        logger.warning(f"Circuit {self.name} opened ({reason}); failing fast for {self._open_for:.0f}s")
+
+    def _admit(self) -> bool:
+        """True when this call is the half-open probe. Raises CircuitOpenError
+        when the call must not go out."""
+        now = time.monotonic()
+        with self._lock:
+            self._stats["calls"] += 1
+            if self.state == OPEN:
+                remaining = self._opened_at + self._open_for - now
+                if remaining > 0:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpenError(self.name, remaining)
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpenError(self.name, 1.0)
+                self._probing = True
+                return True
+            return False
+
+    def _record(self, probe: bool, ok: bool | None) -> None:
+        """ok=None: the call ended without a verdict (cancelled)."""
+        now = time.monotonic()
+        with self._lock:
+            if probe:
+                self._probing = False
+                if ok is None:
+                    return
+                if ok:
+                    self.state = CLOSED
+                    self._open_for = self.OPEN_SECONDS
+                    self._stats["closed"] += 1
+                    logger.info(f"Circuit {self.name} closed (probe succeeded)")
+                else:
+                    self._stats["failures"] += 1
+                    self._open_for = min(self._open_for * 2, self.MAX_OPEN_SECONDS)
+                    self._open(now, "probe failed")
+                return
+            if ok is None or self.state != CLOSED:
+                return
+            self._trim(now)
+            self._outcomes.append((now, ok))
+            if not ok:
+                self._failures += 1
+                self._stats["failures"] += 1
+                if (
+                    len(self._outcomes) >= self.MIN_CALLS
+                    and self._failures / len(self._outcomes) >= self.FAILURE_RATE
+                ):
+                    self._open(
+                        now, f"{self._failures}/{len(self._outcomes)} calls failed"
+                    )
+
+    @contextmanager
+    def guard(self, is_failure: Callable[[BaseException], bool]):
+        """Wrap one attempt. Raises CircuitOpenError on entry instead of
+        running the body while the circuit is open; an exception from the
+        body counts against the dependency only if `is_failure` says so.
+        Yields a _Call whose `failed` the body sets for a failure that isn't
+        an exception (an HTTP 503 the caller still wants to return)."""
+        probe = self._admit()
+        call = _Call()
+        try:
+            yield call
+        except Exception as e:
+            self._record(probe, not is_failure(e))
+            raise
+        except BaseException:
+            # Cancelled / interrupted: no verdict, but free the probe.
+            self._record(probe, None)
+            raise
+        else:
+            self._record(probe, not call.failed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._trim(time.monotonic())
+            return {
+                "state": self.state,
+                "window_calls": len(self._outcomes),
+                "window_failures": self._failures,
+                **self._stats,
+            }
+
+
+class _Call:
+    __slots__ = ("failed",)
+
+    def __init__(self) -> None:
+        self.failed = False
+
+
+class RetryBudget:
+    """Token bucket: every first attempt deposits `ratio` tokens, time adds
+    `per_second`, a retry spends one. Retries can therefore add at most
+    ~ratio extra load on top of real traffic, however many callers fail."""
+
+    def __init__(self, ratio: float, per_second: float, burst: float) -> None:
+        self.ratio = ratio
+        self.per_second = per_second
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self._stats = {"retries": 0, "denied": 0}
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.per_second)
+        self._last = now
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens < 1.0:
+                self._stats["denied"] += 1
+                return False
+            self._tokens -= 1.0
+            self._stats["retries"] += 1
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {"tokens": round(self._tokens, 1), **self._stats}
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get(name: str) -> CircuitBreaker:
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def stats() -> dict:
+    return {name: breaker.stats() for name, breaker in sorted(_breakers.items())}
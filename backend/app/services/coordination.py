@@ -0,0 +1,401 @@
+"""Coordination between uvicorn workers: locks, job ownership and cache
+invalidation.
+
+Several pieces of state used to live in process memory on the assumption of
+a single uvicorn worker: the "a strip / auto-split is already running for
+this book" guards, the role/approval and catalog caches (invalidated
+directly by the handler that wrote), the progress buffer's per-user rows.
+With --workers N each worker has its own copy, so a guard set in one worker
+doesn't stop a run started through another, and an invalidation reaches only
+the worker that happened to serve the write.
+
+This module puts that behind one small interface with two backends:
+
+  * memory (default): everything in this process. Exactly the old
+    behaviour, and all a single worker needs.
+  * sqlite: one SQLite database in WAL mode on the container's disk, shared
+    by every worker on the host. WAL gives readers and the writer their own
+    paths, and each statement is a few microseconds against the page cache.
+
+Two primitives:
+
+  Leases — acquire(name) returns a Lease, or None if another holder (in any
+  worker) has it. It expires after LEASE_TTL_SECONDS unless renewed; the
+  holder renews it in the background while alive, so a worker that dies
+  mid-job frees its locks within one TTL instead of wedging them. holder()
+  tells who owns a job, e.g. to leave a book another worker is still
+  parsing alone.
+
+  Broadcast — broadcast(topic, payload) after a local invalidation;
+  subscribe(topic, handler) runs the handler in every *other* worker (the
+  sender already applied it). Delivery is by polling every
+  POLL_INTERVAL_SECONDS, so another worker may serve the stale value for
+  about a second; the caches' own TTLs stay as the safety net.
+
+Not shared, by design: the chapter-text LRU (keyed by version, so never
+stale), circuit breakers and retry budgets (per-process health), and the
+progress buffer's pending saves (each worker flushes its own; another worker
+sees a save once it is flushed, a few seconds later, and the flush never
+overwrites a newer save another worker flushed first).
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+LEASE_TTL_SECONDS = 60.0
+POLL_INTERVAL_SECONDS = 1.0
+# Broadcasts are only needed until every worker has polled them.
+EVENT_RETENTION_SECONDS = 300.0
+
+# Identifies this process in lease owners and as the origin of broadcasts.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class MemoryBackend:
+    """Single-process backend; broadcasts have nobody to reach."""
+
+    name = "memory"
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leases: dict[str, tuple[str, float]] = {}
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            held = self._leases.get(name)
+            if held is not None and held[1] > now:
+                return False
+            self._leases[name] = (owner, now + ttl)
+            return True
+
+    def renew(self, name: str, owner: str, ttl: float) -> bool:
+        with self._lock:
+            held = self._leases.get(name)
+            if held is None or held[0] != owner:
+                return False
+            self._leases[name] = (owner, time.time() + ttl)
+            return True
+
+    def release(self, name: str, owner: str) -> None:
+        with self._lock:
+            held = self._leases.get(name)
+            if held is not None and held[0] == owner:
+                del self._leases[name]
+
+    def holder(self, name: str) -> Optional[str]:
+        with self._lock:
+            held = self._leases.get(name)
+            if held is None or held[1] <= time.time():
+                return None
+            return held[0]
+
+    def publish(self, origin: str, topic: str, payload: str) -> None:
+        pass
+
+    def events_after(self, cursor: int) -> list[tuple[int, str, str, str]]:
+        return []
+
+    def last_event_id(self) -> int:
+        return 0
+
+    def prune(self, before: float) -> None:
+        pass
+
+
+class SQLiteBackend:
+    """Backend shared by every worker that opens the same database file."""
+
+    name = "sqlite"
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # sqlite3 connections belong to the thread that opened them; calls
+        # come from the event loop and from DB executor threads.
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL,"
+            " topic TEXT NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit: every statement below is atomic on its own.
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        cur = self._conn().execute(
+            "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)"
+            " ON CONFLICT(name) DO UPDATE SET owner = excluded.owner,"
+            " expires_at = excluded.expires_at WHERE leases.expires_at <= ?",
+            (name, owner, now + ttl, now),
+        )
+        return cur.rowcount == 1
+
+    def renew(self, name: str, owner: str, ttl: float) -> bool:
+        cur = self._conn().execute(
+            "UPDATE leases SET expires_at = ? WHERE name = ? AND owner = ?",
+            (time.time() + ttl, name, owner),
+        )
+        return cur.rowcount == 1
+
+    def release(self, name: str, owner: str) -> None:
+        self._conn().execute(
+            "DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner)
+        )
+
+    def holder(self, name: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT owner FROM leases WHERE name = ? AND expires_at > ?",
+            (name, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def publish(self, origin: str, topic: str, payload: str) -> None:
+        self._conn().execute(
+            "INSERT INTO events (origin, topic, payload, created_at) VALUES (?, ?, ?, ?)",
+            (origin, topic, payload, time.time()),
+        )
+
+    def events_after(self, cursor: int) -> list[tuple[int, str, str, str]]:
+        return self._conn().execute(
+            "SELECT id, origin, topic, payload FROM events WHERE id > ? ORDER BY id",
+            (cursor,),
+        ).fetchall()
+
+    def last_event_id(self) -> int:
+        row = self._conn().execute("SELECT MAX(id) FROM events").fetchone()
+        return row[0] or 0
+
+    def prune(self, before: float) -> None:
+        self._conn().execute("DELETE FROM events WHERE created_at < ?", (before,))
+        self._conn().execute("DELETE FROM leases WHERE expires_at < ?", (before,))
+
+
+def _make_backend():
+    kind = settings.coordination_backend
+    if kind == "auto":
+        kind = "sqlite" if settings.web_concurrency > 1 else "memory"
+    if kind == "sqlite":
+        return SQLiteBackend(settings.coordination_sqlite_path)
+    if kind != "memory":
+        raise ValueError(f"Unknown COORDINATION_BACKEND {kind!r}")
+    return MemoryBackend()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_handlers: dict[str, list[Callable[[Any], None]]] = {}
+_held: dict[str, "Lease"] = {}
+_cursor = 0
+_task: Optional[asyncio.Task] = None
+# Broadcasts being written from the event loop; strong refs so they aren't
+# GC'd mid-flight, and so stop() can wait for them.
+_publishing: set = set()
+_stats = {
+    "leases_acquired": 0, "leases_busy": 0, "leases_lost": 0,
+    "broadcasts_sent": 0, "broadcasts_received": 0, "errors": 0,
+}
+
+
+def _get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _make_backend()
+    return _backend
+
+
+class Lease:
+    """A held lock; renewed in the background until release()."""
+
+    def __init__(self, name: str, owner: str, ttl: float):
+        self.name = name
+        self.owner = owner
+        self.ttl = ttl
+        self.lost = False
+        self._renewal: Optional[asyncio.Task] = None
+
+    async def _renew_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                ok = await asyncio.to_thread(
+                    _get_backend().renew, self.name, self.owner, self.ttl
+                )
+            except Exception as e:
+                # Keep trying: one failed renewal still leaves two thirds of
+                # the TTL.
+                _stats["errors"] += 1
+                logger.warning("Lease %s renewal failed: %s", self.name, e)
+                continue
+            if not ok:
+                # Expired and taken over (this worker stalled longer than the
+                # TTL). The job keeps going; the guard no longer covers it.
+                self.lost = True
+                _stats["leases_lost"] += 1
+                logger.warning("Lease %s lost by %s", self.name, self.owner)
+                return
+
+    async def release(self) -> None:
+        if self._renewal is not None:
+            self._renewal.cancel()
+            self._renewal = None
+        _held.pop(self.owner, None)
+        try:
+            await asyncio.to_thread(_get_backend().release, self.name, self.owner)
+        except Exception as e:
+            # The lease runs out on its own within one TTL.
+            _stats["errors"] += 1
+            logger.warning("Lease %s release failed: %s", self.name, e)
+
+
+async def acquire(name: str, ttl: float = LEASE_TTL_SECONDS) -> Optional[Lease]:
+    """Take the lease `name`, or None if someone (in any worker) holds it."""
+    owner = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+    if not await asyncio.to_thread(_get_backend().acquire, name, owner, ttl):
+        _stats["leases_busy"] += 1
+        return None
+    lease = Lease(name, owner, ttl)
+    lease._renewal = asyncio.create_task(lease._renew_loop())
+    _held[owner] = lease
+    _stats["leases_acquired"] += 1
+    return lease
+
+
+def holder(name: str) -> Optional[str]:
+    """Owner of a live lease (WORKER_ID plus a per-lease suffix), or None.
+    Blocking, but local: no network round-trip."""
+    return _get_backend().holder(name)
+
+
+def subscribe(topic: str, handler: Callable[[Any], None]) -> None:
+    """Run `handler(payload)` for broadcasts on `topic` from other workers."""
+    _handlers.setdefault(topic, []).append(handler)
+
+
+def broadcast(topic: str, payload: Any = None) -> None:
+    """Tell the other workers. Call after applying the change locally.
+    Best effort: a failure is logged and left to the receivers' TTLs.
+
+    Never blocks the event loop: the SQLite write can wait out another
+    worker's write lock for seconds, so a call made on the loop is handed to
+    a thread and returns at once. Called from a worker thread, it writes
+    there and then."""
+    backend = _get_backend()
+    if not backend.shared:
+        return
+    message = json.dumps(payload)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        _publish(backend, topic, message)
+        return
+    task = asyncio.create_task(asyncio.to_thread(_publish, backend, topic, message))
+    _publishing.add(task)
+    task.add_done_callback(_publishing.discard)
+
+
+def _publish(backend, topic: str, message: str) -> None:
+    try:
+        backend.publish(WORKER_ID, topic, message)
+        _stats["broadcasts_sent"] += 1
+    except Exception as e:
+        _stats["errors"] += 1
+        logger.warning("Broadcast %s failed: %s", topic, e)
+
+
+def _dispatch(events: list[tuple[int, str, str, str]]) -> None:
+    global _cursor
+    for event_id, origin, topic, payload in events:
+        _cursor = max(_cursor, event_id)
+        if origin == WORKER_ID:
+            continue
+        _stats["broadcasts_received"] += 1
+        for handler in _handlers.get(topic, ()):
+            try:
+                handler(json.loads(payload))
+            except Exception as e:
+                _stats["errors"] += 1
+                logger.warning("Broadcast handler for %s failed: %s", topic, e)
+
+
+async def _poll_loop() -> None:
+    backend = _get_backend()
+    last_prune = 0.0
+    while True:
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+        try:
+            _dispatch(await asyncio.to_thread(backend.events_after, _cursor))
+            now = time.time()
+            if now - last_prune > EVENT_RETENTION_SECONDS / 5:
+                last_prune = now
+                await asyncio.to_thread(backend.prune, now - EVENT_RETENTION_SECONDS)
+        except Exception as e:
+            _stats["errors"] += 1
+            logger.warning("Coordination poll failed: %s", e)
+
+
+async def start() -> None:
+    """Open the backend and, if it is shared, start receiving broadcasts
+    from now on (older ones predate this worker's caches)."""
+    global _cursor, _task
+    backend = await asyncio.to_thread(_get_backend)
+    logger.info("Coordination backend: %s (worker %s)", backend.name, WORKER_ID)
+    if backend.shared and _task is None:
+        _cursor = await asyncio.to_thread(backend.last_event_id)
+        _task = asyncio.create_task(_poll_loop())
+
+
+async def stop() -> None:
+    """Stop polling, finish sending broadcasts and hand back every lease
+    this worker still holds."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    if _publishing:
+        await asyncio.gather(*_publishing, return_exceptions=True)
+    for lease in list(_held.values()):
+        await lease.release()
+
+
+def stats() -> dict:
+    backend = _backend
+    return {
+        **_stats,
+        "backend": backend.name if backend else None,
+        "worker": WORKER_ID,
+        "leases_held": len(_held),
+    }
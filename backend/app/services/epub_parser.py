@@ -10,11 +10,11 @@ from typing import Optional
 
 import ebooklib
 from ebooklib import epub
-from bs4 import BeautifulSoup
 
+from app import database
 from app.database import get_client
-from app.utils.text_cleaner import html_to_text
-from app.services import storage_service, text_cleanup
+from app.utils.text_cleaner import html_to_text_and_title
+from app.services import catalog_cache, storage_service, text_cleanup
 
 logger = logging.getLogger(__name__)
 
@@ -225,14 +225,6 @@ def auto_split_chapters(chapters_data: list[dict]) -> tuple[list[dict], list[str
 VALID_MEDIA_TYPES = {ebooklib.ITEM_DOCUMENT}
 
 
-def _extract_chapter_title(soup: BeautifulSoup, fallback: str) -> str:
-    for tag in ["h1", "h2", "h3"]:
-        el = soup.find(tag)
-        if el and el.get_text(strip=True):
-            return el.get_text(strip=True)[:200]
-    return fallback
-
-
 def _get_cover_image(book: epub.EpubBook) -> Optional[bytes]:
     # Try cover item
     for item in book.get_items():
@@ -268,50 +260,53 @@ def _friendly_parse_error(exc: Exception) -> str:
     return f"{friendly} ({detail})"[:1000]
 
 
-# Parse-time chapter-text uploads run at this concurrency. Capped at 8 because
-# higher values overwhelm storage3's shared connection and Supabase starts
-# closing streams (see storage_service.STORAGE_CONCURRENCY).
-_UPLOAD_CONCURRENCY = 8
-
 # Strong refs to background text-upload tasks so the event loop doesn't GC them
-# mid-flight after parse_epub_task returns.
+# mid-flight after parse_epub_task returns. Per process on purpose: the tasks
+# live in this worker's event loop.
 _deferred_text_tasks: set = set()
 
 
+def parse_lease_name(book_id: str) -> str:
+    """Coordination lease held by whichever worker is converting/parsing the
+    book, so start-up recovery in another worker leaves it alone."""
+    return f"parse:{book_id}"
+
+
 async def _upload_deferred_chapter_text(book_id: str, chapters: list[dict]) -> None:
     """Upload chapter text to Storage AFTER the chapter rows are inserted and the
     book has flipped to 'converting'. Each row already carries the deterministic
     text_storage_path ({book_id}/{chapter_id}.txt), so the book is fully browsable
     the moment it leaves 'parsing'; this just fills in the Storage objects off the
     parse critical path. A chapter whose upload fails is marked 'error' so it
-    surfaces in the admin UI and can be re-triggered."""
+    surfaces in the admin UI and can be re-triggered.
+
+    Runs at BULK priority: listeners' reads go first, and the storage
+    scheduler sets the pace."""
     db = get_client()
-    sem = asyncio.Semaphore(_UPLOAD_CONCURRENCY)
 
     async def _one(ch: dict) -> bool:
-        async with sem:
+        try:
+            await storage_service.upload_chapter_text(
+                book_id, ch["id"], ch["text_content"]
+            )
+            return True
+        except Exception as e:
+            logger.exception(
+                f"Book {book_id} chapter {ch['id']} ({ch.get('title')!r}) "
+                f"deferred text upload failed; marking errored"
+            )
             try:
-                await storage_service.upload_chapter_text(
-                    book_id, ch["id"], ch["text_content"]
-                )
-                return True
-            except Exception as e:
+                await database.execute(db.table("chapters").update({
+                    "status": "error",
+                    "error_message": f"{type(e).__name__}: {e}"[:1000],
+                }).eq("id", ch["id"]))
+            except Exception:
                 logger.exception(
-                    f"Book {book_id} chapter {ch['id']} ({ch.get('title')!r}) "
-                    f"deferred text upload failed; marking errored"
+                    f"Book {book_id}: could not mark chapter {ch['id']} errored"
                 )
-                try:
-                    db.table("chapters").update({
-                        "status": "error",
-                        "error_message": f"{type(e).__name__}: {e}"[:1000],
-                    }).eq("id", ch["id"]).execute()
-                except Exception:
-                    logger.exception(
-                        f"Book {book_id}: could not mark chapter {ch['id']} errored"
-                    )
-                return False
-
-    results = await asyncio.gather(*(_one(ch) for ch in chapters))
+            return False
+
+    results = await storage_service.fan_out(_one, chapters)
     failed = sum(1 for ok in results if not ok)
     if failed:
         logger.warning(
@@ -362,10 +357,13 @@ def extract_epub_contents(epub_bytes: bytes, book_id: str) -> dict:
 
         spine_ids = [iid for iid, _ in getattr(book, "spine", [])]
         if spine_ids:
-            ordered_items = [
-                book.get_item_with_id(iid)
-                for iid in spine_ids
-            ]
+            # book.get_item_with_id scans every item per call — quadratic over
+            # a few-thousand-item spine. First item wins on duplicate ids, as
+            # with get_item_with_id.
+            items_by_id: dict = {}
+            for item in book.get_items():
+                items_by_id.setdefault(item.get_id(), item)
+            ordered_items = [items_by_id.get(iid) for iid in spine_ids]
             ordered_items = [
                 i for i in ordered_items
                 if i is not None and i.get_type() == ebooklib.ITEM_DOCUMENT
@@ -391,17 +389,15 @@ def extract_epub_contents(epub_bytes: bytes, book_id: str) -> dict:
             # Decode only when we got bytes.
             raw = item.get_content()
             html_content = raw.decode("utf-8", errors="replace") if isinstance(raw, bytes) else raw
-            soup = BeautifulSoup(html_content, "lxml")
-            text = html_to_text(html_content)
+            # One parse yields both the text and the h1/h2/h3 title.
+            text, heading = html_to_text_and_title(html_content)
 
             # Skip very short items (TOC, copyright pages, etc.)
             if len(text) < 100:
                 skipped_short += 1
                 continue
 
-            chapter_title = _extract_chapter_title(
-                soup, f"Chương {idx + 1}"
-            )
+            chapter_title = heading or f"Chương {idx + 1}"
             word_count = len(text.split())
 
             chapters_data.append({
@@ -599,6 +595,18 @@ async def parse_epub_task(book_id: str, epub_bytes: bytes) -> None:
                 book_id, ch["id"]
             )
 
+        # Train the book's zstd dictionary before the first upload so every
+        # chapter is written against it. Best effort: without one the book is
+        # simply stored as gzip.
+        try:
+            await asyncio.to_thread(
+                storage_service.train_chapter_dictionary,
+                book_id,
+                [ch["text_content"] for ch in chapters_data],
+            )
+        except Exception as e:
+            logger.warning(f"Book {book_id}: no zstd dictionary, storing gzip: {e}")
+
         PREFETCH_AHEAD = 3
         prefetch = chapters_data[:PREFETCH_AHEAD]
         deferred = chapters_data[PREFETCH_AHEAD:]
@@ -637,7 +645,7 @@ async def parse_epub_task(book_id: str, epub_bytes: bytes) -> None:
             for ch in chapters_data
         ]
         for i in range(0, len(insert_rows), BATCH_SIZE):
-            db.table("chapters").insert(insert_rows[i:i + BATCH_SIZE]).execute()
+            await database.execute(db.table("chapters").insert(insert_rows[i:i + BATCH_SIZE]))
 
         # Update book metadata
         update_data: dict = {
@@ -649,7 +657,7 @@ async def parse_epub_task(book_id: str, epub_bytes: bytes) -> None:
         }
         if cover_url:
             update_data["cover_url"] = cover_url
-        db.table("books").update(update_data).eq("id", book_id).execute()
+        await database.execute(db.table("books").update(update_data).eq("id", book_id))
 
         logger.info(f"Book {book_id}: parsed {len(chapters_data)} chapters")
 
@@ -658,7 +666,8 @@ async def parse_epub_task(book_id: str, epub_bytes: bytes) -> None:
         # immediately usable. Mark it 'ready' straight away rather than
         # 'converting' (which used to mean "generating MP3s"). Chapters stay
         # 'pending' — the players read chapter text, not a stored-audio status.
-        db.table("books").update({"status": "ready"}).eq("id", book_id).execute()
+        await database.execute(db.table("books").update({"status": "ready"}).eq("id", book_id))
+        catalog_cache.invalidate()
 
         # Upload the remaining chapters' text in the background. The rows already
         # point at the right Storage paths, so the book is fully browsable now;
@@ -673,7 +682,8 @@ async def parse_epub_task(book_id: str, epub_bytes: bytes) -> None:
 
     except Exception as e:
         logger.exception(f"Error parsing book {book_id}: {e}")
-        db.table("books").update({
+        await database.execute(db.table("books").update({
             "status": "error",
             "error_message": _friendly_parse_error(e),
-        }).eq("id", book_id).execute()
+        }).eq("id", book_id))
+        catalog_cache.invalidate()
@@ -0,0 +1,211 @@
+"""bcrypt hashing and verification on a small dedicated process pool.
+
+A bcrypt verify is tens to hundreds of milliseconds of pure CPU with the GIL
+held. Run on FastAPI's sync-handler thread pool — where login and signup
+used to call passlib directly — a burst of logins after an app update
+starved every other sync endpoint (catalog, progress) of both threads and
+the GIL. In worker processes the hashing runs truly in parallel and the
+calling thread just waits on a future, GIL released.
+
+Admission is bounded: at most PASSWORD_HASH_WORKERS running plus
+PASSWORD_HASH_QUEUE waiting. Anything beyond that fails fast with
+HasherBusy (the auth router answers 503 + Retry-After) instead of queueing
+logins for longer than the client is going to wait.
+
+stats() reports queue wait and compute time percentiles plus the cost
+factor of recent hashes, for tuning the bcrypt rounds against throughput.
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Per call, covering queueing + compute. A verify taking this long means the
+# pool is wedged; the login answers 503 rather than hanging.
+TIMEOUT_SECONDS = 10.0
+_SAMPLES = 256
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(settings.password_hash_workers + settings.password_hash_queue)
+_stats_lock = threading.Lock()
+_counts = {"hash": 0, "verify": 0, "rejected": 0, "timeouts": 0}
+_in_flight = 0
+# op → recent (queue_ms, compute_ms)
+_samples: dict[str, deque] = {"hash": deque(maxlen=_SAMPLES), "verify": deque(maxlen=_SAMPLES)}
+_last_rounds: Optional[int] = None
+
+
+class HasherBusy(Exception):
+    """Every worker is busy and the queue is full."""
+
+    retry_after = 1
+
+
+# ── Worker-process side ──────────────────────────────────────────────────────
+# Module-level so the spawn start method can pickle them; the CryptContext is
+# built once per worker process.
+
+_context = None
+
+
+def _crypt_context():
+    global _context
+    if _context is None:
+        from passlib.context import CryptContext
+
+        _context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _context
+
+
+def _timed_hash(password: str) -> tuple[str, float, float]:
+    started = time.time()
+    result = _crypt_context().hash(password)
+    return result, started, time.time()
+
+
+def _timed_verify(password: str, password_hash: str) -> tuple[bool, float, float]:
+    started = time.time()
+    result = _crypt_context().verify(password, password_hash)
+    return result, started, time.time()
+
+
+def _warm() -> None:
+    _crypt_context()
+
+
+# ── Caller side ──────────────────────────────────────────────────────────────
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn, not fork: forking a process that already runs the
+                # event loop, httpx clients and a dozen threads can deadlock
+                # the child on a lock some thread held at fork time.
+                _pool = ProcessPoolExecutor(
+                    max_workers=settings.password_hash_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    logger.warning("Password hasher pool broke; restarting it")
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _run(op: str, fn, *args):
+    global _in_flight
+    if not _slots.acquire(blocking=False):
+        with _stats_lock:
+            _counts["rejected"] += 1
+        raise HasherBusy()
+    with _stats_lock:
+        _in_flight += 1
+    try:
+        submitted = time.time()
+        pool = _get_pool()
+        try:
+            future = pool.submit(fn, *args)
+            result, started, finished = future.result(timeout=TIMEOUT_SECONDS)
+        except TimeoutError:
+            future.cancel()
+            with _stats_lock:
+                _counts["timeouts"] += 1
+            raise HasherBusy()
+        except BrokenProcessPool:
+            # A worker died (OOM-killed, ...); the executor is unusable from
+            # here on. Start a fresh one for the next call.
+            _reset_pool(pool)
+            raise HasherBusy()
+        with _stats_lock:
+            _counts[op] += 1
+            _samples[op].append(
+                ((started - submitted) * 1000, (finished - started) * 1000)
+            )
+        return result
+    finally:
+        with _stats_lock:
+            _in_flight -= 1
+        _slots.release()
+
+
+def hash_password(password: str) -> str:
+    """Blocking (call from a sync handler). Raises HasherBusy."""
+    global _last_rounds
+    result = _run("hash", _timed_hash, password)
+    _last_rounds = _rounds(result)
+    return result
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """Blocking (call from a sync handler). Raises HasherBusy."""
+    global _last_rounds
+    _last_rounds = _rounds(password_hash)
+    return _run("verify", _timed_verify, password, password_hash)
+
+
+def _rounds(password_hash: str) -> Optional[int]:
+    # $2b$12$... — the cost factor is the third field.
+    try:
+        return int(password_hash.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def start() -> None:
+    """Spawn the workers now so the first login after a deploy doesn't pay
+    for process start-up and the passlib import."""
+    pool = _get_pool()
+    for _ in range(settings.password_hash_workers):
+        pool.submit(_warm)
+
+
+def shutdown() -> None:
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "max": None}
+    values = sorted(values)
+    return {
+        "p50": round(values[len(values) // 2], 1),
+        "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 1),
+        "max": round(values[-1], 1),
+    }
+
+
+def stats() -> dict:
+    with _stats_lock:
+        ops = {
+            f"{op}_latency": {
+                "queue_ms": _percentiles([q for q, _ in samples]),
+                "compute_ms": _percentiles([c for _, c in samples]),
+            }
+            for op, samples in _samples.items()
+        }
+        return {
+            **_counts,
+            "in_flight": _in_flight,
+            "workers": settings.password_hash_workers,
+            "queue_limit": settings.password_hash_queue,
+            "bcrypt_rounds": _last_rounds,
+            **ops,
+        }
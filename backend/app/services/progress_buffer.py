@@ -0,0 +1,364 @@
+"""Write-behind buffer for reading/listening progress.
+
+useProgressSync PUTs /api/progress every 5 s per active listener, and each
+save used to cost two PostgREST round-trips (the upsert, then a chapters
+lookup for chapter_index) on a worker thread. Nearly all of those writes are
+overwritten by the next one five seconds later.
+
+Saves now land here instead: the latest value per (user_id, book_id)
+replaces any pending one and the response is built from memory. A
+background task flushes whatever is pending to user_progress as one batched
+upsert every FLUSH_INTERVAL_SECONDS, and once more on shutdown. The GET
+endpoints read through the buffer (pending() / flush_user()), so a user
+always sees their own latest save.
+
+What a crash can lose is at most FLUSH_INTERVAL_SECONDS of position — the
+client re-sends within 5 s anyway, and keeps its own offline copy.
+
+Two small caches keep a steady-state save free of DB reads:
+  * chapter_id → (book_id, chapter_index, title), to validate the save and
+    answer with chapter_index. Reindexing paths call forget_book(). The
+    column itself is kept right by triggers in the database, never written
+    from here.
+  * (user_id, book_id) → user_progress.id, so the response carries the row
+    id and new rows get theirs before they are ever written.
+
+A third holds each recently-seen user's complete set of progress rows for
+POST /api/progress/batch (the library's progress bars): loaded with one
+query, updated in place by save(), dropped by forget_book().
+
+With several uvicorn workers each has its own buffer. forget_book() reaches
+the others through coordination, and every flush tells them whose rows it
+wrote so their cached user rows are reloaded; a save is visible from another
+worker once flushed. Consecutive saves for one book can land on different
+workers and be flushed in either order, so the write only replaces a row
+whose updated_at is older (the upsert_progress function).
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+import httpx
+
+from app import database
+from app.database import get_client
+from app.services import circuit_breaker, coordination
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SECONDS = 3.0
+# PostgREST request size stays reasonable; one upsert per chunk.
+FLUSH_CHUNK = 500
+# Chapter indexes move when an admin deletes/splits/inserts; forget_book()
+# handles our own writes, the TTL anything done straight in the database.
+# Either way only responses can be stale; the stored column can't.
+CHAPTER_TTL_SECONDS = 300.0
+MAX_CHAPTERS = 50_000
+MAX_ROW_IDS = 50_000
+USER_ROWS_TTL_SECONDS = 120.0
+MAX_USERS = 5_000
+
+_lock = threading.Lock()
+# Taking rows out of _pending and writing them happen under one lock, so two
+# flushes (the loop and a flush_user) can't land out of order and leave an
+# older position in the table.
+_write_lock = threading.Lock()
+# (user_id, book_id) → row as it will be upserted.
+_pending: dict[tuple[str, str], dict] = {}
+_chapters: "OrderedDict[str, tuple[str, Optional[int], Optional[str], float]]" = OrderedDict()
+_row_ids: "OrderedDict[tuple[str, str], str]" = OrderedDict()
+# user_id → (loaded_at, {book_id: row}).
+_user_rows: "OrderedDict[str, tuple[float, dict[str, dict]]]" = OrderedDict()
+_task: Optional[asyncio.Task] = None
+_stats = {
+    "saves": 0, "coalesced": 0, "flushes": 0, "rows_flushed": 0,
+    "flush_failures": 0, "dropped": 0, "user_rows_hits": 0, "user_rows_loads": 0,
+}
+
+# user_progress columns written by a flush. Not chapter_index: the database
+# fills that in from chapters on every write (trg_user_progress_chapter_index),
+# so a save buffered before a reindex can't write back the old position. The
+# one on a buffered row is only for answering reads until it's flushed.
+_COLUMNS = (
+    "id", "user_id", "book_id", "chapter_id",
+    "progress_value", "total_value", "updated_at",
+)
+
+
+class ChapterNotFound(Exception):
+    pass
+
+
+def chapter_info(chapter_id: str) -> tuple[str, Optional[int], Optional[str]]:
+    """(book_id, chapter_index, title) — blocking on a cache miss."""
+    now = time.monotonic()
+    with _lock:
+        hit = _chapters.get(chapter_id)
+        if hit is not None and now - hit[3] < CHAPTER_TTL_SECONDS:
+            _chapters.move_to_end(chapter_id)
+            return hit[0], hit[1], hit[2]
+    res = (
+        get_client().table("chapters")
+        .select("book_id,chapter_index,title")
+        .eq("id", chapter_id)
+        .maybe_single()
+        .execute()
+    )
+    if not res or not res.data:
+        raise ChapterNotFound(chapter_id)
+    row = res.data
+    with _lock:
+        _chapters[chapter_id] = (row["book_id"], row.get("chapter_index"), row.get("title"), now)
+        _chapters.move_to_end(chapter_id)
+        while len(_chapters) > MAX_CHAPTERS:
+            _chapters.popitem(last=False)
+    return row["book_id"], row.get("chapter_index"), row.get("title")
+
+
+def forget_book(book_id: str) -> None:
+    """The book's chapters were renumbered or removed."""
+    _forget_book_local(book_id)
+    coordination.broadcast("progress.forget_book", book_id)
+
+
+def _forget_book_local(book_id: str) -> None:
+    with _lock:
+        stale = [cid for cid, entry in _chapters.items() if entry[0] == book_id]
+        for cid in stale:
+            del _chapters[cid]
+        # Cached progress rows carry the book's old chapter_index values.
+        users = [uid for uid, (_, rows) in _user_rows.items() if book_id in rows]
+        for uid in users:
+            del _user_rows[uid]
+
+
+def _forget_users(user_ids: list[str]) -> None:
+    """Another worker wrote these users' progress."""
+    with _lock:
+        for uid in user_ids:
+            _user_rows.pop(uid, None)
+
+
+coordination.subscribe("progress.forget_book", _forget_book_local)
+coordination.subscribe("progress.flushed", _forget_users)
+
+
+def _row_id(user_id: str, book_id: str) -> str:
+    key = (user_id, book_id)
+    with _lock:
+        row_id = _row_ids.get(key)
+    if row_id is None:
+        res = (
+            get_client().table("user_progress")
+            .select("id")
+            .eq("user_id", user_id)
+            .eq("book_id", book_id)
+            .maybe_single()
+            .execute()
+        )
+        # A pair with no row yet gets its id now; the flush inserts it.
+        row_id = res.data["id"] if res and res.data else str(uuid.uuid4())
+        remember_row_id(user_id, book_id, row_id)
+    return row_id
+
+
+def remember_row_id(user_id: str, book_id: str, row_id: str) -> None:
+    with _lock:
+        _row_ids[(user_id, book_id)] = row_id
+        _row_ids.move_to_end((user_id, book_id))
+        while len(_row_ids) > MAX_ROW_IDS:
+            _row_ids.popitem(last=False)
+
+
+def save(
+    user_id: str,
+    book_id: str,
+    chapter_id: str,
+    progress_value: float,
+    total_value: Optional[float],
+) -> dict:
+    """Buffer a save and return the row as the client will later read it.
+    Raises ChapterNotFound / ValueError for a chapter that doesn't exist or
+    isn't in `book_id` — checked now, since a flush can't report back."""
+    chapter_book, chapter_index, _ = chapter_info(chapter_id)
+    if chapter_book != book_id:
+        raise ValueError(f"chapter {chapter_id} is not in book {book_id}")
+    row = {
+        "id": _row_id(user_id, book_id),
+        "user_id": user_id,
+        "book_id": book_id,
+        "chapter_id": chapter_id,
+        "progress_value": progress_value,
+        "total_value": total_value,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "chapter_index": chapter_index,
+    }
+    with _lock:
+        if (user_id, book_id) in _pending:
+            _stats["coalesced"] += 1
+        _pending[(user_id, book_id)] = row
+        _stats["saves"] += 1
+        cached = _user_rows.get(user_id)
+        if cached is not None:
+            cached[1][book_id] = row
+    return dict(row)
+
+
+def user_rows(user_id: str) -> dict[str, dict]:
+    """book_id → progress row for every book the user has progress on,
+    buffered saves included. Blocking: one query on a cache miss."""
+    now = time.monotonic()
+    with _lock:
+        cached = _user_rows.get(user_id)
+        if cached is not None and now - cached[0] < USER_ROWS_TTL_SECONDS:
+            _user_rows.move_to_end(user_id)
+            _stats["user_rows_hits"] += 1
+            return {book_id: dict(row) for book_id, row in cached[1].items()}
+    res = get_client().table("user_progress").select("*").eq("user_id", user_id).execute()
+    rows = {row["book_id"]: row for row in res.data or []}
+    for row in rows.values():
+        remember_row_id(user_id, row["book_id"], row["id"])
+    with _lock:
+        # Saves that landed while we were querying (or haven't been flushed)
+        # are newer than anything the query returned.
+        for (uid, book_id), row in _pending.items():
+            if uid == user_id:
+                rows[book_id] = row
+        _user_rows[user_id] = (now, rows)
+        _user_rows.move_to_end(user_id)
+        while len(_user_rows) > MAX_USERS:
+            _user_rows.popitem(last=False)
+        _stats["user_rows_loads"] += 1
+        return {book_id: dict(row) for book_id, row in rows.items()}
+
+
+def pending(user_id: str, book_id: str) -> Optional[dict]:
+    """The user's unflushed save for a book, if any."""
+    with _lock:
+        row = _pending.get((user_id, book_id))
+    return dict(row) if row else None
+
+
+def pending_for_user(user_id: str) -> list[dict]:
+    with _lock:
+        return [dict(row) for (uid, _), row in _pending.items() if uid == user_id]
+
+
+def _take(user_id: Optional[str] = None) -> list[dict]:
+    with _lock:
+        keys = [k for k in _pending if user_id is None or k[0] == user_id]
+        return [_pending.pop(k) for k in keys]
+
+
+def _requeue(rows: list[dict]) -> None:
+    """Put rows back after a failed flush — unless a newer save already
+    replaced them."""
+    with _lock:
+        for row in rows:
+            _pending.setdefault((row["user_id"], row["book_id"]), row)
+
+
+def _is_transient(exc: BaseException) -> bool:
+    return isinstance(exc, (circuit_breaker.CircuitOpenError, httpx.TransportError))
+
+
+def _upsert(rows: list[dict]) -> None:
+    # Conditional on updated_at (see upsert_progress in schema.sql): another
+    # worker may already have written a newer save for the same book.
+    get_client().rpc(
+        "upsert_progress", {"p_rows": [{k: row[k] for k in _COLUMNS} for row in rows]}
+    ).execute()
+
+
+def _write(rows: list[dict]) -> None:
+    """Blocking: upsert `rows` in chunks. A chunk rejected outright (a
+    chapter or book deleted since the save) is retried row by row so one bad
+    row doesn't sink the rest; transient failures go back in the buffer."""
+    for start in range(0, len(rows), FLUSH_CHUNK):
+        chunk = rows[start:start + FLUSH_CHUNK]
+        try:
+            _upsert(chunk)
+            _stats["rows_flushed"] += len(chunk)
+        except Exception as e:
+            if _is_transient(e):
+                _stats["flush_failures"] += 1
+                _requeue(rows[start:])
+                logger.warning("Progress flush deferred (%d rows): %s", len(rows) - start, e)
+                return
+            for row in chunk:
+                try:
+                    _upsert([row])
+                    _stats["rows_flushed"] += 1
+                except Exception as row_error:
+                    if _is_transient(row_error):
+                        _requeue([row])
+                        continue
+                    _stats["dropped"] += 1
+                    logger.warning(
+                        "Dropping progress save for user %s book %s: %s",
+                        row["user_id"], row["book_id"], row_error,
+                    )
+
+
+def flush_user(user_id: str) -> None:
+    """Blocking: write this user's pending saves now (read-your-writes for
+    queries that join user_progress in the database)."""
+    _flush_blocking(user_id)
+
+
+def _flush_blocking(user_id: Optional[str] = None) -> None:
+    with _write_lock:
+        rows = _take(user_id)
+        if rows:
+            _stats["flushes"] += 1
+            _write(rows)
+            coordination.broadcast(
+                "progress.flushed", sorted({row["user_id"] for row in rows})
+            )
+
+
+async def flush() -> None:
+    await database.run(_flush_blocking)
+
+
+async def _flush_loop() -> None:
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+        try:
+            await flush()
+        except Exception as e:
+            logger.warning("Progress flush failed: %s", e)
+
+
+def start() -> None:
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_flush_loop())
+
+
+async def stop() -> None:
+    """Stop the loop and write everything still pending."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    await flush()
+
+
+def stats() -> dict:
+    with _lock:
+        return {
+            **_stats,
+            "pending": len(_pending),
+            "chapters_cached": len(_chapters),
+            "users_cached": len(_user_rows),
+        }
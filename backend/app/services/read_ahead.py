@@ -0,0 +1,153 @@
+"""Predictive read-ahead for chapter text.
+
+Listeners move through a book almost strictly in order, so when chapter N is
+served, chapters N+1..N+k are resolved with one range query on chapter_index
+and pulled into chapter_text_cache in the background. The next request — the
+web player advancing, or the Android service's screen-off self-fetch — is
+then a pure cache hit instead of a Storage round-trip.
+
+k adapts to how often warmed entries are actually read: it grows while
+prefetches keep paying off and shrinks when they mostly go unread (skimmers,
+people jumping around a book), so read-ahead never costs much more Storage
+egress than it saves.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from app import database
+from app.database import get_client
+from app.services import chapter_text_cache, storage_service
+
+logger = logging.getLogger(__name__)
+
+MIN_AHEAD = 1
+MAX_AHEAD = 8
+# Outcomes (used / wasted) per adaptation step.
+_ADAPT_WINDOW = 50
+# A prefetched entry not read within this long counts as wasted: the listener
+# has stopped or jumped elsewhere, and at peak the memory tier has turned over
+# long before. The bound only matters when prefetches far outpace reads; the
+# oldest entries are then written off early.
+_TRACK_DEADLINE_SECONDS = 3600.0
+_MAX_TRACKED = 2000
+
+# Hundreds of listeners open the same chapter at peak; one warm pass per
+# chapter per window is enough, the rest would only repeat the range query.
+_RECENT_TTL_SECONDS = 300.0
+_MAX_RECENT = 5000
+
+_ahead = 3
+_recent: "OrderedDict[tuple[str, int], float]" = OrderedDict()
+# (path, version) → deadline; insertion order is deadline order.
+_tracked: "OrderedDict[tuple[str, str], float]" = OrderedDict()
+_warming: set[tuple[str, int]] = set()
+# Strong refs so the event loop doesn't GC a warming task mid-flight.
+_tasks: set = set()
+_stats = {"scheduled": 0, "prefetched": 0, "used": 0, "wasted": 0, "failed": 0}
+_window = {"used": 0, "wasted": 0}
+
+
+def _record(outcome: str) -> None:
+    global _ahead
+    _stats[outcome] += 1
+    _window[outcome] += 1
+    total = _window["used"] + _window["wasted"]
+    if total < _ADAPT_WINDOW:
+        return
+    ratio = _window["used"] / total
+    if ratio >= 0.6 and _ahead < MAX_AHEAD:
+        _ahead += 1
+    elif ratio < 0.3 and _ahead > MIN_AHEAD:
+        _ahead -= 1
+    _window["used"] = _window["wasted"] = 0
+
+
+def _expire(now: float) -> None:
+    while _tracked:
+        key, deadline = next(iter(_tracked.items()))
+        if deadline > now and len(_tracked) <= _MAX_TRACKED:
+            return
+        del _tracked[key]
+        _record("wasted")
+
+
+def note_served(path: str, version: str | None) -> None:
+    """Called for every chapter-text request that sends a body (not a 304):
+    counts a prefetch as used when its entry is the one being served."""
+    _expire(time.monotonic())
+    key = (path, version)
+    if version and key in _tracked:
+        del _tracked[key]
+        _record("used")
+
+
+def schedule(book_id: str, chapter_index: int) -> None:
+    """Warm chapters after `chapter_index` in the background. Cheap and
+    idempotent — call it on every chapter-text request."""
+    key = (book_id, chapter_index)
+    now = time.monotonic()
+    last = _recent.get(key)
+    if key in _warming or (last is not None and now - last < _RECENT_TTL_SECONDS):
+        return
+    _recent[key] = now
+    _recent.move_to_end(key)
+    while len(_recent) > _MAX_RECENT:
+        _recent.popitem(last=False)
+    _warming.add(key)
+    _stats["scheduled"] += 1
+    task = asyncio.create_task(_warm(book_id, chapter_index, _ahead))
+    _tasks.add(task)
+
+    def _done(t: asyncio.Task) -> None:
+        _tasks.discard(t)
+        _warming.discard(key)
+
+    task.add_done_callback(_done)
+
+
+async def _warm(book_id: str, chapter_index: int, ahead: int) -> None:
+    try:
+        db = get_client()
+        result = await database.execute(
+            db.table("chapters")
+            .select("text_storage_path,updated_at")
+            .eq("book_id", book_id)
+            .gt("chapter_index", chapter_index)
+            .lte("chapter_index", chapter_index + ahead)
+            .order("chapter_index")
+        )
+    except Exception as e:
+        logger.debug("read-ahead lookup failed for %s@%d: %s", book_id, chapter_index, e)
+        return
+    for row in result.data or []:
+        path, version = row.get("text_storage_path"), row.get("updated_at")
+        if not path or not version or chapter_text_cache.contains(path, version):
+            continue
+        # Background warming must never compete seriously with interactive
+        # reads: PREFETCH waits behind every queued listener request and never
+        # takes the slot the storage scheduler holds back for them.
+        with storage_service.priority(storage_service.PREFETCH):
+            try:
+                await storage_service.download_chapter_object(path, version)
+            except Exception as e:
+                _stats["failed"] += 1
+                logger.debug("read-ahead download failed (%s): %s", path, e)
+                continue
+        _stats["prefetched"] += 1
+        now = time.monotonic()
+        _tracked.pop((path, version), None)
+        _tracked[(path, version)] = now + _TRACK_DEADLINE_SECONDS
+        _expire(now)
+
+
+def stats() -> dict:
+    _expire(time.monotonic())
+    outcomes = _stats["used"] + _stats["wasted"]
+    return {
+        **_stats,
+        "ahead": _ahead,
+        "pending": len(_tracked),
+        "use_rate": round(_stats["used"] / outcomes, 4) if outcomes else 0.0,
+    }
@@ -1,20 +1,31 @@
 import asyncio
+import contextlib
+import contextvars
 import gzip
+import heapq
 import logging
 import random
+import threading
 import time
+import uuid
+from collections import OrderedDict
+
 import httpx
+import zstandard
 from storage3 import SyncStorageClient
 from app.config import settings
+from app.services import chapter_text_cache, circuit_breaker, coordination
+from app.services.circuit_breaker import CircuitOpenError
 
 logger = logging.getLogger(__name__)
 
 CHAPTER_TEXT_BUCKET = "chapter-text"
 
-# Concurrency limit for any caller fanning storage requests through gather().
-# Higher values overwhelm storage3's shared HTTP/2 connection and Supabase
-# starts closing streams; 8 matches the value the bulk-migration script
-# proved stable for this workload.
+# Starting concurrency for Storage requests. Higher fixed values overwhelmed
+# storage3's shared HTTP/2 connection and Supabase started closing streams; 8
+# matches what the bulk-migration script proved stable for this workload.
+# Scripts still use it as their worker count; async code goes through the
+# scheduler below, which starts here and adapts within [2, 2x].
 STORAGE_CONCURRENCY = 8
 
 _storage_client: SyncStorageClient | None = None
@@ -88,8 +99,8 @@ class StorageUploadError(Exception):
 
 # storage3 is a sync SDK — calling it directly from `async def` blocks the
 # event loop, so asyncio.gather() over these calls gives zero concurrency.
-# Run every storage HTTP call on the default thread pool so gather() actually
-# fans out.
+# Async code uses the native async transport below; the _sync_* helpers are
+# for scripts and worker threads.
 #
 # Under load Supabase intermittently closes the HTTP/2 stream
 # (httpcore.RemoteProtocolError: Server disconnected). storage3 has a bug
@@ -101,8 +112,16 @@ class StorageUploadError(Exception):
 _RETRY_MAX_ATTEMPTS = 4
 _TRANSIENT_HTTP_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
 
+# Retries may add ~20% on top of first attempts (plus one a second), however
+# many callers are failing at once — see circuit_breaker.RetryBudget. Shared
+# by every Storage op, sync and async.
+_retry_budget = circuit_breaker.RetryBudget(ratio=0.2, per_second=1.0, burst=20.0)
+
 
 def _is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, CircuitOpenError):
+        # Already failing fast; retrying would just fail fast again.
+        return False
     if isinstance(exc, StorageUploadError):
         return exc.status in _TRANSIENT_HTTP_STATUSES
     # httpx network/transport errors (connect, read, write, protocol) — but
@@ -125,16 +144,42 @@ def _is_transient(exc: BaseException) -> bool:
     )
 
 
-def _retry_sync(fn, *args, what: str = "storage op", **kwargs):
+def _breaker(bucket: str, op: str) -> circuit_breaker.CircuitBreaker:
+    """One breaker per (bucket, op): a failing upload path shouldn't stop
+    listeners' downloads, nor one bucket's trouble another's."""
+    return circuit_breaker.get(f"storage:{bucket}:{op}")
+
+
+def _may_retry(e: Exception, attempt: int, what: str) -> bool:
+    if attempt == _RETRY_MAX_ATTEMPTS - 1 or not _is_transient(e):
+        return False
+    if not _retry_budget.withdraw():
+        logger.warning(f"{what} failed ({type(e).__name__}: {e}); retry budget exhausted")
+        return False
+    return True
+
+
+def is_unavailable(exc: BaseException) -> bool:
+    """Storage is down or failing fast, as opposed to e.g. a missing object —
+    the cue for a caller to fall back to whatever it has cached."""
+    return isinstance(exc, CircuitOpenError) or _is_transient(exc)
+
+
+def _retry_sync(fn, *args, what: str = "storage op", breaker=None, **kwargs):
+    """Call fn with up to _RETRY_MAX_ATTEMPTS attempts on transient errors.
+    Each attempt goes through `breaker` (fails fast with CircuitOpenError
+    while it is open); each retry spends from the shared retry budget."""
     last_err: BaseException | None = None
+    _retry_budget.deposit()
     for attempt in range(_RETRY_MAX_ATTEMPTS):
         try:
-            return fn(*args, **kwargs)
+            with breaker.guard(_is_transient) if breaker else contextlib.nullcontext():
+                return fn(*args, **kwargs)
         except Exception as e:
             last_err = e
-            if attempt == _RETRY_MAX_ATTEMPTS - 1 or not _is_transient(e):
+            if not _may_retry(e, attempt, what):
                 raise
-            sleep = (2 ** attempt) + random.uniform(0, 0.5)
+            sleep = _backoff(attempt)
             logger.warning(
                 f"{what} attempt {attempt + 1}/{_RETRY_MAX_ATTEMPTS} failed "
                 f"({type(e).__name__}: {e}); retrying in {sleep:.1f}s"
@@ -144,6 +189,409 @@ def _retry_sync(fn, *args, what: str = "storage op", **kwargs):
     raise last_err
 
 
+def _backoff(attempt: int) -> float:
+    # Exponential with jitter, so a burst of callers that failed together
+    # doesn't retry in lockstep.
+    return (2 ** attempt) + random.uniform(0, 0.5)
+
+
+# ── Native asyncio transport ───────────────────────────────────────────────────
+# The sync functions below used to be the only transport: async callers ran
+# them on the default thread pool through asyncio.to_thread, so a gather of 8
+# downloads held 8 OS threads — the same pool FastAPI runs every sync `def`
+# handler on, so a whole-book fan-out left DB-bound handlers queued behind
+# Storage I/O. Async code now talks to Storage through an httpx.AsyncClient
+# with its own pool: concurrency is bounded by sockets, not threads. The sync
+# versions remain for scripts and for code already on a worker thread.
+
+_async_clients: dict[str, tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+
+
+def _get_async_client(public: bool = False) -> httpx.AsyncClient:
+    """AsyncClient for the running loop. "direct" mirrors _get_direct_client
+    (service key, HTTP/1.1 — same reasoning); "public" carries no credentials
+    and fetches the absolute public URLs stored on rows (cover_url,
+    audio_url). Re-created when the loop changes — a client's connections
+    belong to the loop that opened them, and every asyncio.run in a script is
+    a fresh loop."""
+    loop = asyncio.get_running_loop()
+    name = "public" if public else "direct"
+    entry = _async_clients.get(name)
+    if entry is not None and entry[0] is loop:
+        return entry[1]
+    limits = httpx.Limits(
+        max_connections=STORAGE_CONCURRENCY * 2,
+        max_keepalive_connections=STORAGE_CONCURRENCY * 2,
+    )
+    if public:
+        client = httpx.AsyncClient(timeout=30.0, http2=False, limits=limits)
+    else:
+        client = httpx.AsyncClient(
+            base_url=f"{settings.supabase_url}/storage/v1",
+            headers={
+                "apiKey": settings.supabase_service_key,
+                "Authorization": f"Bearer {settings.supabase_service_key}",
+            },
+            timeout=60.0,
+            http2=False,
+            limits=limits,
+        )
+    _async_clients[name] = (loop, client)
+    return client
+
+
+async def aclose() -> None:
+    """Close the async clients (app shutdown)."""
+    while _async_clients:
+        _, (_, client) = _async_clients.popitem()
+        await client.aclose()
+
+
+async def _retry_async(
+    fn, *args, what: str = "storage op", breaker=None, nbytes: int = 0, **kwargs
+):
+    """_retry_sync for coroutine functions: same attempts, same transient
+    classification, same breaker and retry budget, same jittered backoff —
+    slept with asyncio.sleep.
+
+    Every attempt holds a scheduler slot (and only the attempt: a backoff
+    sleep gives its slot to the next caller). `nbytes` is the request body
+    size; for downloads the response size is taken from the result."""
+    last_err: BaseException | None = None
+    _retry_budget.deposit()
+    for attempt in range(_RETRY_MAX_ATTEMPTS):
+        try:
+            # Breaker first: an open circuit fails fast instead of queueing
+            # for a slot.
+            with breaker.guard(_is_transient) if breaker else contextlib.nullcontext():
+                async with _scheduler.slot() as slot:
+                    slot.nbytes = nbytes
+                    result = await fn(*args, **kwargs)
+                    if isinstance(result, bytes):
+                        slot.nbytes += len(result)
+                    return result
+        except Exception as e:
+            last_err = e
+            if not _may_retry(e, attempt, what):
+                raise
+            sleep = _backoff(attempt)
+            logger.warning(
+                f"{what} attempt {attempt + 1}/{_RETRY_MAX_ATTEMPTS} failed "
+                f"({type(e).__name__}: {e}); retrying in {sleep:.1f}s"
+            )
+            await asyncio.sleep(sleep)
+    assert last_err is not None
+    raise last_err
+
+
+# ── Storage scheduler ──────────────────────────────────────────────────────────
+# Every caller fanning out to Storage used to build its own
+# asyncio.Semaphore(8): the deferred parse uploader, the EPUB export,
+# auto-split, strip-string, bulk delete, the pack rebuild. Each was fair to
+# itself and blind to the others, so two admin jobs plus read-ahead put 24+
+# requests on a pool sized for 16, and a listener's chapter queued behind a
+# 5,000-chapter re-upload on equal terms.
+#
+# Now every async Storage attempt (see _retry_async) takes a slot from one
+# process-wide scheduler:
+#
+#   * Priority classes. A request runs at the priority of the task that issued
+#     it — INTERACTIVE unless the caller wrapped its work in
+#     `with priority(PREFETCH | BULK):`. Tasks started inside the block
+#     (gather, create_task) inherit it through the context. Waiters are
+#     served best class first, FIFO within a class; one slot is held back
+#     for INTERACTIVE so a saturating bulk job never leaves a listener
+#     waiting out a whole request. Every 8th grant goes to the longest
+#     waiter regardless of class, so bulk work slows down but never stops.
+#
+#   * Adaptive total (AIMD). The limit starts at STORAGE_CONCURRENCY and
+#     grows by ~1 per limit's worth of successes while it is actually the
+#     bottleneck (someone was queued). It is cut by 30% when an attempt fails
+#     transiently (429 / 5xx / dropped connection) or when request latency
+#     climbs well above its recent baseline — Supabase slowing down is the
+#     early warning before it starts closing streams. Cuts are at most one
+#     per second, so one burst of failures doesn't collapse the limit to the
+#     floor. Bounded to [2, pool size].
+#
+# Event-loop only, like single_flight: no lock. The _sync_* helpers (scripts,
+# worker threads) don't go through it.
+#
+# A coalesced download (single_flight) runs at the priority of whichever
+# caller started it.
+
+INTERACTIVE = 0
+PREFETCH = 1
+BULK = 2
+_PRIORITY_NAMES = ("interactive", "prefetch", "bulk")
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "storage_priority", default=INTERACTIVE
+)
+
+
+@contextlib.contextmanager
+def priority(level: int):
+    """Run the Storage requests issued inside the block (and by tasks started
+    inside it) at `level`."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class _Slot:
+    __slots__ = ("nbytes",)
+
+    def __init__(self) -> None:
+        self.nbytes = 0
+
+
+class StorageScheduler:
+    # Latency samples only from requests this small: a 40 MB pack download is
+    # slow because it is big, not because Storage is struggling.
+    LATENCY_MAX_BYTES = 1024 * 1024
+    # Latency EWMA this many times the baseline counts as congestion.
+    LATENCY_CONGESTED = 2.5
+    # Below this baseline, ratios are noise (a cache hit in front of Storage).
+    LATENCY_FLOOR = 0.05
+    DECREASE_FACTOR = 0.7
+    DECREASE_COOLDOWN = 1.0
+    AGING_EVERY = 8
+
+    def __init__(self, initial: int, minimum: int, maximum: int) -> None:
+        self.limit = float(initial)
+        self.min_limit = minimum
+        self.max_limit = maximum
+        self.active = 0
+        # [priority, seq, future]; granted / cancelled entries are skipped
+        # lazily when they reach the top.
+        self._heap: list[list] = []
+        self._seq = 0
+        self._grants = 0
+        self._latency: float | None = None
+        self._baseline: float | None = None
+        self._last_decrease = 0.0
+        self._queued = [0, 0, 0]
+        self._stats = {"grants": [0, 0, 0], "waited": [0, 0, 0], "increases": 0,
+                       "decreases": 0, "congested": 0}
+
+    def _cap(self, level: int) -> int:
+        cap = int(self.limit)
+        return cap if level == INTERACTIVE else max(1, cap - 1)
+
+    def _top(self) -> list | None:
+        while self._heap and self._heap[0][2].done():
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
+
+    def _oldest(self) -> list | None:
+        live = [w for w in self._heap if not w[2].done()]
+        return min(live, key=lambda w: w[1]) if live else None
+
+    def _grant(self, waiter: list) -> None:
+        level = waiter[0]
+        waiter[2].set_result(None)
+        self._queued[level] -= 1
+        self.active += 1
+        self._grants += 1
+        self._stats["grants"][level] += 1
+
+    def _wake(self) -> None:
+        while True:
+            top = self._top()
+            if top is None or self.active >= self._cap(top[0]):
+                return
+            waiter = top
+            if self._grants % self.AGING_EVERY == self.AGING_EVERY - 1:
+                oldest = self._oldest()
+                if oldest is not None and self.active < self._cap(oldest[0]):
+                    waiter = oldest
+            self._grant(waiter)
+
+    async def _acquire(self, level: int) -> None:
+        if self._top() is None and self.active < self._cap(level):
+            self.active += 1
+            self._grants += 1
+            self._stats["grants"][level] += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._heap, [level, self._seq, fut])
+        self._queued[level] += 1
+        # Lower classes may be queued while a slot this class is allowed is
+        # free (the interactive reserve).
+        self._wake()
+        if not fut.done():
+            self._stats["waited"][level] += 1
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Granted, then cancelled before it ran: hand the slot on.
+                self._release(None, 0.0, None)
+            else:
+                self._queued[level] -= 1
+            raise
+
+    def _release(self, slot: _Slot | None, elapsed: float, outcome: str | None) -> None:
+        saturated = self.active >= int(self.limit) or self._top() is not None
+        self.active -= 1
+        if outcome == "congested":
+            self._stats["congested"] += 1
+            self._decrease("transient failure")
+        elif outcome == "ok" and slot is not None:
+            self._observe(elapsed, slot.nbytes, saturated)
+        self._wake()
+
+    def _observe(self, elapsed: float, nbytes: int, saturated: bool) -> None:
+        if nbytes <= self.LATENCY_MAX_BYTES:
+            self._latency = (
+                elapsed if self._latency is None else 0.8 * self._latency + 0.2 * elapsed
+            )
+            # Follows improvements at once, degradations slowly — a lasting
+            # shift eventually becomes the new normal instead of pinning the
+            # limit to the floor.
+            if self._baseline is None or self._latency < self._baseline:
+                self._baseline = self._latency
+            else:
+                self._baseline += (self._latency - self._baseline) * 0.01
+            if self._latency > self.LATENCY_CONGESTED * max(self._baseline, self.LATENCY_FLOOR):
+                self._decrease("latency")
+                return
+        if saturated and self.limit < self.max_limit:
+            before = int(self.limit)
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            if int(self.limit) > before:
+                self._stats["increases"] += 1
+
+    def _decrease(self, reason: str) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        before = int(self.limit)
+        self.limit = max(float(self.min_limit), self.limit * self.DECREASE_FACTOR)
+        if int(self.limit) < before:
+            self._stats["decreases"] += 1
+            logger.info(f"Storage concurrency {before} -> {int(self.limit)} ({reason})")
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Hold one concurrency slot at the caller's priority for the body.
+        A transient failure inside the body is a congestion signal; anything
+        else (404, a bug) says nothing about Storage's health."""
+        await self._acquire(_priority.get())
+        slot = _Slot()
+        started = time.monotonic()
+        outcome = None
+        try:
+            yield slot
+            outcome = "ok"
+        except Exception as e:
+            if _is_transient(e):
+                outcome = "congested"
+            raise
+        finally:
+            self._release(slot, time.monotonic() - started, outcome)
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "active": self.active,
+            "queued": dict(zip(_PRIORITY_NAMES, self._queued)),
+            "grants": dict(zip(_PRIORITY_NAMES, self._stats["grants"])),
+            "waited": dict(zip(_PRIORITY_NAMES, self._stats["waited"])),
+            "increases": self._stats["increases"],
+            "decreases": self._stats["decreases"],
+            "congested": self._stats["congested"],
+            "latency_ms": round(self._latency * 1000, 1) if self._latency is not None else None,
+            "baseline_ms": round(self._baseline * 1000, 1) if self._baseline is not None else None,
+        }
+
+
+# Ceiling = the async client's connection pool: a slot beyond it would only
+# queue inside httpx.
+_scheduler = StorageScheduler(STORAGE_CONCURRENCY, 2, STORAGE_CONCURRENCY * 2)
+
+
+def scheduler_stats() -> dict:
+    return _scheduler.stats()
+
+
+async def fan_out(fn, items, *, level: int = BULK, return_exceptions: bool = False) -> list:
+    """asyncio.gather(*(fn(item) for item in items)) at `level` priority — the
+    replacement for a per-caller Semaphore. The scheduler decides how many
+    requests are in flight; this only caps the coroutines alive at once at
+    the scheduler's ceiling, so per-item work around the Storage call
+    (encoding on a worker thread, a DB update) can't fan out to thousands."""
+    gate = asyncio.Semaphore(_scheduler.max_limit)
+
+    async def _one(item):
+        async with gate:
+            return await fn(item)
+
+    with priority(level):
+        return await asyncio.gather(
+            *(_one(item) for item in items), return_exceptions=return_exceptions
+        )
+
+
+# ── Single-flight request coalescing ───────────────────────────────────────────
+# When a popular object is cold (right after a deploy, or a chapter that was
+# just published), N simultaneous requests each used to start their own
+# download — N worker threads and N Storage connections for identical bytes.
+# Callers for the same key now await one shared task instead. Event-loop only:
+# the map is touched without a lock, which is safe because every access
+# happens on the loop thread.
+
+_inflight: dict[tuple, asyncio.Task] = {}
+_flight_stats = {"leaders": 0, "coalesced": 0}
+
+
+async def single_flight(key: tuple, load):
+    """Run `load()` (a coroutine function) once per key at a time; concurrent
+    callers with the same key get the same result or the same exception.
+
+    Each waiter is shielded, so one client disconnecting (cancelling its
+    request) doesn't cancel the download everyone else is waiting on."""
+    task = _inflight.get(key)
+    if task is None:
+        _flight_stats["leaders"] += 1
+        task = asyncio.ensure_future(load())
+        _inflight[key] = task
+
+        def _done(t: asyncio.Task) -> None:
+            _inflight.pop(key, None)
+            # Mark the exception retrieved even if every waiter was cancelled.
+            if not t.cancelled():
+                t.exception()
+
+        task.add_done_callback(_done)
+    else:
+        _flight_stats["coalesced"] += 1
+    return await asyncio.shield(task)
+
+
+def retry_budget_stats() -> dict:
+    return _retry_budget.stats()
+
+
+def single_flight_stats() -> dict:
+    return {**_flight_stats, "in_flight": len(_inflight)}
+
+
+async def fetch_public_object(url: str, timeout: float = 30.0) -> bytes:
+    """GET a public Storage URL (cover_url, audio_url), coalescing concurrent
+    fetches of the same URL. Stored URLs carry their own ?v= version, so the
+    URL alone is the key. Raises httpx.HTTPStatusError on non-2xx."""
+    async def _load() -> bytes:
+        resp = await _get_async_client(public=True).get(url, timeout=timeout)
+        resp.raise_for_status()
+        return resp.content
+    return await single_flight(("url", url), _load)
+
+
 # ── Chapter-text gzip (de)compression ─────────────────────────────────────────
 # Chapter text is stored gzip-compressed (~3x smaller) but with Content-Type
 # "application/gzip" and NO Content-Encoding header — storage3/httpx would
@@ -172,6 +620,272 @@ def _gunzip_decompress(data: bytes) -> bytes:
     return gzip.decompress(data)
 
 
+# ── Chapter-text zstd with per-book dictionaries ─────────────────────────────
+# Chapters of one web novel share a huge vocabulary of names, honorifics and
+# boilerplate that gzip's 32 KB window re-learns in every ~30 KB object. A
+# zstd dictionary trained on the book at ingest carries that vocabulary once,
+# so each chapter compresses against it — and zstd decompresses several
+# times faster than gzip on the hot read path.
+#
+# Dictionaries live next to the chapters in the chapter-text bucket:
+#   {book_id}/_zstd-{dict_id}.dict   immutable, what readers fetch — every
+#                                    frame names its dict_id in its header
+#   {book_id}/_zstd.dict             the book's current dictionary for writes
+# Books without a dictionary (older books, tiny books that can't be trained
+# on) keep writing gzip. Reading is by magic bytes, like gzip vs legacy plain
+# UTF-8, so every generation of object stays readable.
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+ZSTD_DICT_PREFIX = "_zstd"
+# Roughly two chapters' worth of shared vocabulary; also bounds the memory
+# each cached book costs.
+_ZSTD_DICT_SIZE = 64 * 1024
+# Compression runs once per write, decompression on every read — and zstd
+# decompression speed doesn't depend on the level — so lean towards size.
+_ZSTD_LEVEL = 12
+# Training needs enough distinct samples to find anything worth sharing, and
+# more than a few MB of them only makes training slower. Fixed COVER
+# parameters instead of zstd's parameter search, which costs tens of seconds
+# on the parse path for a near-identical dictionary.
+_ZSTD_MIN_SAMPLES = 20
+_ZSTD_TRAIN_BYTES = 4 * 1024 * 1024
+_ZSTD_TRAIN_PARAMS = {"k": 1024, "d": 8}
+_ZSTD_MAX_CACHED_DICTS = 256
+
+# book_id → the book's write dictionary (None = the book has none: gzip).
+# Unlike the read side this goes stale when a book is retrained or deleted,
+# so every change is broadcast to the other workers (forget_write_dict).
+_write_dicts: "OrderedDict[str, zstandard.ZstdCompressionDict | None]" = OrderedDict()
+# (book_id, dict_id) → dictionary. Immutable, so never invalidated.
+_read_dicts: "OrderedDict[tuple[str, int], zstandard.ZstdCompressionDict]" = OrderedDict()
+_dict_lock = threading.Lock()
+
+
+def _is_zstd(data: bytes) -> bool:
+    """True if data starts with the zstd frame magic (28 b5 2f fd) — like the
+    gzip magic, never the start of valid UTF-8 prose."""
+    return data[:4] == _ZSTD_MAGIC
+
+
+def is_compressed_chapter(data: bytes) -> bool:
+    """Stored in one of the compressed formats (gzip or zstd), as opposed to a
+    legacy plain-UTF-8 object."""
+    return _is_gzip(data) or _is_zstd(data)
+
+
+def is_gzip(data: bytes) -> bool:
+    """Stored gzip-compressed — bytes a client that accepts gzip can be sent
+    as they are, with Content-Encoding: gzip."""
+    return _is_gzip(data)
+
+
+def chapter_content_type(data: bytes) -> str:
+    return "application/zstd" if _is_zstd(data) else "application/gzip"
+
+
+def zstd_dict_path(book_id: str, dict_id: int | None = None) -> str:
+    if dict_id is None:
+        return f"{book_id}/{ZSTD_DICT_PREFIX}.dict"
+    return f"{book_id}/{ZSTD_DICT_PREFIX}-{dict_id}.dict"
+
+
+def _cache_dict(cache: OrderedDict, key, value) -> None:
+    with _dict_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > _ZSTD_MAX_CACHED_DICTS:
+            cache.popitem(last=False)
+
+
+_NO_DICT = object()
+
+
+def _cached_write_dict(book_id: str):
+    """The cached write dictionary (or None), or _NO_DICT if not looked up."""
+    with _dict_lock:
+        if book_id not in _write_dicts:
+            return _NO_DICT
+        _write_dicts.move_to_end(book_id)
+        return _write_dicts[book_id]
+
+
+def _parse_write_dict(book_id: str, raw: bytes | None) -> "zstandard.ZstdCompressionDict | None":
+    zdict = zstandard.ZstdCompressionDict(raw) if raw is not None else None
+    _cache_dict(_write_dicts, book_id, zdict)
+    return zdict
+
+
+def _missing_ok(e: StorageUploadError) -> None:
+    # Missing object (Supabase answers 400/404): the book has none. Anything
+    # transient must not be cached as "no dictionary".
+    if e.status in _TRANSIENT_HTTP_STATUSES:
+        raise e
+
+
+def write_dictionary(book_id: str) -> "zstandard.ZstdCompressionDict | None":
+    """The book's current dictionary, or None if it has none. Blocking."""
+    zdict = _cached_write_dict(book_id)
+    if zdict is not _NO_DICT:
+        return zdict
+    try:
+        # Overwritten on retrain (reparse) — cache-bust so the CDN never hands
+        # back a previous dictionary.
+        raw = _sync_download(CHAPTER_TEXT_BUCKET, zstd_dict_path(book_id), uuid.uuid4().hex)
+    except StorageUploadError as e:
+        _missing_ok(e)
+        raw = None
+    return _parse_write_dict(book_id, raw)
+
+
+async def write_dictionary_async(book_id: str) -> "zstandard.ZstdCompressionDict | None":
+    """write_dictionary over the async transport."""
+    zdict = _cached_write_dict(book_id)
+    if zdict is not _NO_DICT:
+        return zdict
+    try:
+        raw = await _async_download(CHAPTER_TEXT_BUCKET, zstd_dict_path(book_id), uuid.uuid4().hex)
+    except StorageUploadError as e:
+        _missing_ok(e)
+        raw = None
+    return _parse_write_dict(book_id, raw)
+
+
+def _cached_read_dict(book_id: str, dict_id: int) -> "zstandard.ZstdCompressionDict | None":
+    key = (book_id, dict_id)
+    with _dict_lock:
+        zdict = _read_dicts.get(key)
+        if zdict is not None:
+            _read_dicts.move_to_end(key)
+        return zdict
+
+
+def _read_dict(book_id: str, dict_id: int) -> zstandard.ZstdCompressionDict:
+    """Dictionary `dict_id` of `book_id`. Blocking on a cache miss."""
+    zdict = _cached_read_dict(book_id, dict_id)
+    if zdict is None:
+        raw = _sync_download(CHAPTER_TEXT_BUCKET, zstd_dict_path(book_id, dict_id))
+        zdict = zstandard.ZstdCompressionDict(raw)
+        _cache_dict(_read_dicts, (book_id, dict_id), zdict)
+    return zdict
+
+
+def _frame_dict_id(data: bytes) -> int:
+    return zstandard.get_frame_parameters(data).dict_id if _is_zstd(data) else 0
+
+
+def needs_zstd_dict(book_id: str | None, data: bytes) -> bool:
+    """True if decoding `data` would first have to fetch a dictionary."""
+    dict_id = _frame_dict_id(data)
+    if not dict_id or book_id is None:
+        return False
+    with _dict_lock:
+        return (book_id, dict_id) not in _read_dicts
+
+
+async def prepare_chapter_decode(book_id: str | None, data: bytes) -> None:
+    """Fetch the dictionary `data` needs without blocking, so the
+    decode_chapter_bytes that follows on the event loop never waits on
+    Storage. No-op for gzip, plain and dictionary-less objects."""
+    if needs_zstd_dict(book_id, data):
+        dict_id = _frame_dict_id(data)
+        raw = await _async_download(CHAPTER_TEXT_BUCKET, zstd_dict_path(book_id, dict_id))
+        _cache_dict(_read_dicts, (book_id, dict_id), zstandard.ZstdCompressionDict(raw))
+
+
+def _zstd_compress(data: bytes, zdict: zstandard.ZstdCompressionDict) -> bytes:
+    return zstandard.ZstdCompressor(level=_ZSTD_LEVEL, dict_data=zdict).compress(data)
+
+
+def _encode(text: str, zdict: "zstandard.ZstdCompressionDict | None") -> bytes:
+    raw = text.encode("utf-8")
+    if zdict is None:
+        return _gzip_compress(raw)
+    return _zstd_compress(raw, zdict)
+
+
+def encode_chapter_text(book_id: str, text: str) -> bytes:
+    """Text → stored object bytes: zstd with the book's dictionary when it has
+    one, gzip otherwise. Blocking (may fetch the dictionary)."""
+    return _encode(text, write_dictionary(book_id))
+
+
+def build_chapter_dictionary(texts: list[str]) -> zstandard.ZstdCompressionDict | None:
+    """Train a dictionary on a book's chapter texts, or None when there isn't
+    enough text to train on. CPU only — nothing is stored."""
+    samples = [t.encode("utf-8") for t in texts if t]
+    if len(samples) < _ZSTD_MIN_SAMPLES:
+        return None
+    total = sum(len(s) for s in samples)
+    if total > _ZSTD_TRAIN_BYTES:
+        # An even spread across the book, not just its opening arc.
+        samples = samples[:: max(1, round(total / _ZSTD_TRAIN_BYTES))]
+    try:
+        return zstandard.train_dictionary(
+            _ZSTD_DICT_SIZE, samples, level=_ZSTD_LEVEL, **_ZSTD_TRAIN_PARAMS
+        )
+    except zstandard.ZstdError as e:
+        logger.warning(f"zstd dictionary training failed: {e}")
+        return None
+
+
+def store_chapter_dictionary(book_id: str, zdict: zstandard.ZstdCompressionDict) -> None:
+    """Upload `zdict` and make it the book's write dictionary. Blocking."""
+    raw = zdict.as_bytes()
+    dict_id = zdict.dict_id()
+    # Immutable copy first: no object may reference a dictionary readers
+    # can't fetch.
+    _sync_upload(CHAPTER_TEXT_BUCKET, zstd_dict_path(book_id, dict_id), raw, "application/octet-stream")
+    _sync_upload(CHAPTER_TEXT_BUCKET, zstd_dict_path(book_id), raw, "application/octet-stream", "no-cache")
+    _cache_dict(_read_dicts, (book_id, dict_id), zdict)
+    _cache_dict(_write_dicts, book_id, zdict)
+    coordination.broadcast("storage.forget_write_dict", book_id)
+
+
+def train_chapter_dictionary(book_id: str, texts: list[str]) -> int | None:
+    """Train and store a zstd dictionary for `book_id` from its chapter texts
+    (ingest). Returns the dict_id, or None if the book stays on gzip.
+    Blocking."""
+    zdict = build_chapter_dictionary(texts)
+    if zdict is None:
+        _cache_dict(_write_dicts, book_id, None)
+        coordination.broadcast("storage.forget_write_dict", book_id)
+        return None
+    store_chapter_dictionary(book_id, zdict)
+    logger.info(
+        f"Book {book_id}: trained zstd dictionary {zdict.dict_id()} "
+        f"({len(zdict.as_bytes())} bytes)"
+    )
+    return zdict.dict_id()
+
+
+def forget_write_dict(book_id: str) -> None:
+    """The book's dictionary changed or went away: look it up again on the
+    next write, here and in every other worker."""
+    _forget_write_dict(book_id)
+    coordination.broadcast("storage.forget_write_dict", book_id)
+
+
+def _forget_write_dict(book_id: str) -> None:
+    with _dict_lock:
+        _write_dicts.pop(book_id, None)
+
+
+coordination.subscribe("storage.forget_write_dict", _forget_write_dict)
+
+
+def _upload_headers(content_type: str, cache_control: str | None) -> dict:
+    headers = {
+        "Content-Type": content_type,
+        "x-upsert": "true",
+    }
+    if cache_control:
+        # Stored verbatim as the object's cacheControl metadata and served
+        # back on downloads — "no-cache" makes Supabase's CDN revalidate
+        # instead of serving a stale copy after an upsert.
+        headers["Cache-Control"] = cache_control
+    return headers
+
+
 def _sync_upload(
     bucket: str,
     path: str,
@@ -180,48 +894,98 @@ def _sync_upload(
     cache_control: str | None = None,
 ) -> None:
     def _do() -> None:
-        headers = {
-            "Content-Type": content_type,
-            "x-upsert": "true",
-        }
-        if cache_control:
-            # Stored verbatim as the object's cacheControl metadata and served
-            # back on downloads — "no-cache" makes Supabase's CDN revalidate
-            # instead of serving a stale copy after an upsert.
-            headers["Cache-Control"] = cache_control
         resp = _get_direct_client().post(
             f"/object/{bucket}/{path}",
             content=data,
-            headers=headers,
+            headers=_upload_headers(content_type, cache_control),
+        )
+        if resp.status_code >= 400:
+            raise StorageUploadError(resp.status_code, resp.text, bucket, path)
+    _retry_sync(_do, what=f"upload {bucket}/{path}", breaker=_breaker(bucket, "upload"))
+
+
+async def _async_upload(
+    bucket: str,
+    path: str,
+    data: bytes,
+    content_type: str,
+    cache_control: str | None = None,
+) -> None:
+    async def _do() -> None:
+        resp = await _get_async_client().post(
+            f"/object/{bucket}/{path}",
+            content=data,
+            headers=_upload_headers(content_type, cache_control),
         )
         if resp.status_code >= 400:
             raise StorageUploadError(resp.status_code, resp.text, bucket, path)
-    _retry_sync(_do, what=f"upload {bucket}/{path}")
+    await _retry_async(
+        _do, what=f"upload {bucket}/{path}", breaker=_breaker(bucket, "upload"), nbytes=len(data)
+    )
 
 
-def _sync_download(bucket: str, path: str, version: str | None = None) -> bytes:
+def _download_result(
+    resp: httpx.Response, bucket: str, path: str, byte_range: tuple[int, int] | None
+) -> bytes:
+    if resp.status_code >= 400:
+        raise StorageUploadError(
+            resp.status_code, resp.text, bucket, path, op="download"
+        )
+    if byte_range is not None and resp.status_code != 206:
+        return resp.content[byte_range[0]:byte_range[1] + 1]
+    return resp.content
+
+
+def _sync_download(
+    bucket: str,
+    path: str,
+    version: str | None = None,
+    byte_range: tuple[int, int] | None = None,
+) -> bytes:
     """GET an object directly. Supabase serves storage downloads through its
     CDN, which caches per-URL and does NOT invalidate on upsert — after an
     admin edit the old chapter text kept being served from the CDN until its
     TTL expired. `version` (the chapter row's updated_at) is appended as a
-    query param so every rewrite reads from a fresh cache key."""
+    query param so every rewrite reads from a fresh cache key.
+
+    `byte_range` is an inclusive (first, last) pair sent as an HTTP Range
+    header. If the server ignores it and answers 200 with the whole object,
+    the slice is cut locally so callers always get exactly the range."""
     def _do() -> bytes:
         resp = _get_direct_client().get(
             f"/object/{bucket}/{path}",
             params={"v": version} if version else None,
+            headers={"Range": f"bytes={byte_range[0]}-{byte_range[1]}"} if byte_range else None,
         )
-        if resp.status_code >= 400:
-            raise StorageUploadError(
-                resp.status_code, resp.text, bucket, path, op="download"
-            )
-        return resp.content
-    return _retry_sync(_do, what=f"download {bucket}/{path}")
+        return _download_result(resp, bucket, path, byte_range)
+    return _retry_sync(_do, what=f"download {bucket}/{path}", breaker=_breaker(bucket, "download"))
+
+
+async def _async_download(
+    bucket: str,
+    path: str,
+    version: str | None = None,
+    byte_range: tuple[int, int] | None = None,
+) -> bytes:
+    """_sync_download on the event loop — same `version` and `byte_range`
+    semantics."""
+    async def _do() -> bytes:
+        resp = await _get_async_client().get(
+            f"/object/{bucket}/{path}",
+            params={"v": version} if version else None,
+            headers={"Range": f"bytes={byte_range[0]}-{byte_range[1]}"} if byte_range else None,
+        )
+        return _download_result(resp, bucket, path, byte_range)
+    return await _retry_async(
+        _do, what=f"download {bucket}/{path}", breaker=_breaker(bucket, "download")
+    )
 
 
 def _sync_remove(bucket: str, paths: list[str]) -> None:
     _retry_sync(
         lambda: _get_storage().from_(bucket).remove(paths),
         what=f"remove {bucket} ({len(paths)} files)",
+        breaker=_breaker(bucket, "remove"),
     )
 
 
@@ -235,9 +999,45 @@ def _sync_list(bucket: str, prefix: str, *, limit: int = 1000, offset: int = 0)
             {"limit": limit, "offset": offset, "sortBy": {"column": "name", "order": "asc"}},
         ),
         what=f"list {bucket}/{prefix}",
+        breaker=_breaker(bucket, "list"),
+    )
+
+
+async def _async_remove(bucket: str, paths: list[str]) -> None:
+    async def _do() -> None:
+        # Same request storage3's remove() sends.
+        resp = await _get_async_client().request(
+            "DELETE", f"/object/{bucket}", json={"prefixes": paths}
+        )
+        if resp.status_code >= 400:
+            raise StorageUploadError(
+                resp.status_code, resp.text, bucket, f"({len(paths)} files)", op="remove"
+            )
+    await _retry_async(
+        _do, what=f"remove {bucket} ({len(paths)} files)", breaker=_breaker(bucket, "remove")
     )
 
 
+async def _async_list(
+    bucket: str, prefix: str, *, limit: int = 1000, offset: int = 0
+) -> list[dict]:
+    async def _do() -> list[dict]:
+        # Same body storage3's list() sends (see _sync_list on limit).
+        resp = await _get_async_client().post(
+            f"/object/list/{bucket}",
+            json={
+                "prefix": prefix,
+                "limit": limit,
+                "offset": offset,
+                "sortBy": {"column": "name", "order": "asc"},
+            },
+        )
+        if resp.status_code >= 400:
+            raise StorageUploadError(resp.status_code, resp.text, bucket, prefix, op="list")
+        return resp.json()
+    return await _retry_async(_do, what=f"list {bucket}/{prefix}", breaker=_breaker(bucket, "list"))
+
+
 async def upload_bytes(
     bucket: str,
     path: str,
@@ -245,7 +1045,7 @@ async def upload_bytes(
     content_type: str = "application/octet-stream",
 ) -> str:
     """Upload bytes to Supabase Storage and return public URL."""
-    await asyncio.to_thread(_sync_upload, bucket, path, data, content_type)
+    await _async_upload(bucket, path, data, content_type)
     return _get_storage().from_(bucket).get_public_url(path)
 
 
@@ -267,17 +1067,23 @@ def chapter_text_path(book_id: str, chapter_id: str) -> str:
 
 async def upload_chapter_text(book_id: str, chapter_id: str, text: str) -> str:
     path = chapter_text_path(book_id, chapter_id)
-    # Store gzip-compressed (~3x smaller). Content-Type application/gzip, never
-    # Content-Encoding (see the gzip helpers above). download_chapter_text reverses it.
-    data = _gzip_compress(text.encode("utf-8"))
-    await asyncio.to_thread(
-        _sync_upload,
+    # Store compressed — zstd with the book's dictionary, else gzip (~3x
+    # smaller). Content-Type application/zstd or application/gzip, never
+    # Content-Encoding (see the gzip helpers above). download_chapter_text
+    # reverses it.
+    # Compression is CPU work: off the loop.
+    zdict = await write_dictionary_async(book_id)
+    data = await asyncio.to_thread(_encode, text, zdict)
+    await _async_upload(
         CHAPTER_TEXT_BUCKET,
         path,
         data,
-        "application/gzip",
+        chapter_content_type(data),
         "no-cache",
     )
+    # Lazy import: chapter_pack builds on this module.
+    from app.services import chapter_pack
+    chapter_pack.mark_dirty(book_id)
     return path
 
 
@@ -285,11 +1091,60 @@ async def download_chapter_text(path: str, version: str | None = None) -> str:
     """`version` (chapters.updated_at) cache-busts Supabase's CDN — see
     _sync_download. Pass it whenever the caller has the row's updated_at;
     without it an upserted object can be served stale until the CDN TTL."""
-    data = await asyncio.to_thread(_sync_download, CHAPTER_TEXT_BUCKET, path, version)
-    # New objects are gzip (magic 1f 8b); legacy objects are plain UTF-8 and skip
-    # the gunzip branch — byte-identical to the pre-compression behaviour.
+    data = await download_chapter_object(path, version)
+    return decode_chapter_bytes(data, _book_of(path))
+
+
+async def download_chapter_object(path: str, version: str | None = None) -> bytes:
+    """The chapter-text object exactly as stored (gzip, or legacy plain UTF-8).
+
+    Versioned reads go through the in-process LRU and then the on-disk tier
+    (chapter_text_cache), so a chapter many listeners have open costs one
+    Storage GET, not one each — and a restart doesn't start fully cold.
+    Concurrent misses for the same object share one download (single_flight)."""
+    data = chapter_text_cache.get(path, version)
+    if data is None:
+        async def _load() -> bytes:
+            # The disk tier is file I/O — worker thread; Storage is a socket
+            # on the loop.
+            loaded = None
+            if chapter_text_cache.disk_enabled(version):
+                loaded = await asyncio.to_thread(chapter_text_cache.disk_get, path, version)
+            if loaded is None:
+                loaded = await _async_download(CHAPTER_TEXT_BUCKET, path, version)
+                if chapter_text_cache.disk_enabled(version):
+                    await asyncio.to_thread(chapter_text_cache.disk_put, path, version, loaded)
+            await prepare_chapter_decode(_book_of(path), loaded)
+            chapter_text_cache.put(path, version, loaded)
+            return loaded
+        data = await single_flight((CHAPTER_TEXT_BUCKET, path, version), _load)
+    else:
+        # Memory hit whose dictionary has since aged out of its cache.
+        await prepare_chapter_decode(_book_of(path), data)
+    return data
+
+
+def _book_of(path: str) -> str:
+    """book_id of a {book_id}/{chapter_id}.txt chapter-text path."""
+    return path.split("/", 1)[0]
+
+
+def decode_chapter_bytes(data: bytes, book_id: str | None = None) -> str:
+    """Stored chapter-text object bytes → text.
+
+    Detected by magic bytes: zstd (28 b5 2f fd) and gzip (1f 8b) objects are
+    decompressed; legacy objects are plain UTF-8 and skip both branches —
+    byte-identical to the pre-compression behaviour. A zstd object made with
+    a dictionary needs its `book_id`; the dictionary is fetched (blocking) if
+    it isn't cached — async callers run prepare_chapter_decode first."""
     if _is_gzip(data):
         data = _gunzip_decompress(data)
+    elif _is_zstd(data):
+        dict_id = _frame_dict_id(data)
+        if dict_id and book_id is None:
+            raise ValueError("zstd chapter object needs its book_id to decode")
+        zdict = _read_dict(book_id, dict_id) if dict_id else None
+        data = zstandard.ZstdDecompressor(dict_data=zdict).decompress(data)
     return data.decode("utf-8")
 
 
@@ -300,14 +1155,13 @@ async def get_chapter_text(chapter_id: str) -> str:
     Note: This issues a DB query to resolve text_storage_path. Callers that
     already know book_id should use get_chapter_text_by_ids() to skip it.
     """
-    from app.database import get_client
-    db = get_client()
-    result = (
+    from app import database
+    db = database.get_client()
+    result = await database.execute(
         db.table("chapters")
         .select("text_storage_path,updated_at")
         .eq("id", chapter_id)
         .maybe_single()
-        .execute()
     )
     if not result.data:
         return ""
@@ -338,24 +1192,26 @@ async def get_chapter_text_by_ids(
 async def write_chapter_text(book_id: str, chapter_id: str, text: str) -> str:
     """Upload chapter text to Storage and update the row's text_storage_path.
     Returns the storage path."""
-    from app.database import get_client
+    from app import database
     path = await upload_chapter_text(book_id, chapter_id, text)
-    db = get_client()
-    db.table("chapters").update({
+    db = database.get_client()
+    await database.execute(db.table("chapters").update({
         "text_storage_path": path,
-    }).eq("id", chapter_id).execute()
+    }).eq("id", chapter_id))
     return path
 
 
 async def delete_chapter_text(book_id: str, chapter_id: str) -> None:
     """Best-effort delete of a chapter's text file from Storage."""
     await delete_path(CHAPTER_TEXT_BUCKET, chapter_text_path(book_id, chapter_id))
+    from app.services import chapter_pack
+    chapter_pack.mark_dirty(book_id)
 
 
 async def delete_path(bucket: str, path: str) -> None:
     """Delete a file from Supabase Storage."""
     try:
-        await asyncio.to_thread(_sync_remove, bucket, [path])
+        await _async_remove(bucket, [path])
     except Exception as e:
         logger.warning(f"Could not delete {bucket}/{path}: {e}")
 
@@ -369,11 +1225,14 @@ async def delete_folder(bucket: str, prefix: str) -> None:
         while True:
             # Always list from offset 0: as we remove files they drop out of
             # the result set, so the next "page" is still at the start.
-            files = await asyncio.to_thread(_sync_list, bucket, prefix, limit=PAGE)
+            files = await _async_list(bucket, prefix, limit=PAGE)
             if not files:
                 return
             paths = [f"{prefix}/{f['name']}" for f in files]
-            await asyncio.to_thread(_sync_remove, bucket, paths)
+            await _async_remove(bucket, paths)
+            if bucket == CHAPTER_TEXT_BUCKET:
+                # The book's dictionary went with it (reparse retrains one).
+                forget_write_dict(prefix)
             if len(files) < PAGE:
                 return
     except Exception as e:
@@ -1,9 +1,184 @@
+import logging
 import re
+from typing import Optional
+
 from bs4 import BeautifulSoup
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# Subtrees html_to_text drops entirely, and the block elements it wraps in
+# newlines.
+_SKIP_TAGS = frozenset(["script", "style", "img", "figure", "figcaption", "table", "nav", "aside"])
+_BLOCK_TAGS = frozenset(["p", "div", "br", "h1", "h2", "h3", "h4", "h5", "h6"])
+_TITLE_TAGS = ("h1", "h2", "h3")
+# BeautifulSoup gives strings inside these their own string class, which
+# get_text() leaves out.
+_STRING_CONTAINER_TAGS = frozenset(["rt", "rp", "style", "script", "template"])
+# Where BeautifulSoup keeps whitespace-only strings as they are.
+_PRESERVE_WHITESPACE_TAGS = frozenset(["pre", "textarea"])
+_ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+_NEWLINE_RUN_RE = re.compile(r"\n{3,}")
+_SPACE_RUN_RE = re.compile(r"[ \t]+")
+_FOOTNOTE_LINE_RE = re.compile(r"^\s*[\[\(]?\d+[\]\)]?\s*$", flags=re.MULTILINE)
+_DOT_RUN_RE = re.compile(r"\.{5,}")
+_DOCTYPE_RE = re.compile(r"<!doctype", flags=re.IGNORECASE)
+# What may precede a well-placed doctype: whitespace, the XML declaration
+# (a PI), comments.
+_PROLOG_RE = re.compile(r"(?:\s|<\?[^>]*>|<!--.*?-->)*", flags=re.DOTALL)
 
 
 def html_to_text(html_content: str) -> str:
-    """Convert HTML chapter content to clean plain text for TTS."""
+    """Convert HTML chapter content to clean plain text for TTS.
+
+    One lxml parse and a single walk over the tree that writes block
+    boundaries straight into the output, instead of building a
+    BeautifulSoup tree, decomposing the skipped tags and inserting newline
+    strings around every block element first. The output is identical to
+    the BeautifulSoup implementation (_html_to_text_bs4), which stays as the
+    fallback for markup lxml refuses outright and for the two shapes lxml's
+    tree can't reproduce it from: markup after </html> and a doctype out of
+    place.
+    """
+    try:
+        return _convert(html_content, with_title=False)[0]
+    except (etree.LxmlError, ValueError) as e:
+        logger.warning("lxml could not convert HTML (%s); using BeautifulSoup", e)
+        return _html_to_text_bs4(html_content)
+
+
+def html_to_text_and_title(html_content: str) -> tuple[str, Optional[str]]:
+    """html_to_text plus the chapter title, from the same parse and walk.
+
+    The title is the text of the first h1 — or failing that the first h2,
+    then h3 — that has any (None if none does), taken from the whole
+    document, skipped subtrees included. The EPUB parser used to build a
+    second soup per spine item just for this.
+    """
+    try:
+        return _convert(html_content, with_title=True)
+    except (etree.LxmlError, ValueError) as e:
+        logger.warning("lxml could not convert HTML (%s); using BeautifulSoup", e)
+        return _html_to_text_bs4(html_content), _title_bs4(html_content)
+
+
+def _convert(html_content: str, with_title: bool) -> tuple[str, Optional[str]]:
+    if _has_misplaced_doctype(html_content):
+        # lxml drops a doctype met mid-document and merges the text around
+        # it; BeautifulSoup keeps it as a node, so the strings either side
+        # stay apart (and get a separator between them).
+        return _reference(html_content, with_title)
+    # Same parser and options BeautifulSoup's "lxml" builder uses, so both
+    # see the same tree.
+    parser = etree.HTMLParser(recover=True)
+    parser.feed(html_content)
+    try:
+        root = parser.close()
+    except etree.XMLSyntaxError:
+        # Nothing parseable (empty or whitespace-only input).
+        root = None
+    if root is None:
+        return "", None
+    if root.getnext() is not None:
+        # Markup after </html>: lxml's recovery moves it into a second <html>
+        # element and drops the whitespace between the two, which
+        # BeautifulSoup keeps as a line break — not recoverable from the
+        # tree. Rare enough to hand to the reference implementation.
+        return _reference(html_content, with_title)
+
+    strings: list[str] = []
+    skip_depth = container_depth = preserve_depth = 0
+    first_heading: dict[str, etree._Element] = {}
+    heading_parts: dict[str, list[str]] = {}
+    open_headings: list[str] = []
+
+    def add(segment: str) -> None:
+        # BeautifulSoup turns a whitespace-only string into a single newline
+        # or space as it parses (except inside pre/textarea); clean_text's
+        # blank-line handling depends on it.
+        if not preserve_depth and not segment.strip(_ASCII_SPACES):
+            segment = "\n" if "\n" in segment else " "
+        if not container_depth:
+            if not skip_depth:
+                strings.append(segment)
+            for tag in open_headings:
+                stripped = segment.strip()
+                if stripped:
+                    heading_parts[tag].append(stripped)
+
+    for event, el in _walk(root):
+        tag = el.tag
+        if not isinstance(tag, str):
+            # Comment / processing instruction: only its tail is text.
+            if el.tail:
+                add(el.tail)
+            continue
+        if event == "start":
+            if tag in _SKIP_TAGS:
+                skip_depth += 1
+            elif tag in _BLOCK_TAGS and not skip_depth:
+                strings.append("\n")
+            if tag in _STRING_CONTAINER_TAGS:
+                container_depth += 1
+            if tag in _PRESERVE_WHITESPACE_TAGS:
+                preserve_depth += 1
+            if with_title and tag in _TITLE_TAGS and tag not in first_heading:
+                first_heading[tag] = el
+                heading_parts[tag] = []
+                open_headings.append(tag)
+            if el.text:
+                add(el.text)
+        else:
+            if open_headings and tag in open_headings and first_heading[tag] is el:
+                open_headings.remove(tag)
+            if tag in _PRESERVE_WHITESPACE_TAGS:
+                preserve_depth -= 1
+            if tag in _STRING_CONTAINER_TAGS:
+                container_depth -= 1
+            if tag in _SKIP_TAGS:
+                skip_depth -= 1
+            elif tag in _BLOCK_TAGS and not skip_depth:
+                strings.append("\n")
+            if el.tail:
+                add(el.tail)
+
+    title = None
+    for tag in _TITLE_TAGS:
+        if tag in first_heading:
+            # Only the first heading of each level counts, as with soup.find.
+            if heading_parts[tag]:
+                title = "".join(heading_parts[tag])[:200]
+                break
+    # get_text(separator=" ") joined every string with a space.
+    return clean_text(" ".join(strings)), title
+
+
+def _has_misplaced_doctype(html_content: str) -> bool:
+    match = _DOCTYPE_RE.search(html_content)
+    if match is None:
+        return False
+    if match.start() != _PROLOG_RE.match(html_content).end():
+        return True
+    return _DOCTYPE_RE.search(html_content, match.end()) is not None
+
+
+def _reference(html_content: str, with_title: bool) -> tuple[str, Optional[str]]:
+    """_convert's result from the BeautifulSoup implementation."""
+    return _html_to_text_bs4(html_content), _title_bs4(html_content) if with_title else None
+
+
+def _walk(root: etree._Element):
+    """etree.iterwalk over the root element and the comments and PIs
+    before it (its preceding siblings, which iterwalk(root) never visits).
+    A top-level comment or PI only contributes its tail."""
+    for node in reversed(list(root.itersiblings(preceding=True))):
+        yield "comment", node
+    yield from etree.iterwalk(root, events=("start", "end", "comment", "pi"))
+
+
+def _html_to_text_bs4(html_content: str) -> str:
+    """The original BeautifulSoup implementation; the reference output."""
     soup = BeautifulSoup(html_content, "lxml")
 
     # Remove non-speech elements
@@ -19,19 +194,31 @@ def html_to_text(html_content: str) -> str:
     return clean_text(text)
 
 
+def _title_bs4(html_content: str) -> Optional[str]:
+    soup = BeautifulSoup(html_content, "lxml")
+    for tag in _TITLE_TAGS:
+        el = soup.find(tag)
+        if el and el.get_text(strip=True):
+            return el.get_text(strip=True)[:200]
+    return None
+
+
 def clean_text(text: str) -> str:
     """Normalize whitespace and remove TTS-unfriendly characters."""
     # Collapse multiple newlines to max 2
-    text = re.sub(r"\n{3,}", "\n\n", text)
-    # Collapse spaces/tabs on each line
-    text = re.sub(r"[ \t]+", " ", text)
+    text = _NEWLINE_RUN_RE.sub("\n\n", text)
+    # Collapse spaces/tabs on each line. Without a tab or a double space
+    # every match is a lone space replaced by itself — skip the pass, the
+    # most expensive of these on typical chapter text.
+    if "\t" in text or "  " in text:
+        text = _SPACE_RUN_RE.sub(" ", text)
     # Strip trailing/leading whitespace per line
     lines = [line.strip() for line in text.splitlines()]
     text = "\n".join(lines)
     # Remove lines that are only punctuation or numbers (footnote markers)
-    text = re.sub(r"^\s*[\[\(]?\d+[\]\)]?\s*$", "", text, flags=re.MULTILINE)
+    text = _FOOTNOTE_LINE_RE.sub("", text)
     # Remove excessive dots (ellipsis is ok, 5+ is noise)
-    text = re.sub(r"\.{5,}", "...", text)
+    text = _DOT_RUN_RE.sub("...", text)
     return text.strip()
 
 
@@ -72,8 +72,55 @@ CREATE TRIGGER trg_chapters_updated_at
     FOR EACH ROW EXECUTE FUNCTION touch_chapter_updated_at();
 
 CREATE INDEX IF NOT EXISTS idx_chapters_book_id ON chapters(book_id);
+-- Newest updated_at per book: the chapter-list ETag lookup on every
+-- GET /api/books/{id}/chapters.
+CREATE INDEX IF NOT EXISTS idx_chapters_book_updated ON chapters(book_id, updated_at DESC);
 CREATE INDEX IF NOT EXISTS idx_chapters_status  ON chapters(book_id, status);
 
+-- Tombstones for GET /api/books/{id}/chapters?since=: chapter rows are
+-- hard-deleted (delete, bulk delete, auto-split, reparse), so without a log a
+-- delta sync could never tell a client which cached chapters are gone. Filled
+-- by trigger so no delete path can forget it. Deleting the book itself logs
+-- nothing (the book row is already gone when the cascade reaches chapters) —
+-- there is no list left to sync.
+CREATE TABLE IF NOT EXISTS chapter_deletions (
+    chapter_id  UUID NOT NULL,
+    book_id     UUID NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+    deleted_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_chapter_deletions_book ON chapter_deletions(book_id, deleted_at);
+CREATE INDEX IF NOT EXISTS idx_chapter_deletions_at   ON chapter_deletions(deleted_at);
+
+CREATE OR REPLACE FUNCTION log_chapter_deletion() RETURNS TRIGGER AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM books WHERE id = OLD.book_id) THEN
+        INSERT INTO chapter_deletions (chapter_id, book_id) VALUES (OLD.id, OLD.book_id);
+    END IF;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chapters_log_deletion ON chapters;
+CREATE TRIGGER trg_chapters_log_deletion
+    AFTER DELETE ON chapters
+    FOR EACH ROW EXECUTE FUNCTION log_chapter_deletion();
+
+-- Keep the log small: a client whose `since` is older than this gets the
+-- full list instead (CHAPTER_DELETIONS_RETENTION_DAYS in routers/books.py
+-- must match).
+CREATE OR REPLACE FUNCTION prune_chapter_deletions() RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM chapter_deletions WHERE deleted_at < now() - interval '30 days';
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chapters_prune_deletions ON chapters;
+CREATE TRIGGER trg_chapters_prune_deletions
+    AFTER DELETE ON chapters
+    FOR EACH STATEMENT EXECUTE FUNCTION prune_chapter_deletions();
+
 -- ============================================================
 -- Users & auth
 -- ============================================================
@@ -125,6 +172,83 @@ CREATE TABLE IF NOT EXISTS user_progress (
 CREATE INDEX IF NOT EXISTS idx_user_progress_user_book    ON user_progress(user_id, book_id);
 CREATE INDEX IF NOT EXISTS idx_user_progress_user_chapter ON user_progress(user_id, chapter_id);
 
+-- Migration (idempotent): the saved chapter's position, denormalized so
+-- progress reads don't need a second round-trip to chapters. Owned by the two
+-- triggers below — the backend never writes it: a save buffered in a worker
+-- can be flushed after a reindex, and would put back the position it saw.
+-- The backfill only touches rows that are out of date, so re-running it is
+-- cheap.
+ALTER TABLE user_progress ADD COLUMN IF NOT EXISTS chapter_index INTEGER;
+
+UPDATE user_progress up SET chapter_index = c.chapter_index
+FROM chapters c
+WHERE c.id = up.chapter_id AND up.chapter_index IS DISTINCT FROM c.chapter_index;
+
+-- Per-book re-sync (sync_progress_chapter_index).
+CREATE INDEX IF NOT EXISTS idx_user_progress_book ON user_progress(book_id);
+-- Per-chapter follow-up when a chapter moves.
+CREATE INDEX IF NOT EXISTS idx_user_progress_chapter ON user_progress(chapter_id);
+
+-- Every write of a progress row takes the index from its chapter, whatever
+-- the writer sent.
+CREATE OR REPLACE FUNCTION set_progress_chapter_index() RETURNS TRIGGER AS $$
+BEGIN
+    SELECT c.chapter_index INTO NEW.chapter_index FROM chapters c WHERE c.id = NEW.chapter_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_user_progress_chapter_index ON user_progress;
+CREATE TRIGGER trg_user_progress_chapter_index
+    BEFORE INSERT OR UPDATE OF chapter_id, chapter_index ON user_progress
+    FOR EACH ROW EXECUTE FUNCTION set_progress_chapter_index();
+
+-- And every move of a chapter — the reindex functions, PATCH
+-- /chapters/{id}, a fix made straight in SQL — follows through to the
+-- progress rows pointing at it.
+CREATE OR REPLACE FUNCTION follow_chapter_index() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE user_progress SET chapter_index = NEW.chapter_index
+    WHERE chapter_id = NEW.id AND chapter_index IS DISTINCT FROM NEW.chapter_index;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chapters_follow_index ON chapters;
+CREATE TRIGGER trg_chapters_follow_index
+    AFTER UPDATE OF chapter_index ON chapters
+    FOR EACH ROW
+    WHEN (OLD.chapter_index IS DISTINCT FROM NEW.chapter_index)
+    EXECUTE FUNCTION follow_chapter_index();
+
+-- A flush of buffered progress saves (app/services/progress_buffer.py): one
+-- statement for the whole batch, and never an older position over a newer
+-- one. With several uvicorn workers, saves for one book can sit in two
+-- workers' buffers and be flushed in either order; the row keeps the save
+-- with the later updated_at whichever lands last. chapter_index is filled in by
+-- trg_user_progress_chapter_index.
+CREATE OR REPLACE FUNCTION upsert_progress(p_rows jsonb)
+RETURNS void
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = pg_catalog, public
+AS $$
+    INSERT INTO user_progress AS up (
+        id, user_id, book_id, chapter_id, progress_value, total_value, updated_at
+    )
+    SELECT r.id, r.user_id, r.book_id, r.chapter_id, r.progress_value, r.total_value, r.updated_at
+    FROM jsonb_to_recordset(p_rows) AS r(
+        id UUID, user_id UUID, book_id UUID, chapter_id UUID,
+        progress_value FLOAT, total_value FLOAT, updated_at TIMESTAMPTZ
+    )
+    ON CONFLICT (user_id, book_id) DO UPDATE SET
+        chapter_id     = EXCLUDED.chapter_id,
+        progress_value = EXCLUDED.progress_value,
+        total_value    = EXCLUDED.total_value,
+        updated_at     = EXCLUDED.updated_at
+    WHERE EXCLUDED.updated_at > up.updated_at;
+$$;
+
 -- Playback settings (speed, pitch) synced across devices
 CREATE TABLE IF NOT EXISTS user_settings (
     user_id        UUID PRIMARY KEY,
@@ -156,8 +280,10 @@ CREATE INDEX IF NOT EXISTS idx_book_genres_genre_id ON book_genres(genre_id);
 -- XP / Leveling
 -- ============================================================
 
--- One row per user. Deduplication is done via completed_listen_ids / completed_read_ids
--- text arrays — no separate completions table needed.
+-- One row per user: the running totals. Deduplication (one XP award per
+-- user, chapter and mode) is done by chapter_completions below, through the
+-- complete_chapter RPC. completed_read_ids / completed_listen_ids are legacy:
+-- no longer written, kept only as the source of that table's backfill.
 CREATE TABLE IF NOT EXISTS user_stats (
     user_id                 UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
     total_exp               BIGINT NOT NULL DEFAULT 0,
@@ -169,6 +295,80 @@ CREATE TABLE IF NOT EXISTS user_stats (
     updated_at              TIMESTAMPTZ NOT NULL DEFAULT now()
 );
 
+-- One row per (user, chapter, mode) that has earned XP. Replaces the
+-- completed_read_ids / completed_listen_ids arrays above, which every
+-- completion read and rewrote whole (hundreds of KB for a heavy listener)
+-- and which two concurrent completions could both "win". The arrays are no
+-- longer written; they are only the source of the one-time backfill.
+--
+-- The backfill lives inside the DO block so it runs only when the table is
+-- first created.
+DO $$
+BEGIN
+    IF to_regclass('public.chapter_completions') IS NULL THEN
+        CREATE TABLE chapter_completions (
+            user_id      UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            chapter_id   TEXT NOT NULL,
+            mode         TEXT NOT NULL CHECK (mode IN ('read', 'listen')),
+            completed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (user_id, chapter_id, mode)
+        );
+        INSERT INTO chapter_completions (user_id, chapter_id, mode)
+        SELECT user_id, unnest(completed_read_ids), 'read' FROM user_stats
+        ON CONFLICT DO NOTHING;
+        INSERT INTO chapter_completions (user_id, chapter_id, mode)
+        SELECT user_id, unnest(completed_listen_ids), 'listen' FROM user_stats
+        ON CONFLICT DO NOTHING;
+    END IF;
+END $$;
+
+-- Award XP for a completion exactly once: the primary key decides, the
+-- counters move in the same transaction. Returns
+-- {exp_earned, already_completed, total_exp}.
+CREATE OR REPLACE FUNCTION complete_chapter(
+    p_user_id UUID, p_chapter_id TEXT, p_mode TEXT, p_exp INT, p_words INT
+)
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = pg_catalog, public
+AS $$
+DECLARE
+    v_total BIGINT;
+BEGIN
+    INSERT INTO chapter_completions (user_id, chapter_id, mode)
+    VALUES (p_user_id, p_chapter_id, p_mode)
+    ON CONFLICT DO NOTHING;
+
+    IF NOT FOUND THEN
+        SELECT s.total_exp INTO v_total FROM user_stats s WHERE s.user_id = p_user_id;
+        RETURN jsonb_build_object(
+            'exp_earned', 0, 'already_completed', true, 'total_exp', COALESCE(v_total, 0)
+        );
+    END IF;
+
+    INSERT INTO user_stats AS s (
+        user_id, total_exp, total_chapters_read, total_chapters_listened,
+        total_words_read, updated_at
+    )
+    VALUES (
+        p_user_id, p_exp,
+        CASE WHEN p_mode = 'read' THEN 1 ELSE 0 END,
+        CASE WHEN p_mode = 'listen' THEN 1 ELSE 0 END,
+        p_words, now()
+    )
+    ON CONFLICT (user_id) DO UPDATE SET
+        total_exp               = s.total_exp + EXCLUDED.total_exp,
+        total_chapters_read     = s.total_chapters_read + EXCLUDED.total_chapters_read,
+        total_chapters_listened = s.total_chapters_listened + EXCLUDED.total_chapters_listened,
+        total_words_read        = s.total_words_read + EXCLUDED.total_words_read,
+        updated_at              = now()
+    RETURNING s.total_exp INTO v_total;
+
+    RETURN jsonb_build_object('exp_earned', p_exp, 'already_completed', false, 'total_exp', v_total);
+END;
+$$;
+
 -- ============================================================
 -- Storage RLS policies
 -- ============================================================
@@ -177,6 +377,7 @@ DROP POLICY IF EXISTS "Service role full access on epub-uploads" ON storage.obje
 DROP POLICY IF EXISTS "Service role full access on audio"        ON storage.objects;
 DROP POLICY IF EXISTS "Service role full access on covers"       ON storage.objects;
 DROP POLICY IF EXISTS "Service role full access on chapter-text" ON storage.objects;
+DROP POLICY IF EXISTS "Service role full access on chapter-packs" ON storage.objects;
 DROP POLICY IF EXISTS "Public read on audio"                     ON storage.objects;
 DROP POLICY IF EXISTS "Public read on covers"                    ON storage.objects;
 
@@ -196,6 +397,10 @@ CREATE POLICY "Service role full access on chapter-text"
 ON storage.objects FOR ALL TO service_role
 USING (bucket_id = 'chapter-text') WITH CHECK (bucket_id = 'chapter-text');
 
+CREATE POLICY "Service role full access on chapter-packs"
+ON storage.objects FOR ALL TO service_role
+USING (bucket_id = 'chapter-packs') WITH CHECK (bucket_id = 'chapter-packs');
+
 -- The "audio" and "covers" buckets are flagged as public on the bucket
 -- itself, so anyone with an object's path can fetch it via
 -- /storage/v1/object/public/<bucket>/<path>. We deliberately do NOT add a
@@ -208,6 +413,7 @@ USING (bucket_id = 'chapter-text') WITH CHECK (bucket_id = 'chapter-text');
 --   "audio"        → public
 --   "covers"       → public
 --   "chapter-text" → private
+--   "chapter-packs" → private (per-book packed chapter text, see chapter_pack.py)
 
 -- ============================================================
 -- Helper functions for chapter re-indexing
@@ -219,6 +425,24 @@ USING (bucket_id = 'chapter-text') WITH CHECK (bucket_id = 'chapter-text');
 -- functions is also revoked from anon/authenticated/public at the bottom of
 -- this file — only service_role and Postgres superusers may call them.
 
+-- Copy chapters.chapter_index into user_progress.chapter_index for one book.
+-- trg_chapters_follow_index keeps the column in step as chapters move; this
+-- is the repair tool for rows written before that trigger existed.
+CREATE OR REPLACE FUNCTION sync_progress_chapter_index(p_book_id UUID)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = pg_catalog, public
+AS $$
+BEGIN
+    UPDATE user_progress up SET chapter_index = c.chapter_index
+    FROM chapters c
+    WHERE up.book_id = p_book_id
+      AND c.id = up.chapter_id
+      AND up.chapter_index IS DISTINCT FROM c.chapter_index;
+END;
+$$;
+
 -- Make room for a new chapter inserted at p_insert_index by shifting everything above it up 1
 CREATE OR REPLACE FUNCTION shift_chapters_up(p_book_id UUID, p_insert_index INT)
 RETURNS void
@@ -404,9 +628,11 @@ ALTER TABLE user_roles       ENABLE ROW LEVEL SECURITY;
 ALTER TABLE user_progress    ENABLE ROW LEVEL SECURITY;
 ALTER TABLE user_settings    ENABLE ROW LEVEL SECURITY;
 ALTER TABLE user_stats       ENABLE ROW LEVEL SECURITY;
+ALTER TABLE chapter_completions ENABLE ROW LEVEL SECURITY;
 ALTER TABLE genres           ENABLE ROW LEVEL SECURITY;
 ALTER TABLE book_genres      ENABLE ROW LEVEL SECURITY;
 ALTER TABLE signup_log       ENABLE ROW LEVEL SECURITY;
+ALTER TABLE chapter_deletions ENABLE ROW LEVEL SECURITY;
 
 -- ============================================================
 -- Revoke discovery & RPC from anon / authenticated
@@ -425,8 +651,8 @@ ALTER TABLE signup_log       ENABLE ROW LEVEL SECURITY;
 
 REVOKE SELECT ON
     books, chapters, users, refresh_tokens,
-    user_roles, user_progress, user_settings, user_stats,
-    genres, book_genres, signup_log
+    user_roles, user_progress, user_settings, user_stats, chapter_completions,
+    genres, book_genres, signup_log, chapter_deletions
 FROM anon, authenticated;
 
 REVOKE EXECUTE ON FUNCTION
@@ -435,5 +661,8 @@ REVOKE EXECUTE ON FUNCTION
     reindex_chapters_after_delete(UUID, INT),
     strip_string_from_book_chapters(UUID, TEXT),
     normalize_chapter_offset(UUID, INT),
-    reindex_all_chapters(UUID)
+    reindex_all_chapters(UUID),
+    sync_progress_chapter_index(UUID),
+    upsert_progress(jsonb),
+    complete_chapter(UUID, TEXT, TEXT, INT, INT)
 FROM PUBLIC, anon, authenticated;
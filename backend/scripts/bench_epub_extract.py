@@ -0,0 +1,137 @@
+"""Benchmark EPUB spine extraction: one lxml pass vs the old BeautifulSoup path.
+
+extract_epub_contents used to build two BeautifulSoup trees per spine item —
+one for the h1/h2/h3 title, one inside html_to_text — so a 3,000-item book
+paid 6,000 full DOM builds. It now runs text_cleaner.html_to_text_and_title,
+a single lxml parse and tree walk per item. This script builds a synthetic
+EPUB, runs both per-item paths over the same spine documents, checks that
+they agree on every item, and times them plus the whole extract_epub_contents
+call.
+
+Local CPU only — no database, no Storage. Needs the backend's settings to
+import (run from backend/ with the usual .env).
+
+Usage (from backend/):
+    python -m scripts.bench_epub_extract                   # 3,000 items
+    python -m scripts.bench_epub_extract --items 500 --paragraphs 80
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+# Make `app.*` imports work when run as `python -m scripts.…`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bs4 import BeautifulSoup
+from ebooklib import epub
+
+from app.services.epub_parser import extract_epub_contents
+from app.utils.text_cleaner import _html_to_text_bs4, html_to_text_and_title
+
+_WORDS = (
+    "ta nàng hắn sư phụ kiếm khí linh lực đan điền tu vi cảnh giới tông môn "
+    "thiên địa một hai ba không có được đã đang sẽ nói rằng nhìn thấy đi về"
+).split()
+
+
+def _paragraph(rng: random.Random) -> str:
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(20, 60))]
+    return " ".join(words).capitalize() + "."
+
+
+def _chapter_html(n: int, paragraphs: int, rng: random.Random) -> str:
+    """XHTML shaped like the web-novel EPUBs we get: XML declaration, a
+    heading, many <p>, the odd image, footnote and navigation block."""
+    body = [f"<h1>Chương {n}: {rng.choice(_WORDS).capitalize()}</h1>"]
+    for i in range(paragraphs):
+        body.append(f"<p>{_paragraph(rng)}</p>")
+        if i == paragraphs // 2:
+            body.append('<div class="img"><img src="a.jpg" alt="x"/></div>')
+    body.append("<p><sup>[1]</sup> Chú thích.</p>")
+    body.append('<nav><a href="#">Mục lục</a></nav>')
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        "<!DOCTYPE html>\n"
+        '<html xmlns="http://www.w3.org/1999/xhtml">\n'
+        f"<head><title>Chương {n}</title></head>\n"
+        "<body>\n" + "\n".join(body) + "\n</body>\n</html>"
+    )
+
+
+def build_epub(items: int, paragraphs: int, seed: int = 1) -> tuple[bytes, list[str]]:
+    rng = random.Random(seed)
+    book = epub.EpubBook()
+    book.set_identifier("bench")
+    book.set_title("Benchmark")
+    book.set_language("vi")
+    docs, spine = [], []
+    for n in range(1, items + 1):
+        html_doc = _chapter_html(n, paragraphs, rng)
+        docs.append(html_doc)
+        item = epub.EpubHtml(title=f"Chương {n}", file_name=f"c{n}.xhtml", lang="vi")
+        item.content = html_doc.encode("utf-8")
+        book.add_item(item)
+        spine.append(item)
+    book.spine = spine
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    path = Path(__file__).resolve().parent / ".bench_epub_extract.epub"
+    try:
+        epub.write_epub(str(path), book)
+        return path.read_bytes(), docs
+    finally:
+        path.unlink(missing_ok=True)
+
+
+def _legacy_item(html_content: str) -> tuple[str, str | None]:
+    """What extract_epub_contents did per spine item before: two soups."""
+    soup = BeautifulSoup(html_content, "lxml")
+    text = _html_to_text_bs4(html_content)
+    title = None
+    for tag in ["h1", "h2", "h3"]:
+        el = soup.find(tag)
+        if el and el.get_text(strip=True):
+            title = el.get_text(strip=True)[:200]
+            break
+    return text, title
+
+
+def _time(fn, docs: list[str]) -> tuple[float, list]:
+    started = time.perf_counter()
+    out = [fn(d) for d in docs]
+    return time.perf_counter() - started, out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=3000, help="spine items (default 3000)")
+    parser.add_argument("--paragraphs", type=int, default=40, help="paragraphs per item (default 40)")
+    args = parser.parse_args()
+
+    epub_bytes, docs = build_epub(args.items, args.paragraphs)
+    print(
+        f"Synthetic EPUB: {args.items} items x {args.paragraphs} paragraphs, "
+        f"{len(epub_bytes) / 1e6:.1f} MB"
+    )
+
+    legacy_s, legacy = _time(_legacy_item, docs)
+    single_s, single = _time(html_to_text_and_title, docs)
+    mismatched = sum(1 for a, b in zip(legacy, single) if a != b)
+    print(f"  per-item, two BeautifulSoup parses: {legacy_s:7.2f} s")
+    print(f"  per-item, one lxml pass:            {single_s:7.2f} s  ({legacy_s / single_s:.1f}x)")
+    print(f"  items whose text or title differ:   {mismatched}")
+
+    started = time.perf_counter()
+    extracted = extract_epub_contents(epub_bytes, "bench")
+    print(
+        f"  extract_epub_contents end to end:   {time.perf_counter() - started:7.2f} s "
+        f"({len(extracted['chapters'])} chapters)"
+    )
+    if mismatched:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
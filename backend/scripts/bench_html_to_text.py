@@ -0,0 +1,65 @@
+"""Microbenchmark: text_cleaner.html_to_text (lxml) vs the BeautifulSoup path.
+
+Times both engines per call on chapter-shaped XHTML of a few sizes (the same
+generator as bench_epub_extract). Equivalence is checked by
+scripts/check_html_to_text.py, not here.
+
+Local CPU only — no database, no Storage.
+
+Usage (from backend/):
+    python -m scripts.bench_html_to_text
+    python -m scripts.bench_html_to_text --repeat 200
+"""
+import argparse
+import random
+import sys
+import time
+import warnings
+from pathlib import Path
+
+# Make `app.*` imports work when run as `python -m scripts.…`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bs4 import XMLParsedAsHTMLWarning
+
+from app.utils.text_cleaner import _html_to_text_bs4, html_to_text
+from scripts.bench_epub_extract import _chapter_html
+
+warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
+
+# (label, paragraphs): a short note, a typical chapter, a whole-volume item.
+SIZES = [("small", 5), ("chapter", 40), ("large", 400)]
+
+
+def _per_call(fn, doc: str, repeat: int) -> float:
+    """Best-of-three mean seconds per call."""
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn(doc)
+        best = min(best, (time.perf_counter() - started) / repeat)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50, help="calls per timing (default 50)")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    print(f"{'document':>10} {'KB':>7} {'BeautifulSoup':>14} {'lxml':>10} {'speedup':>8}")
+    for label, paragraphs in SIZES:
+        doc = _chapter_html(1, paragraphs, rng)
+        repeat = max(1, args.repeat * 40 // paragraphs)
+        bs4_s = _per_call(_html_to_text_bs4, doc, repeat)
+        lxml_s = _per_call(html_to_text, doc, repeat)
+        print(
+            f"{label:>10} {len(doc.encode('utf-8')) / 1024:7.1f} "
+            f"{bs4_s * 1000:11.2f} ms {lxml_s * 1000:7.2f} ms "
+            f"{bs4_s / lxml_s:7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Golden-file equivalence check for text_cleaner.html_to_text.
+
+html_to_text runs on lxml now; the BeautifulSoup implementation it replaced
+is kept as text_cleaner._html_to_text_bs4 (the fallback, and the reference
+here). Run this after touching either:
+
+  1. Every document is converted both ways; text and title must be
+     identical. The documents are a fixed corpus — hand-written edge cases
+     plus randomly generated, often malformed, markup from a fixed seed —
+     and every spine item of any EPUB passed on the command line.
+  2. A digest of each built-in document's output is compared with
+     html_to_text_golden.json next to this script. Step 1 can't see a change
+     both paths share (clean_text, say); this can. After an intended output
+     change, refresh it with --write-golden and commit the diff.
+
+Local CPU only — no database, no Storage.
+
+Usage (from backend/):
+    python -m scripts.check_html_to_text
+    python -m scripts.check_html_to_text work/some-book.epub other.epub
+    python -m scripts.check_html_to_text --write-golden
+"""
+import argparse
+import hashlib
+import json
+import random
+import sys
+import warnings
+from pathlib import Path
+
+# Make `app.*` imports work when run as `python -m scripts.…`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ebooklib
+from bs4 import XMLParsedAsHTMLWarning
+from ebooklib import epub
+
+from app.utils.text_cleaner import (
+    _html_to_text_bs4,
+    _title_bs4,
+    html_to_text,
+    html_to_text_and_title,
+)
+
+if hasattr(sys.stdout, "reconfigure"):
+    sys.stdout.reconfigure(encoding="utf-8")
+# EPUB chapters are XHTML parsed as HTML — on purpose, as in production.
+warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
+
+GOLDEN_PATH = Path(__file__).resolve().parent / "html_to_text_golden.json"
+# Bump when the generator below changes (the golden no longer applies).
+CORPUS_VERSION = 2
+RANDOM_DOCUMENTS = 1500
+SEED = 20251017
+
+EDGE_CASES = [
+    "",
+    "   ",
+    "<!-- only a comment -->",
+    "plain text, no markup",
+    "<p>a</p><p>b</p>",
+    "<p>a</p>\n\n\n<p>b</p>",
+    "<p>a</p> \n \n <p>b</p>",
+    "<div><p>nested</p></div>after",
+    "<p>one<br>two<br/>three</p>",
+    "<p>x<!-- c -->y<?pi z?>w</p>",
+    "<table><tr><td>dropped</td></tr></table>tail kept",
+    "<nav><h1>Heading in nav</h1></nav><p>body</p>",
+    "<h1>  </h1><h2>Second level</h2><h1>later h1</h1>",
+    "<h1>Tiêu đề <script>x()</script><rt>furigana</rt>chương</h1>",
+    "<ruby>漢<rt>kan</rt><rp>(</rp></ruby> text",
+    "<template><p>inside template</p></template>outside",
+    "<pre>  keep\n\n\n   spacing  </pre><p>  \t  </p>",
+    "<textarea>\n\n\n</textarea>",
+    "<p>[1]</p><p>(23)</p><p>4</p><p>Đoạn văn.</p>",
+    "<p>Chờ đã..........</p><p>...</p>",
+    "<p>&amp; &lt;b&gt; &nbsp;x&nbsp;&nbsp;</p>",
+    "<p>tab\there\t\tand  two  spaces</p>",
+    "<p>line\r\nbreaks\rold mac</p>",
+    "<p>u2028 sep para\x0bvt\x0cff</p>",
+    "<p>full-width　space</p>",
+    '<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+    '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>T</title></head>'
+    "<body><h2>Chương 2</h2><p>Nội dung.</p></body></html>",
+    '<html><head><meta charset="windows-1252"></head><body><p>Tiếng Việt</p></body></html>',
+    "<p>unclosed <b>bold <i>italic</p> after",
+    "</p></div>stray closers<p>",
+    "<figure><img src=a><figcaption>cap</figcaption></figure>kept",
+    "<aside>note</aside><section><h3>Only h3</h3></section>",
+    # Top level: around the root element, and a doctype out of place.
+    "<html><body><p>a</p></body></html><p>b</p>",
+    "<html><body>a</body></html>\n<html><body>b</body></html>",
+    "<html><body>a</body></html><!-- c -->tail<h1>After html</h1>more",
+    '<?xml version="1.0"?><!-- c --><?pi x?>\n<html><body><p>a</p></body></html>',
+    "<!-- c -->before<html><body><p>a</p></body></html>",
+    "text<!DOCTYPE html>more",
+    "<p>a</p><!doctype html>b",
+    "<!DOCTYPE html><!DOCTYPE html><p>twice</p>",
+]
+
+_TAGS = [
+    "p", "div", "br", "h1", "h2", "h3", "h4", "span", "b", "i", "em",
+    "script", "style", "img", "figure", "figcaption", "table", "tr", "td",
+    "nav", "aside", "pre", "textarea", "ruby", "rt", "rp", "template", "a",
+    "section", "ul", "li", "blockquote", "sup",
+]
+_FRAGMENTS = [
+    "Chương 1", "xin chào", "  ", "\n", "\n\n\n", "\t", " \n \n ", "&amp;",
+    "&nbsp;", "1", "[2]", "(3)", ".....", "…", "Lời nói đầu", "&lt;b&gt;",
+    "a  b", "\r\n", "　",
+]
+# Stray top-level markup, before or after a whole document.
+_OUTSIDE = [
+    "<!-- c -->", "<?pi x?>", "<!DOCTYPE html>", "\n", "text", "</html>",
+    "<p>p</p>", "<h1>H</h1>", "<html><body>x</body></html>",
+]
+
+
+def _random_markup(rng: random.Random, depth: int = 0) -> str:
+    out = []
+    for _ in range(rng.randint(0, 5)):
+        r = rng.random()
+        if r < 0.45 or depth > 5:
+            out.append(rng.choice(_FRAGMENTS))
+        elif r < 0.5:
+            out.append("<!-- c -->")
+        elif r < 0.53:
+            out.append("<br/>")
+        else:
+            tag = rng.choice(_TAGS)
+            inner = _random_markup(rng, depth + 1)
+            # Some left unclosed, for the parser's recovery to sort out.
+            out.append(f"<{tag}>{inner}" if rng.random() < 0.05 else f"<{tag}>{inner}</{tag}>")
+    return "".join(out)
+
+
+def builtin_corpus() -> list[str]:
+    rng = random.Random(SEED)
+    docs = list(EDGE_CASES)
+    for i in range(RANDOM_DOCUMENTS):
+        body = _random_markup(rng)
+        r = rng.random()
+        if r < 0.3:
+            docs.append(
+                '<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+                '<html xmlns="http://www.w3.org/1999/xhtml">\n'
+                f"<head>\n<title>T {i}</title>\n</head>\n<body>\n{body}\n</body>\n</html>"
+            )
+        elif r < 0.4:
+            docs.append(
+                '<html><head><meta http-equiv="Content-Type" '
+                'content="text/html; charset=windows-1252"></head>'
+                f"<body>{body}</body></html>"
+            )
+        elif r < 0.5:
+            before = "".join(rng.choice(_OUTSIDE) for _ in range(rng.randint(0, 2)))
+            after = "".join(
+                rng.choice(_OUTSIDE) + _random_markup(rng, 4) for _ in range(rng.randint(1, 3))
+            )
+            docs.append(f"{before}<html><body>{body}</body></html>{after}")
+        else:
+            docs.append(body)
+    return docs
+
+
+def epub_documents(path: str) -> list[str]:
+    book = epub.read_epub(path)
+    docs = []
+    for item in book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
+        raw = item.get_content()
+        docs.append(raw.decode("utf-8", errors="replace") if isinstance(raw, bytes) else raw)
+    return docs
+
+
+def _digest(text: str, title) -> str:
+    payload = json.dumps([text, title], ensure_ascii=False).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()[:16]
+
+
+def compare(label: str, docs: list[str]) -> int:
+    """Both engines over `docs`; returns the number that differ."""
+    bad = 0
+    for n, doc in enumerate(docs):
+        fast = html_to_text_and_title(doc)
+        reference = (_html_to_text_bs4(doc), _title_bs4(doc))
+        if fast != reference or html_to_text(doc) != reference[0]:
+            bad += 1
+            if bad <= 5:
+                print(f"  MISMATCH {label} #{n}: {doc[:200]!r}")
+                print(f"    lxml:          {fast[1]!r} {fast[0][:200]!r}")
+                print(f"    BeautifulSoup: {reference[1]!r} {reference[0][:200]!r}")
+    print(f"{label}: {len(docs)} documents, {bad} mismatched")
+    return bad
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("epubs", nargs="*", help="EPUB files whose spine documents to check too")
+    parser.add_argument(
+        "--write-golden", action="store_true",
+        help=f"rewrite {GOLDEN_PATH.name} from the current output",
+    )
+    args = parser.parse_args()
+
+    corpus = builtin_corpus()
+    digests = [_digest(*html_to_text_and_title(doc)) for doc in corpus]
+    if args.write_golden:
+        GOLDEN_PATH.write_text(
+            json.dumps({"corpus_version": CORPUS_VERSION, "digests": digests}, indent=0) + "\n",
+            encoding="utf-8",
+        )
+        print(f"Wrote {len(digests)} digests to {GOLDEN_PATH}")
+        return
+
+    failures = compare("built-in corpus", corpus)
+    for path in args.epubs:
+        failures += compare(path, epub_documents(path))
+
+    golden = json.loads(GOLDEN_PATH.read_text(encoding="utf-8"))
+    if golden["corpus_version"] != CORPUS_VERSION:
+        print(f"{GOLDEN_PATH.name} is for corpus version {golden['corpus_version']}; rerun with --write-golden")
+        failures += 1
+    else:
+        changed = [i for i, (a, b) in enumerate(zip(digests, golden["digests"])) if a != b]
+        changed += list(range(min(len(digests), len(golden["digests"])), max(len(digests), len(golden["digests"]))))
+        for i in changed[:5]:
+            print(f"  GOLDEN CHANGED #{i}: {corpus[i][:200]!r}" if i < len(corpus) else f"  GOLDEN EXTRA #{i}")
+        print(f"golden: {len(digests)} documents, {len(changed)} changed")
+        failures += len(changed)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
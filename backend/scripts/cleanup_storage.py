@@ -1,25 +1,34 @@
 """One-shot storage cleanup. DRY-RUN unless --apply is passed.
 
-Two independent jobs:
+Three independent jobs:
 
   1. chapter-text orphans
      Delete objects in the `chapter-text` bucket whose chapter_id no longer
      exists in the `chapters` table. These pile up because book deletes,
      reparses, and auto-splits clean storage on a best-effort basis — a single
-     failed delete leaves the .txt behind forever.
+     failed delete leaves the .txt behind forever. A book's zstd
+     dictionaries (_zstd*.dict) count as orphans once none of its chapters
+     are left.
 
-  2. epub-uploads (delete EVERYTHING)
+  2. chapter-packs orphans
+     Delete every object in the `chapter-packs` bucket under a {book_id}
+     folder whose book no longer exists in the `books` table — packs a
+     failed delete, or a rebuild racing one, left behind. Packs of live
+     books are never touched (they are rebuilt from chapter-text anyway).
+
+  3. epub-uploads (delete EVERYTHING)
      Wipe the `epub-uploads` bucket (the original uploaded files).
      ⚠️  After this, the admin "Phân tích lại" (reparse) button stops working,
          since it re-parses from these stored originals.
 
 Bucket layout is one level deep — `{book_id}/{filename}`:
-    chapter-text : {book_id}/{chapter_id}.txt
-    epub-uploads : {book_id}/original.<ext>
+    chapter-text  : {book_id}/{chapter_id}.txt, {book_id}/_zstd[-<id>].dict
+    chapter-packs : {book_id}/index.json.gz, {book_id}/pack-<generation>.bin
+    epub-uploads  : {book_id}/original.<ext>
 
 Usage (from backend/):
-    python -m scripts.cleanup_storage                       # dry run, both jobs
-    python -m scripts.cleanup_storage --apply               # delete, both jobs
+    python -m scripts.cleanup_storage                       # dry run, all jobs
+    python -m scripts.cleanup_storage --apply               # delete, all jobs
     python -m scripts.cleanup_storage --only chapter-text   # dry run, one job
     python -m scripts.cleanup_storage --only epub-uploads --apply
 """
@@ -33,6 +42,7 @@ sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from app.database import get_client
 from app.services import storage_service
+from app.services.chapter_pack import CHAPTER_PACK_BUCKET
 from app.services.storage_service import CHAPTER_TEXT_BUCKET
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
@@ -92,15 +102,25 @@ def list_all_objects(bucket: str):
 
 
 def load_valid_chapter_ids() -> set[str]:
-    """Every chapter_id currently in the DB. Ordered pagination keeps the page
-    window stable as we walk all rows."""
+    """Every chapter_id currently in the DB."""
+    return _load_ids("chapters")
+
+
+def load_valid_book_ids() -> set[str]:
+    """Every book_id currently in the DB."""
+    return _load_ids("books")
+
+
+def _load_ids(table: str) -> set[str]:
+    """Every id in `table`. Ordered pagination keeps the page window stable
+    as we walk all rows."""
     db = get_client()
     ids: set[str] = set()
     PAGE = 1000
     offset = 0
     while True:
         rows = (
-            db.table("chapters")
+            db.table(table)
             .select("id")
             .order("id")
             .range(offset, offset + PAGE - 1)
@@ -133,16 +153,28 @@ def clean_chapter_text(apply: bool) -> None:
     total_size = 0
     orphan_paths: list[str] = []
     orphan_size = 0
+    # A book's zstd dictionaries are needed while any of its chapters are.
+    dict_objects: list[tuple[str, int]] = []
+    live_folders: set[str] = set()
     for path, size in list_all_objects(CHAPTER_TEXT_BUCKET):
         total += 1
         total_size += size
-        fname = path.rsplit("/", 1)[-1]
+        folder, _, fname = path.rpartition("/")
+        if fname.startswith(storage_service.ZSTD_DICT_PREFIX):
+            dict_objects.append((path, size))
+            continue
         chapter_id = fname[:-4] if fname.endswith(".txt") else fname
         if chapter_id not in valid:
             orphan_paths.append(path)
             orphan_size += size
+        else:
+            live_folders.add(folder)
         if total % 20000 == 0:
             logger.info(f"  scanned {total:,} objects…")
+    for path, size in dict_objects:
+        if path.rpartition("/")[0] not in live_folders:
+            orphan_paths.append(path)
+            orphan_size += size
 
     logger.info(f"objects in bucket    : {total:,} ({_fmt_size(total_size)})")
     logger.info(f"ORPHANS to delete    : {len(orphan_paths):,} ({_fmt_size(orphan_size)})")
@@ -157,6 +189,35 @@ def clean_chapter_text(apply: bool) -> None:
         logger.info("DRY RUN — pass --apply to delete the orphans above.")
 
 
+def clean_chapter_packs(apply: bool) -> None:
+    logger.info("=== chapter-packs orphans ===")
+    valid = load_valid_book_ids()
+    logger.info(f"valid books in DB    : {len(valid):,}")
+
+    total = 0
+    total_size = 0
+    orphan_paths: list[str] = []
+    orphan_size = 0
+    for path, size in list_all_objects(CHAPTER_PACK_BUCKET):
+        total += 1
+        total_size += size
+        if path.partition("/")[0] not in valid:
+            orphan_paths.append(path)
+            orphan_size += size
+
+    logger.info(f"objects in bucket    : {total:,} ({_fmt_size(total_size)})")
+    logger.info(f"ORPHANS to delete    : {len(orphan_paths):,} ({_fmt_size(orphan_size)})")
+    if orphan_paths:
+        logger.info(f"  examples: {orphan_paths[:3]}")
+
+    if apply and orphan_paths:
+        logger.info(f"Deleting {len(orphan_paths):,} orphan objects…")
+        delete_paths(CHAPTER_PACK_BUCKET, orphan_paths)
+        logger.info("chapter-packs cleanup complete.")
+    elif not apply:
+        logger.info("DRY RUN — pass --apply to delete the orphans above.")
+
+
 def clean_epub_uploads(apply: bool) -> None:
     logger.info("=== epub-uploads (delete ALL) ===")
     paths: list[str] = []
@@ -181,8 +242,8 @@ def main() -> None:
     ap.add_argument("--apply", action="store_true", help="actually delete (default: dry run)")
     ap.add_argument(
         "--only",
-        choices=["chapter-text", "epub-uploads"],
-        help="run only one job (default: both)",
+        choices=["chapter-text", "chapter-packs", "epub-uploads"],
+        help="run only one job (default: all)",
     )
     args = ap.parse_args()
 
@@ -191,6 +252,8 @@ def main() -> None:
 
     if args.only in (None, "chapter-text"):
         clean_chapter_text(args.apply)
+    if args.only in (None, "chapter-packs"):
+        clean_chapter_packs(args.apply)
     if args.only in (None, "epub-uploads"):
         clean_epub_uploads(args.apply)
 
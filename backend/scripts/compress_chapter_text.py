@@ -43,6 +43,7 @@ logger = logging.getLogger("compress_chapter_text")
 LIST_PAGE = 1000
 CHUNK = 2000  # objects submitted to the pool per wave (bounds in-flight futures)
 GZIP_MIME = "application/gzip"
+ZSTD_MIME = "application/zstd"
 
 
 def _download_http1(path: str) -> bytes:
@@ -104,6 +105,8 @@ def list_objects(book_id: str | None):
             for f in files:
                 if f.get("id") is None:
                     continue  # nested folder (not expected at this depth)
+                if f["name"].startswith(ss.ZSTD_DICT_PREFIX):
+                    continue  # the book's zstd dictionary, not a chapter
                 yield f"{folder}/{f['name']}", (f.get("metadata") or {})
             if len(files) < LIST_PAGE:
                 break
@@ -114,12 +117,13 @@ def compress_one(path: str, metadata: dict, apply: bool):
     """Returns (status, size_before, size_after, error).
     status in {already, empty, dry_run, compressed, error}."""
     try:
-        # Cheap skip — no download — for objects already stored as gzip.
-        if metadata.get("mimetype") == GZIP_MIME:
+        # Cheap skip — no download — for objects already stored compressed.
+        if metadata.get("mimetype") in (GZIP_MIME, ZSTD_MIME):
             return ("already", 0, 0, None)
         data = _download_http1(path)  # HTTP/1.1 — avoids storage3's HTTP/2 stream bug
-        # Authoritative skip (handles missing/stale list metadata).
-        if ss._is_gzip(data):
+        # Authoritative skip (handles missing/stale list metadata). zstd
+        # objects are already smaller than gzip would make them.
+        if ss.is_compressed_chapter(data):
             return ("already", 0, 0, None)
         if len(data) == 0:
             # gzip(b"") would be ~20 bytes — bigger. Leave empties as-is; they
@@ -19,6 +19,7 @@ from pathlib import Path
 # Make `app.*` imports work when run as `python -m scripts.…`
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
+from app import database
 from app.database import get_client
 from app.services import storage_service
 
@@ -44,22 +45,13 @@ async def export_book(book_id: str, output_arg: str | None) -> Path:
     if not book or not book.data:
         raise SystemExit(f"Book {book_id} not found")
 
-    chapters: list[dict] = []
-    offset = 0
-    while True:
-        page = (
-            db.table("chapters")
-            .select("id,chapter_index,title,updated_at")
-            .eq("book_id", book_id)
-            .order("chapter_index")
-            .range(offset, offset + PAGE_SIZE - 1)
-            .execute()
+    chapters = [
+        row
+        for batch in database.iter_chapter_pages(
+            book_id, "id,chapter_index,title,updated_at", PAGE_SIZE
         )
-        batch = page.data or []
-        chapters.extend(batch)
-        if len(batch) < PAGE_SIZE:
-            break
-        offset += PAGE_SIZE
+        for row in batch
+    ]
     if not chapters:
         raise SystemExit(f"Book {book_id} has no chapters")
 
@@ -47,7 +47,6 @@ logger = logging.getLogger("remove_spam_paragraphs")
 
 LIST_PAGE = 1000
 CHUNK = 2000  # objects submitted to the pool per wave (bounds in-flight futures)
-GZIP_MIME = "application/gzip"
 
 # Core token(s) of the watermark after normalization. "thichcode" survives every
 # obfuscation of truyen.thichcode.net because normalization removes exactly the
@@ -129,6 +128,8 @@ def list_objects(book_id: str | None):
             for f in files:
                 if f.get("id") is None:
                     continue  # nested folder (not expected at this depth)
+                if f["name"].startswith(ss.ZSTD_DICT_PREFIX):
+                    continue  # the book's zstd dictionary, not a chapter
                 yield f"{folder}/{f['name']}"
             if len(files) < LIST_PAGE:
                 break
@@ -142,9 +143,8 @@ def clean_one(path: str, signatures: tuple[str, ...], apply: bool):
         data = _download_http1(path)
         if len(data) == 0:
             return ("empty", [], None, None)
-        if ss._is_gzip(data):
-            data = ss._gunzip_decompress(data)
-        text = data.decode("utf-8")
+        book_id = path.split("/", 1)[0]
+        text = ss.decode_chapter_bytes(data, book_id)
 
         new_text, removed = remove_spam_paragraphs(text, signatures)
         if not removed:
@@ -153,8 +153,10 @@ def clean_one(path: str, signatures: tuple[str, ...], apply: bool):
         new_word_count = len(new_text.split())
         if not apply:
             return ("dry_run", removed, new_word_count, None)
-        gz = ss._gzip_compress(new_text.encode("utf-8"))
-        ss._sync_upload(CHAPTER_TEXT_BUCKET, path, gz, GZIP_MIME)  # retried internally
+        encoded = ss.encode_chapter_text(book_id, new_text)
+        ss._sync_upload(
+            CHAPTER_TEXT_BUCKET, path, encoded, ss.chapter_content_type(encoded)
+        )  # retried internally
         return ("cleaned", removed, new_word_count, None)
     except Exception as e:
         return ("error", [], None, f"{type(e).__name__}: {e}")
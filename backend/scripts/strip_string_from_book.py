@@ -41,6 +41,7 @@ from pathlib import Path
 # Make `app.*` imports work when run as `python -m scripts.…`
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
+from app import database
 from app.database import get_client
 from app.services import storage_service, text_cleanup
 
@@ -54,23 +55,12 @@ logger = logging.getLogger("strip_string_from_book")
 PAGE_SIZE = 1000
 
 
-def _load_chapters(db, book_id: str) -> list[dict]:
-    rows: list[dict] = []
-    offset = 0
-    while True:
-        page = (
-            db.table("chapters")
-            .select("id,chapter_index,updated_at")
-            .eq("book_id", book_id)
-            .order("chapter_index")
-            .range(offset, offset + PAGE_SIZE - 1)
-            .execute()
-        )
-        batch = page.data or []
-        rows.extend(batch)
-        if len(batch) < PAGE_SIZE:
-            return rows
-        offset += PAGE_SIZE
+def _load_chapters(book_id: str) -> list[dict]:
+    return [
+        row
+        for batch in database.iter_chapter_pages(book_id, "id,chapter_index,updated_at", PAGE_SIZE)
+        for row in batch
+    ]
 
 
 async def run(args: argparse.Namespace) -> None:
@@ -111,7 +101,7 @@ async def run(args: argparse.Namespace) -> None:
 
     targets: list[tuple[str, dict]] = []
     for b in books:
-        for ch in _load_chapters(db, b["id"]):
+        for ch in _load_chapters(b["id"]):
             if ch["id"] in done_ids:
                 continue
             if manifest_ids is not None and ch["id"] not in manifest_ids:
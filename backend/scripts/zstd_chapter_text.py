@@ -0,0 +1,229 @@
+"""One-shot migration: re-encode existing chapter-text objects as zstd with a
+dictionary trained per book.
+
+New books get a dictionary at ingest (storage_service.train_chapter_dictionary)
+and are written as zstd from the start. This brings every older book onto the
+same codec: per book it downloads all chapter objects, trains the book's
+dictionary (or reuses the one it already has), and re-uploads each chapter
+as zstd — only when that is actually smaller than what is stored.
+
+Transparent + safe:
+  * Same object path ({book_id}/{chapter_id}.txt) — no DB change. The text
+    is byte-identical after decoding, so caches keyed on updated_at stay valid.
+  * Re-uploads with Content-Type "application/zstd" (NEVER Content-Encoding).
+  * The dictionary is uploaded before any object that references it.
+  * decode_chapter_bytes detects zstd / gzip / plain UTF-8 by magic bytes, so
+    this can run gradually against the live backend with zero downtime.
+
+⚠️  DEPLOY THE ZSTD-AWARE BACKEND (storage_service.py) BEFORE RUNNING --apply.
+    The old backend would .decode('utf-8') zstd bytes and serve empty chapters.
+
+⚠️  Avoid editing a book while it is being migrated. Chapters whose updated_at
+    changed between download and upload are skipped, but the window is not zero.
+
+Idempotent + resumable: objects already zstd with the book's current
+dictionary are skipped, so re-running is cheap and safe.
+
+Usage (from backend/):
+    python -m scripts.zstd_chapter_text                  # dry run, every book
+    python -m scripts.zstd_chapter_text --apply          # migrate everything
+    python -m scripts.zstd_chapter_text --book-id <id>   # dry run, one book
+    python -m scripts.zstd_chapter_text --book-id <id> --apply
+    python -m scripts.zstd_chapter_text --apply --workers 8
+"""
+import argparse
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Make `app.*` imports work when run as `python -m scripts.…`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app import database
+from app.services import storage_service as ss
+from app.services.storage_service import CHAPTER_TEXT_BUCKET
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger("zstd_chapter_text")
+
+LIST_PAGE = 1000
+ZSTD_MIME = "application/zstd"
+
+
+def _fmt(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if n < 1024 or unit == "TB":
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def list_book_ids() -> list[str]:
+    """Every {book_id} folder in chapter-text (folder entries have id == None)."""
+    folders: list[str] = []
+    offset = 0
+    while True:
+        entries = ss._sync_list(CHAPTER_TEXT_BUCKET, "", limit=LIST_PAGE, offset=offset)
+        if not entries:
+            break
+        folders.extend(e["name"] for e in entries if e.get("id") is None)
+        if len(entries) < LIST_PAGE:
+            break
+        offset += LIST_PAGE
+    return folders
+
+
+def load_versions(book_id: str) -> dict[str, str]:
+    """chapter_id → updated_at for every chapter of the book with stored text."""
+    versions: dict[str, str] = {}
+    for rows in database.iter_chapter_pages(book_id, "id,updated_at,text_storage_path"):
+        versions.update(
+            {r["id"]: r["updated_at"] for r in rows if r.get("text_storage_path")}
+        )
+    return versions
+
+
+def migrate_book(book_id: str, pool: ThreadPoolExecutor, apply: bool) -> dict:
+    """Returns counts and byte totals for one book."""
+    out = {"converted": 0, "already": 0, "kept": 0, "skipped": 0, "error": 0,
+           "before": 0, "after": 0, "trained": False}
+    versions = load_versions(book_id)
+    if not versions:
+        return out
+    ids = list(versions)
+    paths = [ss.chapter_text_path(book_id, cid) for cid in ids]
+
+    def _download(path: str) -> bytes | None:
+        try:
+            return ss._sync_download(CHAPTER_TEXT_BUCKET, path)
+        except Exception as e:
+            logger.warning("  %s: download failed: %s", path, e)
+            return None
+
+    blobs = list(pool.map(_download, paths))
+    texts: list[str | None] = []
+    for path, data in zip(paths, blobs):
+        try:
+            texts.append(ss.decode_chapter_bytes(data, book_id) if data is not None else None)
+        except Exception as e:
+            logger.warning("  %s: undecodable, leaving as is: %s", path, e)
+            texts.append(None)
+
+    zdict = ss.write_dictionary(book_id)
+    if zdict is None:
+        zdict = ss.build_chapter_dictionary([t for t in texts if t])
+        if zdict is None:
+            logger.info("Book %s: too little text to train a dictionary — stays gzip.", book_id)
+            out["kept"] = len(ids)
+            return out
+        out["trained"] = True
+        if apply:
+            ss.store_chapter_dictionary(book_id, zdict)
+    dict_id = zdict.dict_id()
+
+    uploads: list[tuple[str, str, bytes]] = []
+    for cid, path, data, text in zip(ids, paths, blobs, texts):
+        if data is None or text is None:
+            out["error"] += 1
+            continue
+        if ss._is_zstd(data) and ss._frame_dict_id(data) == dict_id:
+            out["already"] += 1
+            continue
+        encoded = ss._zstd_compress(text.encode("utf-8"), zdict)
+        if len(encoded) >= len(data):
+            out["kept"] += 1
+            continue
+        out["before"] += len(data)
+        out["after"] += len(encoded)
+        uploads.append((cid, path, encoded))
+
+    if not apply:
+        out["converted"] = len(uploads)
+        return out
+
+    # Anything edited while we were downloading keeps its fresh text.
+    current = load_versions(book_id)
+    uploads = [u for u in uploads if current.get(u[0]) == versions[u[0]]]
+    out["skipped"] = sum(1 for cid in ids if current.get(cid) != versions[cid])
+
+    def _upload(item: tuple[str, str, bytes]) -> bool:
+        _, path, encoded = item
+        try:
+            ss._sync_upload(CHAPTER_TEXT_BUCKET, path, encoded, ZSTD_MIME, "no-cache")
+            return True
+        except Exception as e:
+            logger.warning("  %s: upload failed: %s", path, e)
+            return False
+
+    results = list(pool.map(_upload, uploads))
+    out["converted"] = sum(results)
+    out["error"] += len(results) - out["converted"]
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("--apply", action="store_true", help="actually re-encode (default: dry run)")
+    ap.add_argument("--workers", type=int, default=ss.STORAGE_CONCURRENCY,
+                    help=f"concurrent workers (default {ss.STORAGE_CONCURRENCY})")
+    ap.add_argument("--book-id", help="process a single book folder (smoke test)")
+    args = ap.parse_args()
+
+    logger.info(
+        "Mode: %s | workers=%d%s",
+        "APPLY (re-encoding)" if args.apply else "DRY RUN (report only)",
+        args.workers,
+        f" | book={args.book_id}" if args.book_id else "",
+    )
+    ss._get_storage()        # warm singletons before threads race for them
+    ss._get_direct_client()
+
+    book_ids = [args.book_id] if args.book_id else list_book_ids()
+    logger.info("Found %s books.", f"{len(book_ids):,}")
+
+    started = time.monotonic()
+    totals = {"converted": 0, "already": 0, "kept": 0, "skipped": 0, "error": 0,
+              "before": 0, "after": 0, "trained": 0}
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for n, book_id in enumerate(book_ids, 1):
+            try:
+                res = migrate_book(book_id, pool, args.apply)
+            except Exception as e:
+                logger.warning("Book %s failed: %s: %s", book_id, type(e).__name__, e)
+                totals["error"] += 1
+                continue
+            for key in totals:
+                totals[key] += int(res[key])
+            saved = res["before"] - res["after"]
+            logger.info(
+                "[%d/%d] %s: convert=%d already=%d kept=%d skipped=%d err=%d%s | saved %s (%.0f%%)",
+                n, len(book_ids), book_id, res["converted"], res["already"], res["kept"],
+                res["skipped"], res["error"], " | new dictionary" if res["trained"] else "",
+                _fmt(saved), (100 * saved / res["before"]) if res["before"] else 0,
+            )
+
+    saved = totals["before"] - totals["after"]
+    logger.info("-" * 60)
+    logger.info(
+        "%s: convert=%s already=%s kept=%s skipped=%s error=%s | dictionaries trained=%s",
+        "Would convert" if not args.apply else "Converted",
+        f"{totals['converted']:,}", f"{totals['already']:,}", f"{totals['kept']:,}",
+        f"{totals['skipped']:,}", f"{totals['error']:,}", f"{totals['trained']:,}",
+    )
+    if totals["before"]:
+        logger.info(
+            "converted set: %s -> %s  (saved %s, %.0f%%)",
+            _fmt(totals["before"]), _fmt(totals["after"]), _fmt(saved),
+            100 * saved / totals["before"],
+        )
+    if not args.apply:
+        logger.info("DRY RUN — pass --apply to re-encode.")
+    logger.info("Done in %.1fm.", (time.monotonic() - started) / 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -173,6 +173,47 @@ async function request<T>(
   return res.json();
 }
 
+// getBookProgress calls made in the same tick — a book page restoring its
+// position while the offline queue re-syncs, several pages mounting on a cold
+// start — share one POST /api/progress/batch, which the backend answers from
+// its per-user progress cache instead of a query per book.
+type ProgressWaiter = {
+  resolve: (row: UserProgress | null) => void;
+  reject: (err: unknown) => void;
+};
+let progressWaiters: Map<string, ProgressWaiter[]> | null = null;
+
+function loadBookProgress(bookId: string): Promise<UserProgress | null> {
+  return new Promise((resolve, reject) => {
+    if (!progressWaiters) {
+      progressWaiters = new Map();
+      setTimeout(flushBookProgress, 0);
+    }
+    const waiters = progressWaiters.get(bookId) ?? [];
+    waiters.push({ resolve, reject });
+    progressWaiters.set(bookId, waiters);
+  });
+}
+
+async function flushBookProgress(): Promise<void> {
+  const batch = progressWaiters;
+  progressWaiters = null;
+  if (!batch) return;
+  try {
+    const rows = await api.getBatchProgress([...batch.keys()]);
+    const byBook = new Map<string, UserProgress>(
+      rows.map((row) => [row.book_id, row]),
+    );
+    for (const [bookId, waiters] of batch) {
+      for (const w of waiters) w.resolve(byBook.get(bookId) ?? null);
+    }
+  } catch (err) {
+    for (const waiters of batch.values()) {
+      for (const w of waiters) w.reject(err);
+    }
+  }
+}
+
 export const api = {
   // Books
   listBooks: () => request<Book[]>("/api/books"),
@@ -244,8 +285,8 @@ export const api = {
       `/api/books/${bookId}/chapters?page=${page}&page_size=${pageSize}`,
     ),
   getAllBookChapters: async (bookId: string): Promise<PaginatedChapters> => {
-    // One request covers any real catalog (backend caps page_size at 10000),
-    // avoiding the N-1 parallel page fetches a 1000-cap triggered on big books.
+    // The backend clamps page_size to PostgREST's 1000-row cap and reports
+    // total_pages for the clamped size, so pages 2..N are fetched in parallel.
     const PAGE_SIZE = 10000;
     const first = await request<PaginatedChapters>(
       `/api/books/${bookId}/chapters?page=1&page_size=${PAGE_SIZE}`,
@@ -512,8 +553,15 @@ export const api = {
         updated_at: string;
       }>
     >("/api/progress/my-books"),
-  getBookProgress: (bookId: string) =>
-    request<UserProgress | null>(`/api/progress/book/${bookId}`),
+  // Batched with any other book's progress requested in the same tick.
+  getBookProgress: (bookId: string) => loadBookProgress(bookId),
+  // One request for many books' progress bars; books without progress are absent.
+  getBatchProgress: (bookIds: string[]) =>
+    request<UserProgress[]>("/api/progress/batch", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ book_ids: bookIds }),
+    }),
 
   // Settings
   getSettings: () =>